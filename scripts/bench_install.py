@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+"""
+Install pipeline benchmark harness
+
+Runs `install_talos` from install-talos-metal.py against local fake
+"rescue hosts" instead of real Hetzner machines:
+
+- one paramiko SSH server per host, executing commands in a sandbox root
+  (/dev and /tmp in commands are remapped into the sandbox)
+- fake /dev/disk/by-id symlinks and an `lsblk` stub backed by a disks.json
+- sparse-file disks, or real loop devices with --loop (needs root)
+- a local HTTP server that serves the Talos image (TALOS_FACTORY_URL)
+
+For each host it reports end-to-end install time, bytes on the wire,
+SSH round trips (exec requests) and disk write throughput.
+
+Usage:
+    uv run scripts/bench_install.py
+    uv run scripts/bench_install.py --hosts 4 --image-size 512
+    uv run scripts/bench_install.py --write-modes sync,direct,buffered,sparse
+    sudo uv run scripts/bench_install.py --loop --image ~/metal-amd64.iso
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import logging
+import os
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import paramiko
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(SCRIPTS_DIR))
+
+from ssh_engine import SSHEngine
+
+FAKE_SCHEMATIC = "0" * 64
+FAKE_VERSION = "v0.0.0-bench"
+
+# stand-ins for the rescue system tools that must not touch the local machine
+NOOP_TOOLS = ["mdadm", "vgchange", "sgdisk", "wipefs", "reboot"]
+
+# blkdiscard stand-in, so the sparse write mode pays for zeroing its range:
+# the real tool on loop devices, zeros written and synced on sparse-file disks
+BLKDISCARD_STUB = '''#!/usr/bin/env python3
+import os, shutil, stat, sys
+args = sys.argv[1:]
+target = os.path.realpath(args[-1])
+if stat.S_ISBLK(os.stat(target).st_mode):
+    own_dir = os.path.dirname(os.path.abspath(__file__))
+    path = os.pathsep.join(p for p in os.environ.get("PATH", "").split(os.pathsep) if os.path.abspath(p) != own_dir)
+    real = shutil.which("blkdiscard", path=path)
+    if real:
+        os.execv(real, [real] + args[:-1] + [target])
+offset = int(args[args.index("-o") + 1]) if "-o" in args else 0
+length = int(args[args.index("-l") + 1]) if "-l" in args else os.path.getsize(target) - offset
+chunk = bytes(4 * 1024 * 1024)
+with open(target, "r+b") as f:
+    f.seek(offset)
+    while length > 0:
+        length -= f.write(chunk[:min(length, len(chunk))])
+    f.flush()
+    os.fsync(f.fileno())
+'''
+
+LSBLK_STUB = '''#!/usr/bin/env python3
+# lsblk stand-in: prints the disks described in disks.json
+import json, os, sys
+disks = json.load(open(os.path.join(os.path.dirname(__file__), "..", "disks.json")))
+args = sys.argv[1:]
+flags = "".join(a[1:] for a in args if a.startswith("-") and not a.startswith("--"))
+columns = ["NAME", "SIZE", "TYPE"]
+if "-o" in args:
+    columns = args[args.index("-o") + 1].split(",")
+if "J" in flags:
+    print(json.dumps({"blockdevices": [{c.lower(): d.get(c.lower(), "") for c in columns} for d in disks]}))
+    sys.exit(0)
+if "n" not in flags:
+    print(" ".join(columns))
+for d in disks:
+    print(" ".join(str(d.get(c.lower(), "")) for c in columns))
+'''
+
+
+def load_installer():
+    """Import install-talos-metal.py (not importable by name because of the dashes)"""
+    spec = importlib.util.spec_from_file_location("install_talos_metal", SCRIPTS_DIR / "install-talos-metal.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class CountingSocket:
+    """Socket proxy that counts bytes sent and received (bytes on the wire)"""
+
+    def __init__(self, sock):
+        self._sock = sock
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def send(self, data):
+        n = self._sock.send(data)
+        self.bytes_sent += n
+        return n
+
+    def recv(self, size):
+        data = self._sock.recv(size)
+        self.bytes_received += len(data)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self._sock, name)
+
+
+class FakeRescueHost:
+    """A sandboxed fake rescue system: disks, by-id links, tool stubs"""
+
+    def __init__(self, root, disk_size_mb, disk_count=2, use_loop=False):
+        self.root = Path(root)
+        self.disk_size_mb = disk_size_mb
+        self.disk_count = disk_count
+        self.use_loop = use_loop
+        self.loop_devices = []
+
+    def setup(self):
+        dev = self.root / "dev"
+        (dev / "disk" / "by-id").mkdir(parents=True, exist_ok=True)
+        (self.root / "tmp").mkdir(exist_ok=True)
+        (self.root / "disks").mkdir(exist_ok=True)
+        bin_dir = self.root / "bin"
+        bin_dir.mkdir(exist_ok=True)
+        (dev / "null").symlink_to("/dev/null")
+
+        disks = []
+        for i in range(self.disk_count):
+            name = f"nvme{i}n1"
+            backing = self.root / "disks" / f"{name}.img"
+            with open(backing, "wb") as f:
+                f.truncate(self.disk_size_mb * 1024 * 1024)
+            if self.use_loop:
+                loop_dev = subprocess.run(["losetup", "--find", "--show", str(backing)],
+                                          capture_output=True, text=True, check=True).stdout.strip()
+                self.loop_devices.append(loop_dev)
+                (dev / name).symlink_to(loop_dev)
+            else:
+                (dev / name).symlink_to(backing)
+            serial = f"BENCH{i:04d}"
+            (dev / "disk" / "by-id" / f"nvme-BENCH_DISK_{serial}").symlink_to(f"../../{name}")
+            disks.append({
+                "serial": serial,
+                "name": name,
+                "size": f"{self.disk_size_mb}M",
+                "type": "disk",
+                "model": "BENCH_DISK",
+                "wwn": f"eui.{i:016x}",
+                "rota": "0",
+                "tran": "nvme",
+                "path": f"/dev/{name}",
+            })
+        with open(self.root / "disks.json", "w") as f:
+            json.dump(disks, f)
+
+        lsblk = bin_dir / "lsblk"
+        lsblk.write_text(LSBLK_STUB)
+        lsblk.chmod(0o755)
+        blkdiscard = bin_dir / "blkdiscard"
+        blkdiscard.write_text(BLKDISCARD_STUB)
+        blkdiscard.chmod(0o755)
+        for tool in NOOP_TOOLS:
+            stub = bin_dir / tool
+            stub.write_text("#!/bin/sh\nexit 0\n")
+            stub.chmod(0o755)
+
+    def teardown(self):
+        for loop_dev in self.loop_devices:
+            subprocess.run(["losetup", "-d", loop_dev], check=False)
+
+    def rewrite(self, cmd):
+        """Remap absolute /dev and /tmp paths into the sandbox"""
+        return re.sub(r'(?<![\w./])/(dev|tmp)\b', lambda m: f"{self.root}/{m.group(1)}", cmd)
+
+
+class FakeRescueServer(paramiko.ServerInterface):
+    """paramiko server that accepts any key and runs exec requests in the sandbox"""
+
+    def __init__(self, host, stats):
+        self.host = host
+        self.stats = stats
+
+    def get_allowed_auths(self, username):
+        return "publickey"
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        self.stats["round_trips"] += 1
+        threading.Thread(target=self._exec, args=(channel, command.decode()), daemon=True).start()
+        return True
+
+    def _exec(self, channel, command):
+        env = dict(os.environ)
+        env["PATH"] = f"{self.host.root / 'bin'}:{env.get('PATH', '/usr/bin:/bin')}"
+        started = time.monotonic()
+        proc = subprocess.Popen(["/bin/sh", "-c", self.host.rewrite(command)],
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+
+        def pump(stream, send):
+            for chunk in iter(lambda: stream.read1(4096), b""):
+                send(chunk)
+
+        pumps = [threading.Thread(target=pump, args=(proc.stdout, channel.sendall)),
+                 threading.Thread(target=pump, args=(proc.stderr, channel.sendall_stderr))]
+        for t in pumps:
+            t.start()
+        exit_code = proc.wait()
+        for t in pumps:
+            t.join()
+        duration = time.monotonic() - started
+        self.stats["commands"].append({"cmd": command, "exit_code": exit_code, "duration": duration})
+        channel.send_exit_status(exit_code)
+        channel.close()
+
+
+def serve_ssh(host, host_key, stats):
+    """Start an SSH server for one fake host, returns the listening port"""
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(5)
+
+    def accept_loop():
+        while True:
+            client, _ = listener.accept()
+            counting = CountingSocket(client)
+            stats["sockets"].append(counting)
+            transport = paramiko.Transport(counting)
+            transport.add_server_key(host_key)
+            transport.start_server(server=FakeRescueServer(host, stats))
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def serve_image(image_file, served):
+    """Serve the image under the Talos factory URL layout, returns the base URL"""
+    web_root = Path(tempfile.mkdtemp(prefix="bench-factory-"))
+    image_dir = web_root / "image" / FAKE_SCHEMATIC / FAKE_VERSION
+    image_dir.mkdir(parents=True)
+    (image_dir / "metal-amd64.iso").symlink_to(Path(image_file).resolve())
+
+    class QuietHandler(SimpleHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def copyfile(self, source, outputfile):
+            for chunk in iter(lambda: source.read(1024 * 1024), b""):
+                outputfile.write(chunk)
+                served["bytes"] += len(chunk)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(QuietHandler, directory=str(web_root)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}", server
+
+
+def make_image(path, size_mb):
+    """Write a synthetic image: random data with zero-filled stretches, like a real raw image"""
+    chunk = 1024 * 1024
+    with open(path, "wb") as f:
+        for i in range(size_mb):
+            f.write(os.urandom(chunk) if i % 4 != 3 else bytes(chunk))
+
+
+def bench_host(installer, port, key_file, stats, write_mode, ssh=None):
+    """Run install_talos against one fake host and collect its numbers"""
+    ssh = ssh or installer.SSHConnection("127.0.0.1", "root", key_file, port=port)
+    started = time.monotonic()
+    ssh.connect()
+    try:
+        installer.install_talos(ssh, FAKE_VERSION, FAKE_SCHEMATIC, write_mode=write_mode)
+    finally:
+        ssh.disconnect()
+    elapsed = time.monotonic() - started
+
+    # the sparse mode's zeroing (blkdiscard -z) is part of its write cost
+    write_cmds = [c for c in stats["commands"]
+                  if ("dd " in c["cmd"] and "of=/dev/" in c["cmd"]) or c["cmd"].startswith("blkdiscard ")]
+    write_seconds = sum(c["duration"] for c in write_cmds)
+    return {
+        "port": port,
+        "install_seconds": round(elapsed, 3),
+        "round_trips": stats["round_trips"],
+        "bytes_sent": sum(s.bytes_sent for s in stats["sockets"]),
+        "bytes_received": sum(s.bytes_received for s in stats["sockets"]),
+        "write_seconds": round(write_seconds, 3),
+        "slowest_commands": sorted(stats["commands"], key=lambda c: c["duration"], reverse=True)[:3],
+    }
+
+
+async def bench_on_engine(args, installer, ports, key_file, stats, write_mode):
+    """Same as the thread pool run, driven by SSHEngine with one pooled connection per host"""
+    engine = SSHEngine("root", key_file, max_concurrency=args.hosts)
+    targets = {f"127.0.0.1:{port}": i for i, port in enumerate(ports)}
+
+    def operation(target, client):
+        i = targets[target]
+        return bench_host(installer, ports[i], key_file, stats[i], write_mode,
+                          ssh=installer.PooledSSHConnection(target, client))
+
+    try:
+        sessions = await engine.run_sessions(list(targets), operation)
+    finally:
+        await engine.close()
+    for target, session in sessions.items():
+        if not session.ok:
+            raise RuntimeError(f"{target}: {session.error}")
+    return [session.value for session in sessions.values()]
+
+
+def bench_round(args, installer, round_dir, host_key, key_file, write_mode):
+    """Install onto --hosts fresh fake hosts concurrently, returns (wall seconds, per host results)"""
+    hosts, ports, stats = [], [], []
+    for i in range(args.hosts):
+        host = FakeRescueHost(round_dir / f"host{i + 1}", args.disk_size, use_loop=args.loop)
+        host.setup()
+        host_stats = {"round_trips": 0, "commands": [], "sockets": []}
+        hosts.append(host)
+        stats.append(host_stats)
+        ports.append(serve_ssh(host, host_key, host_stats))
+    print(f"✓ Started {args.hosts} fake rescue host(s), write mode '{write_mode}'")
+
+    started = time.monotonic()
+    try:
+        if args.engine == "asyncio":
+            results = asyncio.run(bench_on_engine(args, installer, ports, key_file, stats, write_mode))
+        else:
+            with ThreadPoolExecutor(max_workers=args.hosts) as pool:
+                results = list(pool.map(lambda i: bench_host(installer, ports[i], key_file, stats[i], write_mode),
+                                        range(args.hosts)))
+    finally:
+        for host in hosts:
+            host.teardown()
+    return time.monotonic() - started, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark install_talos against local fake rescue hosts')
+    parser.add_argument('--hosts', type=int, default=1, help='Number of concurrent fake hosts (default: 1)')
+    parser.add_argument('--image', help='Talos image to serve (default: generate a synthetic one)')
+    parser.add_argument('--image-size', type=int, default=256, help='Size in MB of the synthetic image (default: 256)')
+    parser.add_argument('--disk-size', type=int, default=1024, help='Size in MB of each fake disk (default: 1024)')
+    parser.add_argument('--loop', action='store_true', help='Back fake disks with loop devices (needs root)')
+    parser.add_argument('--write-modes', default='auto',
+                        help='Comma separated write modes to compare, e.g. sync,direct,buffered,sparse (default: auto)')
+    parser.add_argument('--engine', choices=['threads', 'asyncio'], default='threads',
+                        help='Drive the hosts with a thread each or with the asyncio SSH engine (default: threads)')
+    parser.add_argument('--workdir', help='Directory for sandboxes (default: temp dir; avoid tmpfs for direct I/O)')
+    parser.add_argument('--json', help='Write results to this JSON file')
+    args = parser.parse_args()
+
+    # client disconnects show up as paramiko "Socket exception" errors on the server side
+    logging.getLogger("paramiko").setLevel(logging.CRITICAL)
+
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="bench-install-"))
+    workdir.mkdir(parents=True, exist_ok=True)
+
+    image_file = args.image
+    if not image_file:
+        image_file = workdir / "metal-amd64.iso"
+        print(f"Generating {args.image_size}MB synthetic image {image_file}")
+        make_image(image_file, args.image_size)
+    image_size = os.path.getsize(image_file)
+
+    served = {"bytes": 0}
+    base_url, http_server = serve_image(image_file, served)
+    os.environ["TALOS_FACTORY_URL"] = base_url
+    installer = load_installer()
+    print(f"✓ Image served at {base_url}")
+
+    client_key = paramiko.RSAKey.generate(2048)
+    key_file = str(workdir / "client_key")
+    client_key.write_private_key_file(key_file)
+    host_key = paramiko.RSAKey.generate(2048)
+
+    rounds = {}
+    try:
+        for write_mode in args.write_modes.split(","):
+            rounds[write_mode] = bench_round(args, installer, workdir / write_mode, host_key, key_file, write_mode)
+    finally:
+        http_server.shutdown()
+
+    print("\n=== Benchmark results ===")
+    print(f"image: {image_size / 1e6:.1f} MB, hosts: {args.hosts}, "
+          f"image bytes served: {served['bytes'] / 1e6:.1f} MB")
+    for write_mode, (wall_seconds, results) in rounds.items():
+        print(f"write mode '{write_mode}': wall time {wall_seconds:.2f}s")
+        for i, r in enumerate(results):
+            r["write_mb_s"] = round(image_size / 1e6 / r["write_seconds"], 1) if r["write_seconds"] else None
+            print(f"  host{i + 1}: install {r['install_seconds']:.2f}s, "
+                  f"{r['round_trips']} round trips, "
+                  f"wire {r['bytes_sent'] / 1e3:.1f} kB out / {r['bytes_received'] / 1e3:.1f} kB in, "
+                  f"write {r['write_seconds']:.2f}s ({r['write_mb_s']} MB/s)")
+            for c in r["slowest_commands"]:
+                print(f"      {c['duration']:7.2f}s  {c['cmd']}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"image_bytes": image_size, "image_bytes_served": served["bytes"], "hosts": args.hosts,
+                       "rounds": {mode: {"wall_seconds": round(wall, 3), "results": results}
+                                  for mode, (wall, results) in rounds.items()}}, f, indent=2)
+        print(f"✓ Results written to {args.json}")
+
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+CLI startup benchmark for config.py
+
+Runs config.py invocations that do no real work (`--help`, `status`, `test`)
+in fresh interpreters, reports the median and best wall time per command
+and, with --importtime, the slowest imports of each (`python -X importtime`).
+
+Usage:
+    uv run scripts/bench_startup.py
+    uv run scripts/bench_startup.py -c config --runs 20 --importtime
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+CONFIG_PY = Path(__file__).resolve().parent / "config.py"
+
+# invocations that only parse arguments (and the cluster config for status)
+COMMANDS = [["--help"], ["status"], ["test"]]
+
+
+def time_command(command, runs):
+    """Wall times in ms of running command, a fresh interpreter each run"""
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append((time.perf_counter() - started) * 1000)
+    return times
+
+
+def slowest_imports(argv, top):
+    """(cumulative ms, module) of the top-level imports config.py pulls in, slowest first"""
+    result = subprocess.run([sys.executable, "-X", "importtime", str(CONFIG_PY)] + argv,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package"; only count top-level imports
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not name.startswith("  ") and name.strip():
+            imports.append((int(cumulative) / 1000, name.strip()))
+    return sorted(imports, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure config.py startup time')
+    parser.add_argument('-c', '--config-dir', default='config', help='Config dir for status (default: config)')
+    parser.add_argument('--runs', type=int, default=10, help='Runs per command (default: 10)')
+    parser.add_argument('--importtime', action='store_true', help='Also list the slowest imports per command')
+    parser.add_argument('--top', type=int, default=8, help='Imports listed with --importtime (default: 8)')
+    parser.add_argument('--budget', type=float, default=100, help='Median ms a command should stay under (default: 100)')
+    args = parser.parse_args()
+
+    # a bare interpreter, to tell our share of the startup from Python's own
+    baseline = statistics.median(time_command([sys.executable, "-c", "pass"], args.runs))
+    print(f"interpreter startup: {baseline:.0f}ms median")
+
+    over_budget = False
+    for command in COMMANDS:
+        argv = ["-c", args.config_dir] + command if command[0] == "status" else command
+        times = time_command([sys.executable, str(CONFIG_PY)] + argv, args.runs)
+        median = statistics.median(times)
+        mark = "✓" if median < args.budget else "✗"
+        over_budget |= median >= args.budget
+        print(f"{mark} {' '.join(command):8} median {median:5.0f}ms  best {min(times):5.0f}ms  "
+              f"(+{median - baseline:.0f}ms over a bare interpreter)")
+        if args.importtime:
+            for ms, name in slowest_imports(argv, args.top):
+                print(f"    {ms:6.1f}ms  {name}")
+    return 1 if over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,32 +8,24 @@ import argparse
 import sys
 import os
 import json
-import hashlib
-from datetime import datetime
-from pathlib import Path
-import shutil
-
-
-import subprocess
-from pathlib import Path
-from jinja2 import Template, StrictUndefined
-import yaml
-import ipaddress
-
-import requests
-import json
 import re
-from dotenv import load_dotenv
-import hashlib
 import time
+from pathlib import Path
 
-from hetzner_robot import HetznerRobotAPI
+# heavier dependencies (jinja2, yaml, requests, dotenv, hetzner_robot, subprocess, thread pools,
+# the tuning and sizing helpers, ...) are imported in the functions that use them, so each
+# subcommand only pays for what it needs
+import metrics
+from tracing import span, traced_run, traced_write_file, print_summary, write_trace
 
 config_folders = {}
 template_folders = {}
+# parsed cluster_config.yaml (plus state.yaml overrides), None for commands that need no config
+cluster_config = None
 
 
 def initialize_config_file(source, destination):
+    import shutil
 
     # print(f"? {source}    -> {destination}")
 
@@ -63,10 +55,10 @@ def initialize_config(args):
     initialize_talos_secrets()
 
 
-    with open('config/.gitignore', 'w') as f:
-        f.write('secrets')
+    with open(config_folders['config_dir'] / '.gitignore', 'w') as f:
+        f.write('secrets\nstate.yaml.lock\n')
 
-    print("You might want to handle `./config` as a distinct git repo")
+    print(f"You might want to handle `{config_folders['config_dir']}` as a distinct git repo")
     print("You should now edit the configs files:")
     print(config_folders['cluster_config_file'])
     print(config_folders['cluster_nodes_index_file'])
@@ -77,31 +69,105 @@ def initialize_config(args):
 
 def render_config(args):
     print("render")
+    started = time.monotonic()
 
-    context=cluster_config
-    
-    # read and render all Jinja template files in patches dir
-    rendered_patches_list = render_termplate_folder(template_folders['patches_dir'], config_folders['patches_dir'], context)
-    rendered_patches_list_controlplane = render_termplate_folder(template_folders['patches_controlplane_dir'], config_folders['patches_controlplane_dir'], context)
-    rendered_patches_list_worker = render_termplate_folder(template_folders['patches_worker_dir'], config_folders['patches_worker_dir'], context)
-
-    print(rendered_patches_list)
-    print(rendered_patches_list_controlplane)
-    print(rendered_patches_list_worker)
+    rendered_patches_list, rendered_patches_list_controlplane, rendered_patches_list_worker = render_patches()
 
     cluster_worker_nodes = render_node_template_files()
+    render_cilium_values()
 
 
     generate_talos_config_controlplane(rendered_patches_list, rendered_patches_list_controlplane)
     generate_talos_config_talosconfig()
     generate_talos_config_workernodes(rendered_patches_list, rendered_patches_list_worker, cluster_worker_nodes)
 
-
+    metrics.observe("render_duration_seconds", time.monotonic() - started)
 
     return 0
 
 
+KUBEPRISM_PORT = 7445
+
+
+def network_profile():
+    """Networking settings shared by the node template, the patches and the Cilium values,
+    with defaults for keys missing from cluster.networking"""
+    import ipaddress
+    networking = cluster_config['cluster']['networking']
+    profile = {
+        'vswitch-mtu': 1400,                    # Hetzner vSwitch limit
+        'pod-cidr': "10.244.0.0/16",
+        'service-cidr': "10.96.0.0/12",
+        # the control plane VMs and the metal workers don't share an L2, native routing needs extra routes
+        'routing-mode': "tunnel",
+        # KubePrism: Talos' API server load balancer on every node, no single address to lose
+        'k8s-service-host': "localhost",
+        'k8s-service-port': None,
+    }
+    profile.update({key: networking[key] for key in profile if networking.get(key) is not None})
+    profile['kubeprism'] = profile['k8s-service-host'] in ("localhost", "127.0.0.1")
+    if profile['k8s-service-port'] is None:
+        profile['k8s-service-port'] = KUBEPRISM_PORT if profile['kubeprism'] else 6443
+    profile['metal-prefix'] = ipaddress.ip_network(networking['subnet-metal']).prefixlen
+    return profile
+
+
+def cp_sizing():
+    """Control plane tier for the planned scale (cluster.scale), see cp_sizing.py"""
+    from cp_sizing import control_plane_sizing
+    nodes_index = load_yaml_file(config_folders['cluster_nodes_index_file']).get('index') or {}
+    return control_plane_sizing(cluster_config['cluster'].get('scale'), len(nodes_index))
+
+
+def render_cilium_values():
+    """Render the Helm values for Cilium (kube-proxy replacement, routing, MTU) to config/cilium/values.yaml"""
+    config_folders['cilium_dir'].mkdir(parents=True, exist_ok=True)
+    output_path = config_folders['cilium_dir'] / "values.yaml"
+    network = network_profile()
+    if network['routing-mode'] == 'native':
+        print(f"⚠ Warning: native routing only reaches nodes on one L2; pod traffic between the control plane VMs "
+              f"and the metal workers needs routes for {network['pod-cidr']} in the HCloud network, "
+              f"or routing-mode: tunnel")
+    render_template_file(template_folders['cilium_dir'] / "values.yaml.j2", output_path,
+                         cluster_config | {'network': network})
+    print(f"Rendered Cilium values -> {output_path}")
+
+
+def registry_mirrors():
+    """{upstream registry: endpoint} of the pull-through cache from cluster_config registries, empty when off"""
+    from registry_cache import mirror_endpoints
+    mirrors = mirror_endpoints(cluster_config.get('registries'), worker_private_ip)
+    if mirrors:
+        print(f"Registry mirrors: {', '.join(mirrors)} -> {next(iter(mirrors.values())).rsplit('/v2/', 1)[0]}")
+    return mirrors
+
+
+def render_patches():
+    """Render the common, controlplane and worker patch folders.
+    Returns the lists of rendered patch files for each."""
+
+    sizing = cp_sizing()
+    print(f"Control plane tier {sizing['name']} for {sizing['planned-workers']} workers / {sizing['planned-pods']} pods: "
+          f"{sizing['server-type']}, etcd quota {sizing['quota-backend-bytes'] // 1024**3}GiB, "
+          f"max-requests-inflight {sizing['max-requests-inflight']}")
+    context = cluster_config | {'network': network_profile(), 'cp_sizing': sizing,
+                                'registries': cluster_config.get('registries') or {},
+                                'registry_mirrors': registry_mirrors()}
+    
+    # read and render all Jinja template files in patches dir
+    rendered_patches_list = render_termplate_folder(template_folders['patches_dir'], config_folders['patches_dir'], context)
+    rendered_patches_list_controlplane = render_termplate_folder(template_folders['patches_controlplane_dir'], config_folders['patches_controlplane_dir'], context)
+    rendered_patches_list_worker = render_termplate_folder(template_folders['patches_worker_dir'], config_folders['patches_worker_dir'], context)
+
+    print(rendered_patches_list)
+    print(rendered_patches_list_controlplane)
+    print(rendered_patches_list_worker)
+
+    return rendered_patches_list, rendered_patches_list_controlplane, rendered_patches_list_worker
+
+
 def generate_talos_config_controlplane(rendered_patches_list, rendered_patches_list_controlplane):
+    import subprocess
 
         # ------------ ControlPlane config-----------
     cp_command= ["talosctl", "gen", "config",
@@ -127,7 +193,7 @@ def generate_talos_config_controlplane(rendered_patches_list, rendered_patches_l
 
     try:
         # print(' \\\n  '.join(cp_command))
-        result_cp = subprocess.run(cp_command, capture_output=False, text=True)
+        result_cp = traced_run(cp_command, capture_output=False, text=True)
         print(f"Command output for controlplane: {result_cp.stdout}")
         print(f"Command output for controlplane: {result_cp.stderr}")
         print("ok")
@@ -140,6 +206,7 @@ def generate_talos_config_controlplane(rendered_patches_list, rendered_patches_l
 
 
 def generate_talos_config_talosconfig():
+    import subprocess
      # ---- generate talosconfig file ---------
     command_talosconfig= ["talosctl", "gen", "config",
         "--output", f"{config_folders['talosconfig_file']}",
@@ -151,7 +218,7 @@ def generate_talos_config_talosconfig():
     
     try:
         # print(' \\\n  '.join(command_talosconfig))
-        result_talosconfig = subprocess.run(command_talosconfig, capture_output=True, text=True)
+        result_talosconfig = traced_run(command_talosconfig, capture_output=True, text=True)
         print(f"Command output for talosconfig: {result_talosconfig.stdout}")
         print(f"Command output for talosconfig: {result_talosconfig.stderr}")
         print("ok")
@@ -174,44 +241,7 @@ def strip_hostname_config_document(file_path):
 def generate_talos_config_workernodes(rendered_patches_list, rendered_patches_list_worker, cluster_worker_nodes):
 
     for node in cluster_worker_nodes:
-
-        command_workernodes= ["talosctl", "gen", "config",
-            # "--with-examples=false", "--with-docs=false",
-            "--output", f"{config_folders['secrets_nodes_dir']}/{node['config_file']}",
-            "--output-types", "worker",
-            "--kubernetes-version", "1.35.2",
-            "--with-secrets", f"{config_folders['secrets_file']}"
-            ]
-        
-        for patch_file in rendered_patches_list:
-            command_workernodes.append("--config-patch")
-            command_workernodes.append(f"@{config_folders['patches_dir']}/{patch_file}")
-        
-        for patch_file in rendered_patches_list_worker:
-            command_workernodes.append("--config-patch")
-            command_workernodes.append(f"@{config_folders['patches_worker_dir']}/{patch_file}")                          
-        
-        command_workernodes.append("--config-patch")
-        command_workernodes.append(f"@{config_folders['nodes_dir']}/{node['config_file']}") 
-        command_workernodes.append(cluster_config['cluster']['name']) 
-        command_workernodes.append(cluster_config['cluster']['endpoint'])
-        command_workernodes.append("--force")
-        
-
-        try:
-            # print(' \\\n  '.join(command_workernodes))
-            result_cp = subprocess.run(command_workernodes, capture_output=True, text=True)
-            print(f"Command output for worker node {node['name']}: {result_cp.stdout}")
-            # print(result_cp)
-            
-            if (result_cp.returncode):
-                print(f"Command output for worker node {node['name']}: {result_cp.stderr}")
-                exit(1)
-
-        except subprocess.SubprocessError as e:
-            print(f"Error running command for {node}: {e}")
-        except Exception as e:
-            print(("{e}"))
+        generate_talos_config_workernode(rendered_patches_list, rendered_patches_list_worker, node)
 
 
     for node in cluster_worker_nodes:
@@ -219,6 +249,50 @@ def generate_talos_config_workernodes(rendered_patches_list, rendered_patches_li
         print(f"talosctl apply-config  --talosconfig {config_folders['talosconfig_file']} --nodes {node['public_ip']} -e {node['public_ip']}  --file {config_folders['secrets_nodes_dir']}/{node['config_file']} --insecure")
 
 
+def generate_talos_config_workernode(rendered_patches_list, rendered_patches_list_worker, node):
+    import subprocess
+
+    command_workernodes= ["talosctl", "gen", "config",
+        # "--with-examples=false", "--with-docs=false",
+        "--output", f"{config_folders['secrets_nodes_dir']}/{node['config_file']}",
+        "--output-types", "worker",
+        "--kubernetes-version", "1.35.2",
+        "--with-secrets", f"{config_folders['secrets_file']}"
+        ]
+    
+    for patch_file in rendered_patches_list:
+        command_workernodes.append("--config-patch")
+        command_workernodes.append(f"@{config_folders['patches_dir']}/{patch_file}")
+    
+    for patch_file in rendered_patches_list_worker:
+        command_workernodes.append("--config-patch")
+        command_workernodes.append(f"@{config_folders['patches_worker_dir']}/{patch_file}")                          
+    
+    command_workernodes.append("--config-patch")
+    command_workernodes.append(f"@{config_folders['nodes_dir']}/{node['config_file']}") 
+    command_workernodes.append("--config-patch")
+    command_workernodes.append(f"@{config_folders['nodes_dir']}/{node['tuning_file']}")
+    command_workernodes.append(cluster_config['cluster']['name']) 
+    command_workernodes.append(cluster_config['cluster']['endpoint'])
+    command_workernodes.append("--force")
+    
+
+    try:
+        # print(' \\\n  '.join(command_workernodes))
+        result_cp = traced_run(command_workernodes, capture_output=True, text=True)
+        print(f"Command output for worker node {node['name']}: {result_cp.stdout}")
+        # print(result_cp)
+        
+        if (result_cp.returncode):
+            print(f"Command output for worker node {node['name']}: {result_cp.stderr}")
+            exit(1)
+
+    except subprocess.SubprocessError as e:
+        print(f"Error running command for {node}: {e}")
+    except Exception as e:
+        print(("{e}"))
+
+
 
 
 def get_node_index(ip):
@@ -230,66 +304,145 @@ def get_node_index(ip):
     # print(nodes)
     return nodes[ip]
 
+def worker_private_ip(node_index):
+    """Private (vSwitch) IP of metal worker node_index: the 100th + index host of subnet-metal"""
+    import ipaddress
+    import itertools
+    cluster_private_cidr_workers = ipaddress.ip_network(cluster_config['cluster']['networking']['subnet-metal'])
+    return str(next(itertools.islice(cluster_private_cidr_workers.hosts(), 99 + node_index, None)))
+
+
 def render_node_template_files():
 ### renders all node files
 ### for each node file reads context from it's corresponding discovery file
 
+    node_template = load_node_template()
+
+    # Find and read all files in discovery directory
+    cluster_worker_nodes = []
+    if config_folders['discovery_dir'].exists():
+        for file_path in sorted(config_folders['discovery_dir'].iterdir()):
+            if file_path.is_file():
+                cluster_worker_nodes.append(render_node_template_file(file_path, node_template))
+    return cluster_worker_nodes
+
+
+def load_node_template(template_name="node_template.yaml.j2"):
+    from jinja2 import Template, StrictUndefined
     # ------------- render worker node config ----------------
     # read and render node template file
-    node_template_file = template_folders["nodes_dir"] / "node_template.yaml.j2"
+    node_template_file = template_folders["nodes_dir"] / template_name
     print(f"reading {node_template_file}")
     with open(node_template_file, "r") as f:
         node_template_content = f.read()
-    node_template = Template(node_template_content, undefined=StrictUndefined)
+    return Template(node_template_content, undefined=StrictUndefined)
+
+
+def render_node_template_file(file_path, node_template):
+    """Render the node file of one worker from its discovery file.
+    Returns the node entry (name, ips, config file name)."""
+    import ipaddress
 
      # ------ prepare some variables needed for rendering node ----------------
-    cluster_private_cidr=ipaddress.ip_network(cluster_config['cluster']['networking']['private-node-cidr'])
-    
     cluster_private_cidr_workers=ipaddress.ip_network(cluster_config['cluster']['networking']['subnet-metal'])
-    cluster_private_cidr_controlplane=ipaddress.ip_network(cluster_config['cluster']['networking']['subnet-virtual'])
     ip_list_workers = list(cluster_private_cidr_workers.hosts())  # Only usable hosts (excludes network/broadcast)
-    # ip_list_controlplane = list(cluster_private_cidr_controlplane.hosts())  # Only usable hosts (excludes network/broadcast)
     gateway_workers = ip_list_workers[0]
 
-
-
-    # Find and read all files in discovery directory
-    cluster_worker_nodes = []
-    discovery_files = {}
-    if config_folders['discovery_dir'].exists():
-        for file_path in sorted(config_folders['discovery_dir'].iterdir()):
-            if file_path.is_file():
-                # extract the filename without extension 
-                ip = file_path.stem
-
-                # read node index from config
-                node_index = get_node_index(ip)
-                print(f"index of {ip} -> {node_index} --------------")
-                content = load_yaml_file(file_path)
-
-                discovery_files[ip] = content
-                content['node_private_ip']= str(ip_list_workers[99+node_index])
-                content['node_public_ip']= file_path.stem
-                content['node_public_network'] = str(ipaddress.ip_network(content['node_public_ip'] + "/29", strict=False))
-                content['node_name'] = f"{cluster_config['cluster']['name']}-{node_index}"
-                content['gateway_workers']=gateway_workers
-
-                node_config = cluster_config | content 
-                print(node_config)
-                rendered_node_content = node_template.render(node_config)
-                # print(rendered_node_content)
-                local_config_file_name = f"w{node_index}.yaml"
-                output_path = config_folders['nodes_dir'] / local_config_file_name
-                with open(output_path, "w") as out_f:
-                    out_f.write(rendered_node_content)
-                print(f"Rendered node {node_index} -> {output_path}")
-                cluster_worker_nodes.append({
-                    "name": content['node_name'],
-                    "public_ip": content['node_public_ip'],
-                    "private_ip": content['node_private_ip'],
-                    "config_file": local_config_file_name}
-                    )
-    return cluster_worker_nodes
+    # extract the filename without extension 
+    ip = file_path.stem
+
+    # read node index from config
+    node_index = get_node_index(ip)
+    print(f"index of {ip} -> {node_index} --------------")
+    content = load_yaml_file(file_path)
+
+    content['node_private_ip']= worker_private_ip(node_index)
+    content['node_public_ip']= file_path.stem
+    content['node_public_network'] = str(ipaddress.ip_network(content['node_public_ip'] + "/29", strict=False))
+    content['node_name'] = f"{cluster_config['cluster']['name']}-{node_index}"
+    content['gateway_workers']=gateway_workers
+    content.update(data_disk_context(content))
+    content['network'] = network_profile()
+
+    node_config = cluster_config | content 
+    print(node_config)
+    with span(f"render node {node_index}", kind="render", node=ip):
+        rendered_node_content = node_template.render(node_config)
+    # print(rendered_node_content)
+    local_config_file_name = f"w{node_index}.yaml"
+    output_path = config_folders['nodes_dir'] / local_config_file_name
+    traced_write_file(output_path, rendered_node_content)
+    print(f"Rendered node {node_index} -> {output_path}")
+
+    tuning_file_name = render_node_tuning_file(node_index, content.get('hardware'))
+    return {
+        "name": content['node_name'],
+        "public_ip": content['node_public_ip'],
+        "private_ip": content['node_private_ip'],
+        "config_file": local_config_file_name,
+        "tuning_file": tuning_file_name}
+
+
+def talos_version_at_least(version, minimum):
+    """Compare Talos versions like v1.11.2 >= v1.10"""
+    parse = lambda v: tuple(int(part) for part in re.findall(r'\d+', v)[:3])
+    return parse(version) >= parse(minimum)
+
+
+def data_disk_context(content):
+    """Template variables for the node's data disks: DATA_DISKS, data_disk_layout and the Longhorn disk list.
+
+    Layouts (storage.data-disk-layout in cluster_config.yaml):
+    - disks:   one machine.disks partition per data disk (any Talos version)
+    - volumes: one UserVolumeConfig per data disk (Talos v1.10+)
+    - stripe:  Talos has no RAID/LVM to stripe disks, so it is rendered as volumes; Longhorn
+               then spreads replicas over all disks instead of striping inside one volume
+    Every layout mounts disk N at /var/mnt/disk<N>, which is also the Longhorn disk path.
+    """
+    data_disks = content.get('DATA_DISKS')
+    if data_disks is None:
+        # discovery files written before DATA_DISKS existed only know the second disk
+        data_disks = []
+        if content.get('SECONDARY_DISK'):
+            secondary = next((d for d in content.get('disks', []) if d.get('role') == 'secondary'), {})
+            data_disks.append({'name': "disk2", 'device': content['SECONDARY_DISK'],
+                               'serial': secondary.get('serial', ''), 'mountpoint': "/var/mnt/disk2"})
+
+    layout = cluster_config.get('storage', {}).get('data-disk-layout', 'disks')
+    if layout == 'stripe':
+        print("⚠ Warning: Talos cannot stripe disks (no RAID/LVM), using one volume per disk")
+        layout = 'volumes'
+    if layout == 'volumes' and not talos_version_at_least(cluster_config['talos']['version'], "v1.10"):
+        print(f"⚠ Warning: user volumes need Talos v1.10+, using per-disk partitions on {cluster_config['talos']['version']}")
+        layout = 'disks'
+
+    longhorn_disks = [{"path": disk['mountpoint'], "allowScheduling": True, "tags": ["data"]} for disk in data_disks]
+    return {
+        'DATA_DISKS': data_disks,
+        'data_disk_layout': layout,
+        'longhorn_disks_config': json.dumps(longhorn_disks, separators=(',', ':')),
+    }
+
+
+def render_node_tuning_file(node_index, hardware):
+    """Render w<N>-tuning.yaml with the kubelet and kernel tuning for the node's hardware and pool"""
+    from worker_tuning import cpu_manager_policy, node_pool, worker_tuning
+    pool = node_pool(load_yaml_file(config_folders['cluster_nodes_index_file']), node_index)
+    tuning = worker_tuning(hardware, cluster_config.get('worker-tuning'), pool)
+    print(f"Tuning node {node_index} (pool: {pool or '-'}, profile: {(hardware or {}).get('profile', '-')}): "
+          f"max-pods {tuning['max-pods']}, hugepages {tuning['hugepages']}, cpu manager {tuning['cpu-manager']}")
+
+    with span(f"render tuning {node_index}", kind="render"):
+        rendered = load_node_template("node_tuning.yaml.j2").render(tuning=tuning)
+    tuning_file_name = f"w{node_index}-tuning.yaml"
+    tuning_file = config_folders['nodes_dir'] / tuning_file_name
+    if tuning_file.exists():
+        previous = cpu_manager_policy(load_yaml_file(tuning_file))
+        if previous != tuning['cpu-manager']:
+            print(f"⚠ Warning: w{node_index} CPU manager policy changes {previous} -> {tuning['cpu-manager']}; "
+                  f"a joined node needs a kubelet state reset (see `diff`)")
+    traced_write_file(tuning_file, rendered)
+    return tuning_file_name
 
 # renders each file in folder
 # returns a list of rendered files
@@ -299,19 +452,27 @@ def render_termplate_folder(template_folder, output_folder, context):
     for template_file in template_folder.glob("*.j2"):
         print(f"Rendering {template_file.name}")
         output_path = output_folder / template_file.stem
-        render_template_file(template_file, output_path, context)
+        if not render_template_file(template_file, output_path, context):
+            # optional patches (e.g. registry mirrors when no cache is configured) render to nothing
+            output_path.unlink(missing_ok=True)
+            print(f"Skipped {template_file.name}, nothing to patch")
+            continue
         rendered_files_list.append( f"{template_file.stem}")
         print(f"Rendered {template_file.name} -> {output_path}")
     return rendered_files_list
 
 def render_template_file(template_file, output_path, context):
+    from jinja2 import Template, StrictUndefined
+    with span(f"render {template_file.name}", kind="render"):
         with open(template_file, "r") as f:
             template_content = f.read()
         template = Template(template_content, undefined=StrictUndefined)
         rendered = template.render(context)
+        if not rendered.strip():
+            return False
         # output_path = rendered_patches_dir / f"{template_file.stem}"
-        with open(output_path, "w") as out_f:
-            out_f.write(rendered)
+        traced_write_file(output_path, rendered)
+        return True
 
 
 
@@ -323,6 +484,8 @@ def get_folder_names(config_dir):
     paths['discovery_dir'] = config_dir / "discovery"
     paths['secrets_dir'] = config_dir / "secrets"
     paths['talos_dir'] = config_dir / 'talos'
+    paths['logs_dir'] = config_dir / 'logs'
+    paths['cilium_dir'] = config_dir / 'cilium'
 
     paths['secrets_nodes_dir'] = paths['secrets_dir'] / 'nodes'
 
@@ -335,21 +498,47 @@ def get_folder_names(config_dir):
     paths['cluster_config_file'] = config_dir / 'cluster_config.yaml'
     paths['cluster_nodes_index_file'] = config_dir / 'cluster_nodes_index.yaml'
     paths['schematic_file'] = config_dir / 'talos' / 'schematic.yaml'
+    paths['state_file'] = config_dir / 'state.yaml'
 
     paths['secrets_file'] = paths['secrets_dir'] / 'secrets.yaml'
     paths['talosconfig_file'] = paths['secrets_dir'] /'talosconfig.yaml'
     return paths
 
 
+def machine_state():
+    """Store for the values the scripts manage, see state_store.py"""
+    from state_store import StateStore
+    return StateStore(config_folders['state_file'])
+
+
+def record_state(section, values):
+    """Save values the scripts manage (ids, IPs) for a cluster_config section and apply them to cluster_config"""
+    from state_store import deep_merge
+    global cluster_config
+    machine_state().update({'config': {section: values}, 'config-updated': time.time()})
+    cluster_config = deep_merge(cluster_config, {section: values})
+    for key, value in values.items():
+        print(f"✓ {section}.{key} = {value} (saved in {config_folders['state_file']})")
+
+
+def load_cluster_config():
+    """cluster_config.yaml with the values from state.yaml applied"""
+    from state_store import deep_merge
+    return deep_merge(load_yaml_file(config_folders['cluster_config_file']), machine_state().config_overrides())
+
+
 def load_yaml_file(file_path):
+    import yaml
 
     result = {}
     if file_path.is_file():
         with open( file_path, 'r') as f:
-            result = yaml.safe_load(f)
+            # libyaml's C loader is several times faster on large discovery/config files
+            result = yaml.load(f, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
     return result
 
 def save_schematic_id(args):
+    import requests
 
     # print(f"called with params {args}")
     global cluster_config
@@ -361,39 +550,30 @@ def save_schematic_id(args):
     with open(config_folders['schematic_file'], 'rb') as f:
         schematic_data = f.read()
 
-    response = requests.post('https://factory.talos.dev/schematics', data=schematic_data )        
-
+    # TALOS_FACTORY_URL points at a mirror or the fixtures server (http_fixtures.py)
+    factory_url = os.getenv('TALOS_FACTORY_URL', 'https://factory.talos.dev')
+    with span("POST /schematics", kind="http", url=f'{factory_url}/schematics') as s:
+        response = requests.post(f'{factory_url}/schematics', data=schematic_data )
+        s.exit_status = response.status_code
+        s.add_bytes(len(schematic_data) + len(response.content))
 
     response.raise_for_status()  # Raise an error if the request failed
     schematic_id = response.json()['id']
 
     print (f"schamatic id: {schematic_id}")
 
-    cluster_config['talos']['schematicId']=schematic_id
-    # print(format_yaml(cluster_config))
-
-
-    # update cluster_config file with new schematic id
-    with open(config_folders['cluster_config_file'], "r") as f:
-        content = f.read()
-    content = re.sub(r'schematicId:\s*.*', f'schematicId: {schematic_id}', content)
-
-
-    with open(config_folders['cluster_config_file'], "w") as f:
-        f.write(content)
-
-    cluster_config=load_yaml_file(config_folders['cluster_config_file'])        
-    print('Updated cluster config:')
-    print(format_yaml(cluster_config))
+    record_state('talos', {'schematicId': schematic_id})
 
 
 def format_yaml(arg):
+    import yaml
     return yaml.dump(arg, default_flow_style=False)
 
 def format_json(arg):
     return json.dumps(arg, indent=2, sort_keys=True)
 
 def initialize_talos_secrets():
+    import subprocess
 
     # -------------Initialize Secrets if needed------------------
     secrets_path = config_folders['secrets_file']
@@ -405,7 +585,7 @@ def initialize_talos_secrets():
         try:
             print(f"Initializing Talos secrets...")
             print(secrets_command)
-            result = subprocess.run(secrets_command, capture_output=True, text=True)
+            result = traced_run(secrets_command, capture_output=True, text=True)
             print(result)
             print(result.stdout.strip())
             if (result.returncode):
@@ -416,9 +596,22 @@ def initialize_talos_secrets():
         except subprocess.SubprocessError as e:
             print(f"Error running command for {filename}: {e}")
 
-def upload_hcloud_image(args):
+# kernel args of the metal schematic that must not end up in the CP snapshot: a CP VM booting
+# with talos.config= fetches a worker config from serve-configs
+METAL_ONLY_KERNEL_ARGS = ('talos.config=',)
 
-    global cluster_config
+
+def metal_only_kernel_args():
+    """extraKernelArgs of config/talos/schematic.yaml that only make sense on the metal workers"""
+    schematic = load_yaml_file(config_folders['schematic_file']) or {}
+    kernel_args = (schematic.get('customization') or {}).get('extraKernelArgs') or []
+    return [arg for arg in kernel_args if str(arg).startswith(METAL_ONLY_KERNEL_ARGS)]
+
+
+def upload_hcloud_image(args):
+    """Use the registry snapshot for the schematic, Talos version and arch, building it only
+    when no cluster in the HCloud project has yet; see hcloud_images.py"""
+    import hcloud_images
 
     hcloud_token = os.getenv("HCLOUD_TOKEN")
 
@@ -427,101 +620,74 @@ def upload_hcloud_image(args):
         print("Please set it with: export HCLOUD_TOKEN=your_token_here", file=sys.stderr)
         sys.exit(1)
 
-    talos_image_arch = "amd64"
-    hcloud_server_arch = "x86"
-
-    # Read Talos version from config file
     talos_version = cluster_config["talos"]["version"]
-    talos_schematic_id = cluster_config['talos']['schematicId']
-
-    print(f"Preparing Talos image hcloud-{talos_image_arch} {talos_version} for schematic ID {talos_schematic_id}")
-
-    # Create storage directory
-    os.makedirs("storage", exist_ok=True)
-
-    OUTPUT_FILE = f"storage/hcloud-{talos_image_arch}-{talos_version}.raw.xz"
-    SCHEMATIC_ID= "376567988ad370138ad8b2698212367b8edcb69b5fd68c80be1f2ec7d603b4ba"
-    DOWNLOAD_URL = f"https://factory.talos.dev/image/{SCHEMATIC_ID}/{talos_version}/hcloud-{talos_image_arch}.raw.xz"
-    SCHEMATIC_HASH = hashlib.md5(SCHEMATIC_ID.encode()).hexdigest()
-    LABEL = f"open-talos-builer/v={SCHEMATIC_HASH}-{talos_version}"
-    print(LABEL)
-
-    # check if the image exists already
-    # 
-    # Retrieve the snapshot id
-    result = subprocess.run(
-        ["hcloud", "image", "list", "--type", "snapshot", "-l", LABEL, "-o", "json"],
-        capture_output=True,
-        text=True,
-        check=True
-    )
-    images = json.loads(result.stdout)
-    print(images)
-    if len(images)>0:
-        HCLOUD_TALOS_IMAGE_ID = images[0]["id"] 
-        print(f"found image already in HCloud, id={HCLOUD_TALOS_IMAGE_ID}")
-
-    else:
-
-        # Download image if it doesn't exist
-        if not os.path.isfile(OUTPUT_FILE):
-            print(f"wget {DOWNLOAD_URL} -O {OUTPUT_FILE}")
-            subprocess.run(["wget", DOWNLOAD_URL, "-O", OUTPUT_FILE], check=True)
-        else:
-            print(f"found {OUTPUT_FILE}, will not re-download")
-
-        # # Original Docker-based upload (disabled while fsn1 is unavailable)
-        # print("Running Docker hcloud-upload-image:latest")
-        # subprocess.run([
-        #     "docker", "run", "--rm",
-        #     "-e", f"HCLOUD_TOKEN={hcloud_token}",
-        #     "-v", f"{os.getcwd()}/{OUTPUT_FILE}:/image.xz",
-        #     "ghcr.io/apricote/hcloud-upload-image:latest", "upload",
-        #     "--image-path", "/image.xz",
-        #     "--architecture", hcloud_server_arch,
-        #     "--compression", "xz",
-        #     "--labels", LABEL
-        # ], check=True)
-
-        # Run local binary (patched to default to nbg1)
-        print("Running local hcloud-upload-image binary")
-        hcloud_upload_bin = str(Path(__file__).resolve().parent.parent.parent / "hcloud-upload-image" / "hcloud-upload-image")
-        env = os.environ.copy()
-        env["HCLOUD_TOKEN"] = hcloud_token
-        subprocess.run([
-            hcloud_upload_bin, "upload",
-            "--image-path", f"{os.getcwd()}/{OUTPUT_FILE}",
-            "--architecture", hcloud_server_arch,
-            "--compression", "xz",
-            "--labels", LABEL
-        ], env=env, check=True)
-
-        # Retrieve the snapshot id
-        result = subprocess.run(
-            ["hcloud", "image", "list", "--type", "snapshot", "-l", LABEL, "-o", "json"],
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        images = json.loads(result.stdout)
-        HCLOUD_TALOS_IMAGE_ID = images[0]["id"]
-
-    # update cluster_config file with new image id
-    with open(config_folders['cluster_config_file'], "r") as f:
-        content = f.read()
-    # content = re.sub(r'hcloud-image-id:\s*.* ', f'hcloud-image-id: {HCLOUD_TALOS_IMAGE_ID}', content)
-    content = re.sub(r'(hcloud-image-id:)\s+\S+(\s+#.*)$', rf'\1       {HCLOUD_TALOS_IMAGE_ID}\2  ', content, flags=re.MULTILINE)
-
-
-    with open(config_folders['cluster_config_file'], "w") as f:
-        f.write(content)
+    # the CP image may use its own schematic (e.g. without the metal extensions)
+    schematic_id = cluster_config['hetzner'].get('hcloud-schematic-id') or cluster_config['talos']['schematicId']
+    cluster_name = cluster_config['cluster']['name']
+    metal_only = [] if cluster_config['hetzner'].get('hcloud-schematic-id') else metal_only_kernel_args()
+    if metal_only:
+        print(f"✗ Error: the metal schematic has kernel args the control plane must not boot with "
+              f"({' '.join(metal_only)}); create a schematic without them at "
+              f"https://factory.talos.dev and set its ID as hetzner.hcloud-schematic-id")
+        return 1
 
-    cluster_config=load_yaml_file(config_folders['cluster_config_file'])        
-    print('Updated cluster config:')
-    print(format_yaml(cluster_config))
+    print(f"Preparing Talos image hcloud-{args.arch} {talos_version} for schematic ID {schematic_id}")
 
-    print(f"Use snapshot {HCLOUD_TALOS_IMAGE_ID}")
-    print('Updated cluster config with image id')
+    image = hcloud_images.find_snapshot(schematic_id, talos_version, args.arch)
+    if image:
+        used_by = ", ".join(hcloud_images.clusters_of(image)) or "no cluster"
+        print(f"✓ found snapshot {image['id']} (created {image['created']}, used by {used_by})")
+    else:
+        # local binary (patched build) next to the repo, else from PATH
+        upload_bin = Path(__file__).resolve().parent.parent.parent / "hcloud-upload-image" / "hcloud-upload-image"
+        upload_bin = os.getenv("HCLOUD_UPLOAD_IMAGE") or (str(upload_bin) if upload_bin.is_file() else "hcloud-upload-image")
+        # the temporary upload server runs next to the control plane
+        location = cluster_config['hetzner']['cp-datacenter'].split("-")[0]
+        factory_url = os.getenv('TALOS_FACTORY_URL', 'https://factory.talos.dev')
+        image = hcloud_images.build_snapshot(schematic_id, talos_version, args.arch, location,
+                                             "storage", upload_bin, factory_url)
+
+    hcloud_images.add_reference(image['id'], cluster_name)
+    for released in hcloud_images.release_other_snapshots(image['id'], cluster_name):
+        print(f"✓ {cluster_name} no longer uses snapshot {released}")
+
+    record_state('hetzner', {'hcloud-image-id': image['id']})
+
+
+def add_hcloud_image_arguments(parser):
+    parser.add_argument('--arch', choices=['amd64', 'arm64'], default='amd64',
+                        help='Image architecture (default: amd64; the ccx CP server types are x86)')
+
+
+def hcloud_image_gc(args):
+    """Delete registry snapshots that no cluster references and no server runs from"""
+    import hcloud_images
+
+    # this cluster's current image is referenced even if its label got lost
+    current = cluster_config['hetzner'].get('hcloud-image-id')
+    if isinstance(current, int):
+        hcloud_images.add_reference(current, cluster_config['cluster']['name'])
+
+    images = hcloud_images.garbage(args.min_age)
+    if not images:
+        print("✓ no unreferenced snapshots")
+        return 0
+    for image in images:
+        labels = image.get('labels') or {}
+        key = " ".join(f"{labels.get(hcloud_images.LABEL_PREFIX + k, '?')}" for k in hcloud_images.KEY_LABELS)
+        print(f"  {image['id']}  {image['created']}  {image.get('image_size') or 0:.2f} GB  {key}")
+    if not args.yes:
+        print(f"⚠ {len(images)} unreferenced snapshots, run with --yes to delete them")
+        return 0
+    results = hcloud_images.delete_snapshots(images)
+    print(f"{'✓' if all(results.values()) else '✗'} deleted {sum(results.values())}/{len(images)} snapshots")
+    return 0 if all(results.values()) else 1
+
+
+def add_hcloud_image_gc_arguments(parser):
+    parser.add_argument('--yes', action='store_true', help='Delete the snapshots (default: only list them)')
+    parser.add_argument('--min-age', type=float, default=24,
+                        help='Keep snapshots younger than this many hours, another run may be about to use them (default: 24)')
 
 
 def create_cp_lb(args):
@@ -534,7 +700,7 @@ def create_cp_lb(args):
 
     # check LB exists
     command = ["hcloud", "load-balancer", "list", "-l", lb_label, "-o", "json"]
-    result = subprocess.run( command, capture_output=True, text=True, check=True)
+    result = traced_run( command, capture_output=True, text=True, check=True)
     lbs = json.loads(result.stdout)
     if len(lbs) > 0:
         print(f"load balancer {lb_name} already exists")
@@ -542,14 +708,14 @@ def create_cp_lb(args):
         print(f"creating LB {lb_name}")
         command = ['hcloud', 'load-balancer', 'create', '--name', lb_name, '--network-zone', lb_zone, '--type', 'lb11', '--label', lb_label]
         print(" ".join(command))
-        result = subprocess.run(command, capture_output=True, text=True, check=True )
+        result = traced_run(command, capture_output=True, text=True, check=True )
         print(result.stdout)
     
         time.sleep(2)
         print('adding 6443 sevice to LB')
         command = ['hcloud', 'load-balancer', 'add-service', lb_name, '--listen-port', '6443', '--destination-port', '6443', '--protocol', 'tcp']
         print(" ".join(command))
-        result = subprocess.run(command, capture_output=True, text=True, check=False )
+        result = traced_run(command, capture_output=True, text=True, check=False )
         print('--------')
         if (result.returncode):
             print(f"ERROR: {result.stderr}")
@@ -559,7 +725,7 @@ def create_cp_lb(args):
         print('adding targets to LB')
         print(" ".join(command))
         command = ['hcloud', 'load-balancer', 'add-target', '--label-selector', lb_label, lb_name ]
-        result = subprocess.run(command, capture_output=True, text=True, check=False )
+        result = traced_run(command, capture_output=True, text=True, check=False )
         if (result.returncode):
                 print(f"ERROR: {result.stderr}")
         else:
@@ -568,28 +734,140 @@ def create_cp_lb(args):
 
     # check
     command = ["hcloud", "load-balancer", "list", "-l", lb_label, "-o", "json"]
-    result = subprocess.run( command, capture_output=True, text=True, check=True)
+    result = traced_run( command, capture_output=True, text=True, check=True)
     lbs = json.loads(result.stdout)
     lb = lbs[0]
     lb_ip = lb['public_net']['ipv4']['ip']
     print(format_json(lb_ip))
     
-    # update cluster_config file with new image id
-    with open(config_folders['cluster_config_file'], "r") as f:
-        content = f.read()
-    content = re.sub(r'(cp-lb-ip:)\s+\S+(\s+#.*)$', rf'\1 {lb_ip}\2', content, flags=re.MULTILINE)
-
-    with open(config_folders['cluster_config_file'], "w") as f:
-        f.write(content)
-
-    cluster_config=load_yaml_file(config_folders['cluster_config_file'])        
-    print('Updated cluster config:')
-    print(format_yaml(cluster_config))
+    record_state('cluster', {'cp-lb-ip': lb_ip})
 
     print(f"Control plane LB IP is {lb_ip}")
     print('Saved to cluster config')
 
 
+# Hetzner LB types: (name, max concurrent connections, max targets, planning throughput Mbit/s).
+# Connection and target limits are Hetzner's; throughput is not published per type, the figures
+# are a planning estimate that scales with the connection limit.
+LB_TYPES = [
+    ('lb11', 10000, 25, 1000),
+    ('lb21', 20000, 75, 2000),
+    ('lb31', 40000, 150, 4000),
+]
+
+INGRESS_DEFAULTS = {
+    'lb-type': 'auto',
+    'expected-connections': 5000,           # peak concurrent connections
+    'expected-bandwidth-mbps': 100,         # average ingress + egress through the LB
+    'headroom': 1.5,                        # sizing margin over the expected load
+    'http-node-port': 30080,                # ingress controller ports on the workers
+    'https-node-port': 30443,
+    'proxy-protocol': True,
+    'health-check-path': '/healthz',
+}
+
+
+def ingress_lb_type(ingress, target_count):
+    """Smallest LB type that fits the expected connections, bandwidth and target count (with headroom)"""
+    if ingress['lb-type'] != 'auto':
+        return ingress['lb-type']
+    connections = ingress['expected-connections'] * ingress['headroom']
+    bandwidth = ingress['expected-bandwidth-mbps'] * ingress['headroom']
+    for lb_type, max_connections, max_targets, max_mbps in LB_TYPES:
+        if connections <= max_connections and target_count <= max_targets and bandwidth <= max_mbps:
+            return lb_type
+    print(f"⚠ Warning: expected load ({connections:.0f} connections, {bandwidth:.0f} Mbit/s, {target_count} targets) "
+          f"exceeds {LB_TYPES[-1][0]}, using it anyway; consider several LBs with DNS round robin")
+    return LB_TYPES[-1][0]
+
+
+def hcloud_lb(name):
+    command = ["hcloud", "load-balancer", "describe", name, "-o", "json"]
+    result = traced_run(command, capture_output=True, text=True, check=False)
+    return json.loads(result.stdout) if result.returncode == 0 else None
+
+
+def run_hcloud(command):
+    print(" ".join(command))
+    result = traced_run(command, capture_output=True, text=True, check=False)
+    if result.returncode:
+        print(f"ERROR: {result.stderr}")
+    return result.returncode == 0
+
+
+def sync_lb_ip_targets(lb_name, lb, desired_ips):
+    """Make the LB's IP targets exactly desired_ips; adds and removals run concurrently"""
+    from concurrent.futures import ThreadPoolExecutor
+    current = {t['ip']['ip'] for t in lb.get('targets', []) if t.get('type') == 'ip'}
+    to_add = sorted(set(desired_ips) - current)
+    to_remove = sorted(current - set(desired_ips))
+    commands = [['hcloud', 'load-balancer', 'add-target', lb_name, '--ip', ip] for ip in to_add]
+    commands += [['hcloud', 'load-balancer', 'remove-target', lb_name, '--ip', ip] for ip in to_remove]
+    if not commands:
+        print(f"✓ {len(current)} targets already in sync")
+        return True
+    with ThreadPoolExecutor(max_workers=min(len(commands), 10)) as pool:
+        results = list(pool.map(run_hcloud, commands))
+    print(f"{'✓' if all(results) else '✗'} targets: +{len(to_add)} -{len(to_remove)} ({len(desired_ips)} total)")
+    return all(results)
+
+
+def create_ingress_lb(args):
+    """Create or update the ingress LB: type by expected load, attached to the private network,
+    TCP services with proxy protocol to the ingress controller ports, metal workers as private IP targets"""
+
+    ingress = INGRESS_DEFAULTS | (cluster_config.get('ingress') or {})
+    lb_name = f"{cluster_config['cluster']['name']}-ingress"
+    lb_label = 'type=ingress'
+    lb_zone = cluster_config['hetzner']['hcloud-zone']
+    network_id = cluster_config['hetzner']['hcloud-network-id']
+
+    nodes_index = load_yaml_file(config_folders['cluster_nodes_index_file'])['index']
+    # spares in maintenance mode run no ingress controller, they become targets once promoted
+    target_ips = [worker_private_ip(index) for index in worker_indexes(nodes_index)]
+
+    lb = hcloud_lb(lb_name)
+    if lb is None and args.sync_targets:
+        print(f"✗ Error: load balancer {lb_name} does not exist, run `ingress-lb` first")
+        return 1
+
+    if not args.sync_targets:
+        lb_type = ingress_lb_type(ingress, len(target_ips))
+        if lb is None:
+            print(f"creating LB {lb_name} ({lb_type})")
+            run_hcloud(['hcloud', 'load-balancer', 'create', '--name', lb_name, '--network-zone', lb_zone,
+                        '--type', lb_type, '--label', lb_label])
+        elif lb['load_balancer_type']['name'] != lb_type:
+            print(f"changing LB {lb_name} type {lb['load_balancer_type']['name']} -> {lb_type}")
+            run_hcloud(['hcloud', 'load-balancer', 'change-type', lb_name, lb_type])
+        lb = hcloud_lb(lb_name)
+
+        if not any(str(net['network']) == str(network_id) for net in lb.get('private_net', [])):
+            print('attaching LB to the private network')
+            run_hcloud(['hcloud', 'load-balancer', 'attach-to-network', lb_name, '--network', str(network_id)])
+
+        services = {service['listen_port']: service for service in lb.get('services', [])}
+        for listen_port, node_port in ((80, ingress['http-node-port']), (443, ingress['https-node-port'])):
+            if listen_port not in services:
+                command = ['hcloud', 'load-balancer', 'add-service', lb_name, '--protocol', 'tcp',
+                           '--listen-port', str(listen_port), '--destination-port', str(node_port)]
+                if ingress['proxy-protocol']:
+                    command.append('--proxy-protocol')
+                run_hcloud(command)
+            # the ingress controller answers plain HTTP on its http port, for both services
+            run_hcloud(['hcloud', 'load-balancer', 'update-service', lb_name, '--listen-port', str(listen_port),
+                        '--health-check-protocol', 'http', '--health-check-port', str(ingress['http-node-port']),
+                        '--health-check-http-path', ingress['health-check-path'],
+                        '--health-check-interval', '5s', '--health-check-timeout', '3s', '--health-check-retries', '3'])
+        lb = hcloud_lb(lb_name)
+
+    ok = sync_lb_ip_targets(lb_name, lb, target_ips)
+
+    lb_ip = lb['public_net']['ipv4']['ip']
+    print(f"Ingress LB {lb_name} ({lb['load_balancer_type']['name']}) public IP is {lb_ip}")
+    return 0 if ok else 1
+
+
 def create_network(args):
     """
     mise set NETWORK_NAME=$CLUSTER_NAME
@@ -611,7 +889,7 @@ def create_network(args):
 
     # check Net exists
     command = ["hcloud", "network", "list", "-o", "json"]
-    result = subprocess.run( command, capture_output=True, text=True, check=True)
+    result = traced_run( command, capture_output=True, text=True, check=True)
     nets = json.loads(result.stdout)
     if len(nets) > 0:
         print(f"Network {net_name} already exists")
@@ -624,7 +902,7 @@ def create_network(args):
         print(f"creating net {net_name}")
         command = ['hcloud', 'network', 'create', '--name', net_name, '--ip-range', net_cidr]
         print(" ".join(command))
-        result = subprocess.run(command, capture_output=True, text=True, check=True )
+        result = traced_run(command, capture_output=True, text=True, check=True )
         if (result.returncode):
             print(f"ERROR: {result.stderr}")
         else:
@@ -633,7 +911,7 @@ def create_network(args):
         print('adding VM subnet')
         command = ['hcloud', 'network', 'add-subnet', '--type', 'server', '--network-zone', net_zone, '--ip-range', net_subnet_virtual, net_name]
         print(" ".join(command))
-        result = subprocess.run(command, capture_output=True, text=True, check=False )
+        result = traced_run(command, capture_output=True, text=True, check=False )
         print('--------')
         if (result.returncode):
             print(f"ERROR: {result.stderr}")
@@ -644,7 +922,7 @@ def create_network(args):
         command = ['hcloud', 'network', 'add-subnet', '--type', 'vswitch', '--network-zone', 
             net_zone, '--ip-range', f"{net_subnet_metal}", '--vswitch-id', f"{vswitch_id}", net_name]
         print(" ".join(command))
-        result = subprocess.run(command, capture_output=True, text=True, check=False )
+        result = traced_run(command, capture_output=True, text=True, check=False )
         print('--------')
         if (result.returncode):
             print(f"ERROR: {result.stderr}")
@@ -654,7 +932,7 @@ def create_network(args):
         print('exposing routes to vswitch')
         command = ['hcloud', 'network', 'expose-routes-to-vswitch', net_name]
         print(" ".join(command))
-        result = subprocess.run(command, capture_output=True, text=True, check=False )
+        result = traced_run(command, capture_output=True, text=True, check=False )
         print('--------')
         if (result.returncode):
             print(f"ERROR: {result.stderr}")
@@ -664,7 +942,7 @@ def create_network(args):
 
         # check Net exists
         command = ["hcloud", "network", "list", "-o", "json"]
-        result = subprocess.run( command, capture_output=True, text=True, check=True)
+        result = traced_run( command, capture_output=True, text=True, check=True)
         nets = json.loads(result.stdout)
         network = nets[0]
 
@@ -672,18 +950,7 @@ def create_network(args):
         print(f"Network is:")
         print(format_json(network))
 
-        # update cluster_config file with new image id
-        with open(config_folders['cluster_config_file'], "r") as f:
-            content = f.read()
-        network_id = network['id']
-        content = re.sub(r'(hcloud-network-id:)\s+\S+(\s+#.*)$', rf'\1     {network_id}\2', content, flags=re.MULTILINE)
-
-        with open(config_folders['cluster_config_file'], "w") as f:
-            f.write(content)
-
-        cluster_config=load_yaml_file(config_folders['cluster_config_file'])        
-        print('Updated cluster config:')
-        print(format_yaml(cluster_config))
+        record_state('hetzner', {'hcloud-network-id': network['id']})
 
         print(f"HCloud Network ID is {network['id']}")
         print('Saved to cluster config')
@@ -693,7 +960,7 @@ def create_network(args):
     return False
 
 def create_cp_nodes(args):
-
+    from cp_sizing import resolve_cp_server_type
     global cluster_config
 
     """
@@ -714,7 +981,7 @@ def create_cp_nodes(args):
     
     server_label = 'type=controlplane'
     server_zone = cluster_config['hetzner']['hcloud-zone']
-    server_type = cluster_config['hetzner']['cp-server-type']
+    server_type = resolve_cp_server_type(cluster_config['hetzner']['cp-server-type'], cp_sizing())
     datacenter = cluster_config['hetzner']['cp-datacenter']
     network_id = cluster_config['hetzner']['hcloud-network-id']
     server_image = cluster_config['hetzner']['hcloud-image-id']
@@ -723,7 +990,7 @@ def create_cp_nodes(args):
 
     # check servers exist
     command = ["hcloud", "server", "list", "-l", server_label, "-o", "json"]
-    result = subprocess.run( command, capture_output=True, text=True, check=True)
+    result = traced_run( command, capture_output=True, text=True, check=True)
     servers = json.loads(result.stdout)
     # exit()
     if len(servers) == desired_cp_node_count:
@@ -743,7 +1010,7 @@ def create_cp_nodes(args):
                 '--label', f"{server_label}",
                 '--user-data-from-file', f"{userdata_file}"]
             print(" ".join(command))
-            result = subprocess.run(command, capture_output=True, text=True, check=False )
+            result = traced_run(command, capture_output=True, text=True, check=False )
             if result.returncode:
                 print(result.stderr)
             else:
@@ -753,18 +1020,25 @@ def create_cp_nodes(args):
         
 
 
-def vswitch(args):
-
-    global cluster_config
+def get_robot_api():
+    from dotenv import load_dotenv
+    from hetzner_robot import HetznerRobotAPI
     load_dotenv()
     username = os.getenv("HETZNER_ROBOT_USER")
     password = os.getenv("HETZNER_ROBOT_PASSWORD")
-    print(f"usernmame is {password}:{username}")
+    print(f"Robot API user is {username}")
 
     # Initialize API client
     print("\nInitializing API client...")
     robot = HetznerRobotAPI(username, password)
     print("✓ API client initialized\n")
+    return robot
+
+
+def vswitch(args):
+
+    global cluster_config
+    robot = get_robot_api()
 
     switches=robot.list_vswitches()
     # print(format_json(switches))
@@ -783,25 +1057,775 @@ def vswitch(args):
         print(vswitch)
     
 
-    # update cluster_config file with new vSwitch ID
-    with open(config_folders['cluster_config_file'], "r") as f:
-        content = f.read()
-    vswitch_id = vswitch['id']
-    content = re.sub(r'(robot-vswitch-id:)\s+\S+(\s+#.*)$', rf'\1 {vswitch_id}\2', content, flags=re.MULTILINE)
-
-    with open(config_folders['cluster_config_file'], "w") as f:
-        f.write(content)
-
-    cluster_config=load_yaml_file(config_folders['cluster_config_file'])        
-    print('Updated cluster config:')
-    print(format_yaml(cluster_config))
+    record_state('hetzner', {'robot-vswitch-id': vswitch['id']})
 
     print(f"vSwitch ID: {vswitch['id']}")
     print('Saved to cluster config')        
 
+def wait_for_port(host, port, timeout, initial_delay=2, max_delay=15):
+    """Poll a TCP port with exponential backoff until it accepts connections.
+    Returns True when it is up, False on timeout."""
+    import socket
+    deadline = time.monotonic() + timeout
+    delay = initial_delay
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=5):
+                return True
+        except OSError:
+            time.sleep(min(delay, max(deadline - time.monotonic(), 0)))
+            delay = min(delay * 2, max_delay)
+    return False
+
+
+def pipeline_node(args, node_index, patches, apply=True):
+    """Move one metal node through install -> boot -> maintenance API -> apply-config.
+    Without apply the node is left in maintenance mode with its config rendered (hot spares).
+    Returns a dict with the per-stage durations."""
+
+    rendered_patches_list, rendered_patches_list_worker = patches
+    nodes_index = load_yaml_file(config_folders['cluster_nodes_index_file'])['index']
+    ip = nodes_index[node_index]
+    stages = {}
+    started = time.monotonic()
+
+    def stage(name):
+        stages[name] = round(time.monotonic() - started - sum(stages.values()), 1)
+        print(f"[w{node_index} {ip}] ✓ {name} ({stages[name]}s)")
+        metrics.observe("node_stage_duration_seconds", stages[name], stage=name)
+        # every node records its own entry; the store's lock keeps the parallel nodes apart
+        machine_state().update({'workers': {node_index: {'ip': ip, 'stage': name, 'error': None,
+                                                         'updated': int(time.time())}}})
+
+    with span(f"pipeline w{node_index}", kind="node", node=ip):
+        # --- install Talos over SSH (rescue system) and boot into maintenance mode
+        install_command = [sys.executable, str(Path(__file__).resolve().parent / "install-talos-metal.py"),
+            "-k", args.key_file, "-u", args.username, "-c", str(config_folders['config_dir']),
+            "-i", str(node_index), "--kexec" if args.kexec else "--reboot"]
+        log_file = config_folders['logs_dir'] / f"w{node_index}-install.log"
+        log_file.parent.mkdir(parents=True, exist_ok=True)
+        print(f"[w{node_index} {ip}] installing Talos (log: {log_file})")
+        result = traced_run(install_command, capture_output=True, text=True)
+        traced_write_file(log_file, result.stdout + result.stderr)
+        if result.returncode:
+            print(f"[w{node_index} {ip}] ✗ install failed, last lines of {log_file}:")
+            print("\n".join((result.stdout + result.stderr).splitlines()[-15:]))
+            raise RuntimeError(f"install of w{node_index} failed")
+        stage("install")
+
+        # --- render just this node from its fresh discovery file
+        node = render_node_template_file(config_folders['discovery_dir'] / f"{ip}.yaml", load_node_template())
+        generate_talos_config_workernode(rendered_patches_list, rendered_patches_list_worker, node)
+        stage("render")
+
+        # --- wait for the Talos maintenance API
+        print(f"[w{node_index} {ip}] waiting for Talos API on port 50000")
+        with span(f"wait {ip}:50000", kind="wait", node=ip):
+            if not wait_for_port(ip, 50000, args.api_timeout):
+                raise RuntimeError(f"Talos API of w{node_index} not up after {args.api_timeout}s")
+        stage("boot")
+        if not apply:
+            stages["total"] = round(time.monotonic() - started, 1)
+            return stages
+
+        # --- push the config
+        config_file = config_folders['secrets_nodes_dir'] / node['config_file']
+        command = ["talosctl", "apply-config", "--insecure", "--nodes", ip, "--file", str(config_file)]
+        result = traced_run(command, capture_output=True, text=True)
+        if result.returncode:
+            print(f"[w{node_index} {ip}] ✗ apply-config failed: {result.stderr}")
+            raise RuntimeError(f"apply-config of w{node_index} failed")
+        stage("apply")
+
+    stages["total"] = round(time.monotonic() - started, 1)
+    metrics.observe("node_time_to_join_seconds", stages["total"])
+    return stages
+
+
+def pipeline(args):
+    """Install, render and apply every selected metal node independently of the others"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    nodes_index = load_yaml_file(config_folders['cluster_nodes_index_file'])['index']
+    node_indexes = [int(i) for i in args.index] if args.index else worker_indexes(nodes_index)
+    if not node_indexes:
+        print("⚠ No nodes to run the pipeline on (every indexed node is an unpromoted spare)")
+        return 0
+
+    # patches are shared by all nodes, render them once up front
+    rendered_patches_list, _, rendered_patches_list_worker = render_patches()
+    patches = (rendered_patches_list, rendered_patches_list_worker)
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=min(args.max_concurrency, len(node_indexes))) as pool:
+        futures = {i: pool.submit(pipeline_node, args, i, patches) for i in node_indexes}
+        for i, future in futures.items():
+            try:
+                results[i] = future.result()
+            except (Exception, SystemExit) as e:
+                results[i] = e
+
+    print("\n=== Pipeline summary ===")
+    failed = 0
+    for i in node_indexes:
+        if isinstance(results[i], dict):
+            stages = ", ".join(f"{k} {v}s" for k, v in results[i].items())
+            print(f"  ✓ w{i} {nodes_index[i]}: {stages}")
+        else:
+            failed += 1
+            print(f"  ✗ w{i} {nodes_index[i]}: {results[i]}")
+
+    # one write for all failures
+    failures = {i: {'error': str(results[i]), 'updated': int(time.time())}
+                for i in node_indexes if not isinstance(results[i], dict)}
+    if failures:
+        machine_state().update({'workers': failures})
+    return 1 if failed else 0
+
+
+def wait_for_port_closed(host, port, timeout, interval=3):
+    """Poll until a TCP port stops accepting connections. Returns True once it is closed."""
+    import socket
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=3):
+                pass
+        except OSError:
+            return True
+        time.sleep(interval)
+    return False
+
+
+def ssh_key_fingerprint(key_file):
+    """MD5 fingerprint (aa:bb:...) of an SSH public key, the format Robot uses to identify keys"""
+    import base64
+    import hashlib
+    pub_file = Path(key_file if str(key_file).endswith(".pub") else f"{key_file}.pub")
+    key_blob = base64.b64decode(pub_file.read_text().split()[1])
+    digest = hashlib.md5(key_blob).hexdigest()
+    return ":".join(digest[i:i + 2] for i in range(0, len(digest), 2))
+
+
+def rescue_node(robot, server, args, fingerprints):
+    """Activate rescue for one server, reset it and wait for the rescue SSH"""
+    ip = server['server_ip']
+    with span(f"rescue {ip}", kind="node", node=ip):
+        # a rescue left active by an earlier, partly failed run makes activate fail with 409;
+        # activate it again so the keys of this run are the ones allowed
+        if robot.get_rescue(server['server_number']).get('active'):
+            robot.deactivate_rescue(server['server_number'])
+        robot.activate_rescue(server['server_number'], authorized_keys=fingerprints)
+        robot.reset_server(server['server_number'], reset_type=args.reset_type)
+        if args.no_wait:
+            return "reset"
+        # the old system may still answer on port 22 for a moment after the reset
+        wait_for_port_closed(ip, 22, 120)
+        with span(f"wait {ip}:22", kind="wait", node=ip):
+            if not wait_for_port(ip, 22, args.ssh_timeout):
+                raise RuntimeError(f"rescue SSH not up after {args.ssh_timeout}s")
+        return "rescue SSH up"
+
+
+def rescue(args):
+    """Boot metal nodes into the Robot rescue system: activate rescue, reset, wait for SSH"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    nodes_index = load_yaml_file(config_folders['cluster_nodes_index_file'])['index']
+    node_indexes = [int(i) for i in args.index] if args.index else worker_indexes(nodes_index)
+    if not node_indexes:
+        print("⚠ No nodes to rescue (every indexed node is an unpromoted spare)")
+        return 0
+    fingerprints = list(args.key_fingerprint or [])
+    if args.key_file:
+        fingerprints.append(ssh_key_fingerprint(args.key_file))
+    if not fingerprints:
+        print("✗ Error: provide --key-file or --key-fingerprint so the rescue system accepts your SSH key")
+        return 1
+
+    robot = get_robot_api()
+    # one listing maps all node IPs to Robot server numbers
+    servers_by_ip = {server['server_ip']: server for server in robot.list_servers()}
+
+    targets = {}
+    for i in node_indexes:
+        ip = nodes_index[i]
+        if ip not in servers_by_ip:
+            print(f"✗ w{i} {ip}: not found in Robot server list")
+            continue
+        targets[i] = servers_by_ip[ip]
+        print(f"  w{i} {ip} -> server #{targets[i]['server_number']} {targets[i].get('server_name', '')}")
+    if not targets:
+        return 1
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=len(targets)) as pool:
+        futures = {i: pool.submit(rescue_node, robot, server, args, fingerprints) for i, server in targets.items()}
+        for i, future in futures.items():
+            try:
+                results[i] = future.result()
+            except Exception as e:
+                results[i] = e
+
+    print("\n=== Rescue summary ===")
+    failed = len(node_indexes) - len(targets)
+    for i, result in results.items():
+        if isinstance(result, Exception):
+            failed += 1
+            print(f"  ✗ w{i} {nodes_index[i]}: {result}")
+        else:
+            print(f"  ✓ w{i} {nodes_index[i]}: {result}")
+    return 1 if failed else 0
+
+
+def spare_settings():
+    """(candidate node indexes, spares to keep ready) from the spares section of cluster_nodes_index.yaml"""
+    spares = load_yaml_file(config_folders['cluster_nodes_index_file']).get('spares') or {}
+    candidates = [int(i) for i in spares.get('nodes') or []]
+    return candidates, int(spares.get('size', len(candidates)))
+
+
+def spare_states():
+    """{candidate index: ready/provisioning/failed/promoted or None} from state.yaml"""
+    workers = machine_state().load().get('workers') or {}
+    candidates, _ = spare_settings()
+    return {i: (workers.get(i) or {}).get('spare') for i in candidates}
+
+
+def spare_nodes():
+    """Candidates that are not (yet) promoted to workers"""
+    return [i for i, state in spare_states().items() if state != 'promoted']
+
+
+def worker_indexes(nodes_index):
+    """Indexes of the nodes that are cluster workers: every indexed node but the unpromoted spares.
+    Hot spares are provisioned with `spares --fill` and join with `promote`, commands working on
+    "all nodes" leave them alone"""
+    spares = spare_nodes()
+    return [int(i) for i in sorted(nodes_index) if int(i) not in spares]
+
+
+def set_spare_state(node_index, state, error=None):
+    machine_state().update({'workers': {node_index: {'spare': state, 'error': error, 'updated': int(time.time())}}})
+
+
+def provision_spare(args, node_index, ip, robot_server, fingerprints, patches):
+    """Rescue, install and render one spare and leave it in Talos maintenance mode"""
+    set_spare_state(node_index, 'provisioning')
+    try:
+        rescue_node(get_robot_api(), robot_server, args, fingerprints)
+        stages = pipeline_node(args, node_index, patches, apply=False)
+    except (Exception, SystemExit) as e:
+        set_spare_state(node_index, 'failed', str(e))
+        raise
+    set_spare_state(node_index, 'ready')
+    return stages
+
+
+def spares(args):
+    """Show the hot spare pool; with --fill provision spares until `size` are ready"""
+    from concurrent.futures import ThreadPoolExecutor
+    nodes_index = load_yaml_file(config_folders['cluster_nodes_index_file'])['index']
+    candidates, size = spare_settings()
+    states = spare_states()
+    if not candidates:
+        print("No spares configured, add a spares section to cluster_nodes_index.yaml")
+        return 0
+    workers = machine_state().load().get('workers') or {}
+    for i in candidates:
+        worker = workers.get(i) or {}
+        detail = f" ({worker['error']})" if worker.get('error') else ""
+        print(f"  w{i} {nodes_index[i]}: {states[i] or 'not provisioned'}{detail}")
+    ready = [i for i in candidates if states[i] in ('ready', 'provisioning')]
+    print(f"{len([i for i in ready if states[i] == 'ready'])} of {size} spares ready")
+    if not args.fill:
+        return 0
+
+    # failed spares are retried, promoted ones are workers now
+    available = [i for i in candidates if states[i] in (None, 'failed')]
+    to_provision = available[:max(size - len(ready), 0)]
+    if not to_provision:
+        if len(ready) < size:
+            print("⚠ Warning: no spare candidates left, add index entries to spares.nodes")
+            return 1
+        print("✓ Spare pool is full")
+        return 0
+    if not args.key_file:
+        print("✗ Error: --fill needs --key-file for the rescue system")
+        return 1
+
+    fingerprints = list(args.key_fingerprint or []) + [ssh_key_fingerprint(args.key_file)]
+    servers_by_ip = {server['server_ip']: server for server in get_robot_api().list_servers()}
+    rendered_patches_list, _, rendered_patches_list_worker = render_patches()
+    patches = (rendered_patches_list, rendered_patches_list_worker)
+
+    print(f"Provisioning spares {' '.join(f'w{i}' for i in to_provision)}")
+    results = {}
+    with ThreadPoolExecutor(max_workers=len(to_provision)) as pool:
+        futures = {i: pool.submit(provision_spare, args, i, nodes_index[i], servers_by_ip[nodes_index[i]],
+                                  fingerprints, patches)
+                   for i in to_provision if nodes_index[i] in servers_by_ip}
+        for i, future in futures.items():
+            try:
+                results[i] = future.result()
+            except (Exception, SystemExit) as e:
+                results[i] = e
+    failed = len(to_provision) - len(futures)
+    for i, result in results.items():
+        if isinstance(result, dict):
+            print(f"  ✓ w{i} {nodes_index[i]}: ready in maintenance mode ({result['total']}s)")
+        else:
+            failed += 1
+            print(f"  ✗ w{i} {nodes_index[i]}: {result}")
+    return 1 if failed else 0
+
+
+def start_backfill(args):
+    """Refill the spare pool in a detached process that outlives this command"""
+    import subprocess
+    log_file = config_folders['logs_dir'] / f"spares-backfill-{time.strftime('%Y%m%d-%H%M%S')}.log"
+    log_file.parent.mkdir(parents=True, exist_ok=True)
+    command = [sys.executable, str(Path(__file__).resolve()), "-c", str(config_folders['config_dir']),
+               "spares", "--fill", "-k", args.key_file, "-u", args.username, "--api-timeout", str(args.api_timeout)]
+    if args.kexec:
+        command.append("--kexec")
+    with open(log_file, "w") as log:
+        subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+                         start_new_session=True)
+    print(f"✓ Backfilling the spare pool in the background (log: {log_file})")
+
+
+def promote(args):
+    """Join a ready spare: apply its pre-rendered config, then backfill the pool"""
+    nodes_index = load_yaml_file(config_folders['cluster_nodes_index_file'])['index']
+    states = spare_states()
+    if args.index is not None:
+        if states.get(args.index) != 'ready':
+            print(f"✗ w{args.index} is not a ready spare ({states.get(args.index, 'not a spare candidate')})")
+            return 1
+        choices = [args.index]
+    else:
+        choices = [i for i, state in states.items() if state == 'ready']
+    if not choices:
+        print("✗ No ready spare, run `spares --fill`")
+        return 1
+
+    for i in choices:
+        ip = nodes_index[i]
+        config_file = config_folders['secrets_nodes_dir'] / f"w{i}.yaml"
+        if not wait_for_port(ip, 50000, 10, initial_delay=1):
+            print(f"⚠ w{i} {ip}: Talos maintenance API not reachable, marking it failed")
+            set_spare_state(i, 'failed', "maintenance API not reachable at promote")
+            continue
+        if not config_file.exists():
+            rendered_patches_list, _, rendered_patches_list_worker = render_patches()
+            node = render_node_template_file(config_folders['discovery_dir'] / f"{ip}.yaml", load_node_template())
+            generate_talos_config_workernode(rendered_patches_list, rendered_patches_list_worker, node)
+        command = ["talosctl", "apply-config", "--insecure", "--nodes", ip, "--file", str(config_file)]
+        with span(f"promote w{i}", kind="node", node=ip):
+            result = traced_run(command, capture_output=True, text=True)
+        if result.returncode:
+            print(f"✗ w{i} {ip}: apply-config failed: {result.stderr}")
+            set_spare_state(i, 'failed', result.stderr.strip())
+            continue
+        set_spare_state(i, 'promoted')
+        print(f"✓ w{i} {ip} promoted, it joins the cluster after its reboot")
+        print("  Run `ingress-lb --sync-targets` to add it to the ingress LB")
+        break
+    else:
+        return 1
+
+    if args.no_backfill:
+        return 0
+    if not args.key_file:
+        print("⚠ Warning: no --key-file, the spare pool is not backfilled; run `spares --fill -k ...`")
+        return 0
+    start_backfill(args)
+    return 0
+
+
+def fetch_live_config(ip):
+    """Machine config a joined node is running, as returned by `talosctl get machineconfig`"""
+    from machine_config_diff import live_machine_config
+    command = ["talosctl", "--talosconfig", str(config_folders['talosconfig_file']), "--nodes", ip, "--endpoints", ip,
+               "get", "machineconfig", "-o", "yaml"]
+    result = traced_run(command, capture_output=True, text=True, timeout=60)
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip() or f"talosctl exited with {result.returncode}")
+    return live_machine_config(result.stdout)
+
+
+def diff_node(node_index, ip):
+    """Changes between w<N>.yaml as rendered and what the node runs, and the
+    (live, rendered) kubelet CPU manager policies"""
+    from worker_tuning import cpu_manager_policy
+    from machine_config_diff import parse_machine_config, semantic_diff
+    config_file = config_folders['secrets_nodes_dir'] / f"w{node_index}.yaml"
+    rendered = parse_machine_config(config_file.read_text())
+    with span(f"diff w{node_index}", kind="node", node=ip):
+        live = fetch_live_config(ip)
+    policies = (cpu_manager_policy(live.get('v1alpha1')), cpu_manager_policy(rendered.get('v1alpha1')))
+    return semantic_diff(rendered, live), policies
+
+
+def apply_node_config(node_index, ip, mode):
+    config_file = config_folders['secrets_nodes_dir'] / f"w{node_index}.yaml"
+    command = ["talosctl", "--talosconfig", str(config_folders['talosconfig_file']), "--nodes", ip, "--endpoints", ip,
+               "apply-config", "--file", str(config_file), "--mode", mode]
+    result = traced_run(command, capture_output=True, text=True)
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip() or f"talosctl exited with {result.returncode}")
+
+
+def diff_configs(args):
+    """Compare the rendered worker configs with the configs the nodes run; with --apply push only the changed ones"""
+    from concurrent.futures import ThreadPoolExecutor
+    from machine_config_diff import format_changes
+
+    nodes_index = load_yaml_file(config_folders['cluster_nodes_index_file'])['index']
+    node_indexes = [int(i) for i in args.index] if args.index else worker_indexes(nodes_index)
+    if not node_indexes:
+        print("⚠ No nodes to compare (every indexed node is an unpromoted spare)")
+        return 0
+    missing = [i for i in node_indexes if not (config_folders['secrets_nodes_dir'] / f"w{i}.yaml").exists()]
+    if missing:
+        print(f"✗ Not rendered: {', '.join(f'w{i}' for i in missing)}, run `render` first")
+        return 1
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=min(args.max_concurrency, len(node_indexes))) as pool:
+        futures = {i: pool.submit(diff_node, i, nodes_index[i]) for i in node_indexes}
+        for i, future in futures.items():
+            try:
+                results[i] = future.result()
+            except Exception as e:
+                results[i] = e
+
+    changed, failed, cpu_manager_changed = [], [], []
+    for i in node_indexes:
+        if isinstance(results[i], Exception):
+            failed.append(i)
+            print(f"✗ w{i} {nodes_index[i]}: {results[i]}")
+            continue
+        changes, (live_policy, rendered_policy) = results[i]
+        if changes:
+            changed.append(i)
+            print(f"⚠ w{i} {nodes_index[i]}: {len(changes)} change(s)")
+            for line in format_changes(changes):
+                print(f"    {line}")
+        if live_policy != rendered_policy:
+            # kubelet won't start with a cpu_manager_state written under the old policy
+            cpu_manager_changed.append(i)
+            print(f"⚠ w{i} {nodes_index[i]}: CPU manager policy {live_policy} -> {rendered_policy} needs a kubelet "
+                  f"state reset (talosctl reset --system-labels-to-wipe EPHEMERAL, or a reinstall); not applied")
+    print(f"\n{len(changed)} changed, {len(node_indexes) - len(changed) - len(failed)} unchanged, {len(failed)} unreachable")
+
+    changed = [i for i in changed if i not in cpu_manager_changed]
+    if args.apply and changed:
+        print(f"Applying to {' '.join(f'w{i}' for i in changed)} (mode {args.mode})")
+        with ThreadPoolExecutor(max_workers=min(args.max_concurrency, len(changed))) as pool:
+            futures = {i: pool.submit(apply_node_config, i, nodes_index[i], args.mode) for i in changed}
+            for i, future in futures.items():
+                try:
+                    future.result()
+                    print(f"  ✓ w{i} {nodes_index[i]}")
+                except Exception as e:
+                    failed.append(i)
+                    print(f"  ✗ w{i} {nodes_index[i]}: {e}")
+    elif changed:
+        print("Run with --apply to push the changed configs")
+    # nodes held back keep running their old config
+    return 1 if failed or (args.apply and cpu_manager_changed) else 0
+
+
+def boot_reachable_address(node_ips):
+    """This host's address on the route to the metal nodes' public IPs, or None. A node fetching
+    talos.config= at first boot has no vSwitch (VLAN) interface yet, it comes from its public IP"""
+    import socket
+    for ip in node_ips:
+        # connecting a UDP socket sends nothing, it only picks the route and source address
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+            try:
+                probe.connect((ip, 9))
+                return probe.getsockname()[0]
+            except OSError:
+                continue
+    return None
+
+
+def serve_configs(args):
+    """Serve the rendered worker configs to nodes that boot with talos.config=<url>"""
+    import ipaddress
+    import threading
+    from config_server import serve
+
+    nodes_index = load_yaml_file(config_folders['cluster_nodes_index_file'])['index']
+    listen = args.listen or boot_reachable_address(list(nodes_index.values()))
+    if not listen:
+        print("✗ No route to the nodes in cluster_nodes_index.yaml, pass the address to serve on with --listen")
+        return 1
+    try:
+        loopback = ipaddress.ip_address(listen).is_loopback
+    except ValueError:
+        loopback = listen == 'localhost'
+    if not args.tls_cert and not loopback and not args.insecure_http:
+        print(f"✗ The configs hold the cluster secrets; serving them on {listen} needs --tls-cert "
+              "(or --insecure-http to send them unencrypted)")
+        return 1
+    # a MAC is no secret: only the indexed nodes (from their public IP at first boot, or from the
+    # private network once the vSwitch is up) may look their config up by it
+    mac_networks = [cluster_config['cluster']['networking']['private-node-cidr']]
+    mac_networks += [f"{ip}/32" for ip in nodes_index.values()]
+    server, base_url = serve(config_folders, listen, args.port, args.tls_cert, args.tls_key, mac_networks)
+    print(f"✓ Serving configs from {config_folders['secrets_nodes_dir']} on {base_url}")
+    print(f"  ?mac= lookups are answered for the indexed nodes and {mac_networks[0]} only")
+    if not args.tls_cert:
+        print("⚠ Warning: the configs hold the cluster secrets and go out unencrypted without --tls-cert")
+    print("  Boot the workers with this kernel argument (schematic customization.extraKernelArgs,")
+    print("  or `install-talos-metal.py --kexec --talos-config-url`):")
+    print(f"    talos.config={args.url or base_url}/config?mac=${{mac}}")
+    print(f"  Fetches are logged to {config_folders['logs_dir'] / 'serve-configs.log'}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+def seed_registry_cache(args):
+    """Pull the installer and extension images for talos.version through the registry cache"""
+    import glob
+    import yaml
+    from registry_cache import cache_url, extension_images, seed
+
+    registries = cluster_config.get('registries') or {}
+    cache = args.cache or cache_url(registries, worker_private_ip)
+    if not cache:
+        print("✗ No registry cache configured, set registries.cache or registries.cache-node (or pass --cache)")
+        return 1
+
+    talos_version = cluster_config['talos']['version']
+    images = []
+    # installer images exactly as the rendered patches reference them
+    for patch_file in sorted(glob.glob(str(config_folders['patches_dir'] / "**" / "*.yaml"), recursive=True)):
+        for doc in yaml.safe_load_all(Path(patch_file).read_text()):
+            image = ((doc or {}).get('machine') or {}).get('install', {}).get('image')
+            if image and image not in images:
+                images.append(image)
+    if not images:
+        print("⚠ Warning: no rendered patches with an installer image, run `render` first")
+    schematic = load_yaml_file(config_folders['schematic_file'])
+    extensions = (((schematic.get('customization') or {}).get('systemExtensions') or {}).get('officialExtensions')) or []
+    images += extension_images(talos_version, extensions)
+    images += args.image or []
+
+    print(f"Seeding {cache} with {len(images)} image(s) for Talos {talos_version}")
+    results = seed(cache, images, registries.get('override-path', True), args.arch, args.max_concurrency)
+    failed = 0
+    for image, result in results.items():
+        if isinstance(result, Exception):
+            failed += 1
+            print(f"  ✗ {image}: {result}")
+        else:
+            print(f"  ✓ {image} ({result / 1024**2:.1f}MB)")
+    return 1 if failed else 0
+
+
+def status(args):
+    """Print a local, read-only summary of the cluster config: ids, nodes and whether configs are rendered and current"""
+    nodes_index = load_yaml_file(config_folders['cluster_nodes_index_file']).get('index') or {}
+    discovered = sorted(p.stem for p in config_folders['discovery_dir'].glob("*.yaml")) if config_folders['discovery_dir'].exists() else []
+    print(f"cluster:       {cluster_config['cluster']['name']} ({cluster_config['cluster']['endpoint']})")
+    print(f"config dir:    {config_folders['config_dir']}")
+    print(f"talos:         {cluster_config['talos']['version']} schematic {cluster_config['talos']['schematicId']}")
+    for key in ('robot-vswitch-id', 'hcloud-network-id', 'hcloud-image-id'):
+        value = str(cluster_config['hetzner'].get(key, ''))
+        print(f"{key + ':':<18} {value if value.strip('_') else '✗ not set'}")
+    print(f"workers:       {len(nodes_index)} indexed, {len(discovered)} discovered")
+    missing = [ip for ip in nodes_index.values() if ip not in discovered]
+    if missing:
+        print(f"  not installed/discovered: {' '.join(missing)}")
+    for index, worker in sorted((machine_state().load().get('workers') or {}).items()):
+        details = [f"{label} {worker[key]}" for key, label in (('stage', 'pipeline'), ('spare', 'spare')) if worker.get(key)]
+        if worker.get('config-fetched'):
+            details.append("config fetched " + time.strftime('%Y-%m-%d %H:%M', time.localtime(worker['config-fetched'])))
+        mark = f"✗ {', '.join(details)} ({worker['error']})" if worker.get('error') else f"✓ {', '.join(details)}"
+        print(f"  w{index} {worker.get('ip', nodes_index.get(index, ''))}: {mark}")
+
+    # rendered configs are stale when any input changed after them
+    rendered = sorted(config_folders['secrets_nodes_dir'].glob("*.yaml")) if config_folders['secrets_nodes_dir'].exists() else []
+    inputs = [config_folders['cluster_config_file'], config_folders['cluster_nodes_index_file']]
+    inputs += list(config_folders['discovery_dir'].glob("*.yaml")) if config_folders['discovery_dir'].exists() else []
+    inputs += list(Path(template_folders['talos_dir']).rglob("*.j2"))
+    inputs = [(p.name, p.stat().st_mtime) for p in inputs if p.exists()]
+    # state.yaml also tracks node progress; only its config values feed the renders
+    config_updated = machine_state().load().get('config-updated')
+    if config_updated:
+        inputs.append(("state.yaml config", config_updated))
+    if not rendered:
+        print("rendered:      ✗ none, run `render`")
+        return 1
+    newest_input, newest_mtime = max(inputs, key=lambda item: item[1])
+    oldest_render = min(rendered, key=lambda p: p.stat().st_mtime)
+    if newest_mtime > oldest_render.stat().st_mtime:
+        print(f"rendered:      ⚠ {len(rendered)} files, stale ({newest_input} changed after {oldest_render.name}), run `render`")
+        return 1
+    print(f"rendered:      ✓ {len(rendered)} files, up to date")
+    return 0
+
+
+def strip_options(argv, options):
+    """argv without the given options and their values, to re-run the same command for one cluster"""
+    stripped = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg in options:
+            skip = True
+        elif not any(arg.startswith(f"{option}=") if option.startswith('--') else (arg.startswith(option) and len(arg) > 2)
+                     for option in options):
+            stripped.append(arg)
+    return stripped
+
+
+def run_clusters(config_dirs, argv, args):
+    """Run this script once per cluster config dir, concurrently. Each run's output goes to
+    <config_dir>/logs/<timestamp>-<action>.log and is printed as one block when it finishes;
+    with --trace each run writes its own <config_dir>/logs/<timestamp>-<action>-trace.json."""
+    from concurrent.futures import ThreadPoolExecutor
+    from datetime import datetime
+    command_args = strip_options(argv, ('-c', '--config-dir', '--trace'))
+    action = args.action
+    timestamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+
+    def run_one(config_dir):
+        started = time.monotonic()
+        log_file = Path(config_dir) / 'logs' / f"{timestamp}-{action}.log"
+        log_file.parent.mkdir(parents=True, exist_ok=True)
+        command = [sys.executable, str(Path(__file__).resolve()), '-c', str(config_dir)]
+        if args.trace:
+            command += ['--trace', str(log_file.with_name(f"{timestamp}-{action}-trace.json"))]
+        result = traced_run(command + command_args, capture_output=True, text=True)
+        traced_write_file(log_file, result.stdout + result.stderr)
+        print(f"\n===== {config_dir} (exit {result.returncode}, {time.monotonic() - started:.1f}s, log: {log_file}) =====")
+        print((result.stdout + result.stderr).rstrip())
+        return result.returncode
+
+    with ThreadPoolExecutor(max_workers=args.max_parallel) as pool:
+        exit_codes = dict(zip(config_dirs, pool.map(run_one, config_dirs)))
+
+    print(f"\n=== {action} on {len(config_dirs)} clusters ===")
+    for config_dir, code in exit_codes.items():
+        print(f"  {'✓' if code == 0 else '✗'} {config_dir} (exit {code})")
+    return 0 if all(code == 0 for code in exit_codes.values()) else 1
+
+
 def test(args):
     return True
 
+def add_ingress_lb_arguments(parser):
+    parser.add_argument('--sync-targets', action='store_true', help='Only sync the LB targets with cluster_nodes_index.yaml (unpromoted spares are left out)')
+
+
+def add_pipeline_arguments(parser):
+    parser.add_argument('-k', '--key-file', required=True, help='SSH private key file path (rescue system)')
+    parser.add_argument('-u', '--username', default='root', help='SSH username (default: root)')
+    parser.add_argument('-i', '--index', nargs='+', help='Index number(s) from cluster_nodes_index.yaml (default: all)')
+    parser.add_argument('--kexec', action='store_true', help='kexec into Talos after install instead of a firmware reboot')
+    parser.add_argument('--api-timeout', type=int, default=1800, help='Seconds to wait for the Talos maintenance API (default: 1800)')
+    parser.add_argument('--max-concurrency', type=int, default=16, help='Nodes in the pipeline at the same time (default: 16)')
+
+
+def add_diff_arguments(parser):
+    parser.add_argument('-i', '--index', nargs='+', help='Index number(s) from cluster_nodes_index.yaml (default: all)')
+    parser.add_argument('--apply', action='store_true', help='apply-config to the nodes whose config changed')
+    parser.add_argument('--mode', default='auto', choices=['auto', 'no-reboot', 'reboot', 'staged'],
+                        help='talosctl apply-config mode for --apply (default: auto)')
+    parser.add_argument('--max-concurrency', type=int, default=32, help='Nodes queried at the same time (default: 32)')
+
+
+def add_serve_configs_arguments(parser):
+    parser.add_argument('--listen', help="Address to listen on (default: this host's address on the route to the nodes' public IPs)")
+    parser.add_argument('--port', type=int, default=8090, help='Port to listen on (default: 8090)')
+    parser.add_argument('--tls-cert', help='Serve HTTPS with this certificate (PEM)')
+    parser.add_argument('--tls-key', help='Private key of --tls-cert (default: in the cert file)')
+    parser.add_argument('--url', help='URL the nodes reach the server at, for the printed kernel argument')
+    parser.add_argument('--insecure-http', action='store_true',
+                        help='Serve plain HTTP on a non-loopback address without --tls-cert')
+
+
+def add_registry_cache_arguments(parser):
+    parser.add_argument('--cache', help='Cache URL (default: from registries.cache / registries.cache-node)')
+    parser.add_argument('--image', action='append', help='Additional image to seed (repeatable)')
+    parser.add_argument('--arch', default='amd64', help='Platform of multi-arch images to seed (default: amd64)')
+    parser.add_argument('--max-concurrency', type=int, default=8, help='Images pulled at the same time (default: 8)')
+
+
+def add_spare_provisioning_arguments(parser):
+    parser.add_argument('-k', '--key-file', help='SSH private key file path (rescue system); its .pub must be stored in Robot')
+    parser.add_argument('-u', '--username', default='root', help='SSH username (default: root)')
+    parser.add_argument('--kexec', action='store_true', help='kexec into Talos after install instead of a firmware reboot')
+    parser.add_argument('--api-timeout', type=int, default=1800, help='Seconds to wait for the Talos maintenance API (default: 1800)')
+    parser.set_defaults(reset_type='hw', ssh_timeout=900, no_wait=False, key_fingerprint=None)
+
+
+def add_spares_arguments(parser):
+    parser.add_argument('--fill', action='store_true', help='Provision spares until spares.size are ready')
+    parser.add_argument('--key-fingerprint', action='append', help='Additional Robot SSH key fingerprint for the rescue system')
+    add_spare_provisioning_arguments(parser)
+
+
+def add_promote_arguments(parser):
+    parser.add_argument('-i', '--index', type=int, help='Spare to promote (default: the first ready one)')
+    parser.add_argument('--no-backfill', action='store_true', help='Do not provision a replacement spare')
+    add_spare_provisioning_arguments(parser)
+
+
+def add_rescue_arguments(parser):
+    parser.add_argument('-k', '--key-file', help='SSH key (private or .pub) whose fingerprint is authorized in rescue; must be stored in Robot')
+    parser.add_argument('--key-fingerprint', action='append', help='Robot SSH key fingerprint to authorize (repeatable)')
+    parser.add_argument('-i', '--index', nargs='+', help='Index number(s) from cluster_nodes_index.yaml (default: all)')
+    parser.add_argument('--reset-type', default='hw', choices=['sw', 'hw', 'power'], help='Robot reset type (default: hw)')
+    parser.add_argument('--ssh-timeout', type=int, default=900, help='Seconds to wait for the rescue SSH (default: 900)')
+    parser.add_argument('--no-wait', action='store_true', help='Do not wait for SSH after the reset')
+
+
+# subcommand -> (help, function name, needs cluster_config.yaml, argument setup)
+# functions are looked up by name at dispatch and import their own dependencies
+COMMANDS = {
+    'init': ('Initialize configuration', 'initialize_config', False, None),
+    'render': ('Render configuration', 'render_config', True, None),
+    'schematic': ('Calculate Talos schematic id and save in config file', 'save_schematic_id', True, None),
+    'hcloud-image': ("Use the HCloud snapshot for the schematic/version/arch, build it if no cluster has; update config",
+                     'upload_hcloud_image', True, add_hcloud_image_arguments),
+    'hcloud-image-gc': ("list (--yes: delete) Talos snapshots no cluster references and no server runs from",
+                        'hcloud_image_gc', True, add_hcloud_image_gc_arguments),
+    'cp-lb': ("create control plain LB", 'create_cp_lb', True, None),
+    'ingress-lb': ("create/update the ingress LB sized for the expected load, with metal workers as private targets",
+                   'create_ingress_lb', True, add_ingress_lb_arguments),
+    'cp-nodes': ("create control plain nodes", 'create_cp_nodes', True, None),
+    'net': ("create network and subnets", 'create_network', True, None),
+    'vswitch': ("create vSwitch and save ID to cluster config", 'vswitch', True, None),
+    'pipeline': ("install, render and apply config per metal node, each node on its own", 'pipeline', True,
+                 add_pipeline_arguments),
+    'rescue': ("activate Robot rescue system on metal nodes, reset them and wait for SSH", 'rescue', True,
+               add_rescue_arguments),
+    'diff': ("compare rendered worker configs with the live node configs; --apply pushes only changed nodes",
+             'diff_configs', True, add_diff_arguments),
+    'serve-configs': ("serve rendered worker configs over HTTP(S) to nodes booting with talos.config=",
+                      'serve_configs', True, add_serve_configs_arguments),
+    'registry-cache': ("pre-seed the registry pull-through cache with the installer and extension images",
+                       'seed_registry_cache', True, add_registry_cache_arguments),
+    'spares': ("show the hot spare pool; --fill provisions spares into Talos maintenance mode",
+               'spares', True, add_spares_arguments),
+    'promote': ("join a ready spare as a worker and backfill the spare pool in the background",
+                'promote', True, add_promote_arguments),
+    'status': ("show config ids, node counts and whether rendered configs are current (read-only)", 'status', True, None),
+    'test': ("run some tests", 'test', False, None),
+}
+
+
 def main():
     parser = argparse.ArgumentParser(
         description='Multi-purpose utility script with various actions',
@@ -815,45 +1839,24 @@ Examples:
         '''
     )
 
-    # Load variables from .env file
-    load_dotenv()
-    
     # Global arguments
     parser.add_argument('--version', action='version', version='%(prog)s 1.0.0')
     parser.add_argument('--debug', action='store_true', help='Enable debug output')
+    parser.add_argument('--trace', metavar='FILE', help='Write an OTLP/JSON trace of all steps to FILE and print the slowest steps')
+    parser.add_argument('--timings', action='store_true', help='Print the slowest steps when done')
+    parser.add_argument('-c', '--config-dir', action='append', type=Path,
+                        help='Cluster config dir (default: ./config). Repeat to run the command for several clusters concurrently')
+    parser.add_argument('--max-parallel', type=int, default=8, help='Clusters run at the same time with several --config-dir (default: 8)')
+    parser.add_argument('--metrics-dir', help='Write Prometheus metrics to a node-exporter textfile in this dir (or METRICS_TEXTFILE_DIR)')
+    parser.add_argument('--pushgateway', help='Push Prometheus metrics to this Pushgateway URL (or PUSHGATEWAY_URL)')
     
     # Subcommands
     subparsers = parser.add_subparsers(dest='action', help='Action to perform', required=True)
-    
-    # File info subcommand
-    parser_init = subparsers.add_parser('init', help='Initialize configuration')
-    parser_init.set_defaults(func=initialize_config)
-    
-    parser_render = subparsers.add_parser('render', help='Render configuration')
-    parser_render.set_defaults(func=render_config)
-
-    parser_schematic = subparsers.add_parser('schematic', help='Calculate Talos schematic id and save in config file')
-    parser_schematic.set_defaults(func=save_schematic_id)
-    
-    parser_hcloud_image = subparsers.add_parser('hcloud-image', help="Upload Talos image to HCloud, update config file")
-    parser_hcloud_image.set_defaults(func=upload_hcloud_image)
-    
-    parser_cp_lb = subparsers.add_parser('cp-lb', help="create control plain LB")
-    parser_cp_lb.set_defaults(func=create_cp_lb)
-
-    parser_cp_nodes = subparsers.add_parser('cp-nodes', help="create control plain nodes")
-    parser_cp_nodes.set_defaults(func=create_cp_nodes)
-
-    parser_network = subparsers.add_parser('net', help="create network and subnets")
-    parser_network.set_defaults(func=create_network)
-
-    parser_vswitch = subparsers.add_parser('vswitch', help="create vSwitch and save ID to cluster config")
-    parser_vswitch.set_defaults(func=vswitch)
-
-
-    parser_test = subparsers.add_parser('test', help="run some tests")
-    parser_test.set_defaults(func=test)
-
+    for name, (help_text, func_name, _, add_arguments) in COMMANDS.items():
+        subparser = subparsers.add_parser(name, help=help_text)
+        subparser.set_defaults(func_name=func_name)
+        if add_arguments:
+            add_arguments(subparser)
 
     # Parse arguments
     args = parser.parse_args()
@@ -863,18 +1866,44 @@ Examples:
     
 
 
+    config_dirs = args.config_dir or [Path("config")]
+    if len(config_dirs) > 1:
+        return run_clusters(config_dirs, sys.argv[1:], args)
+
     global config_folders, template_folders
-    config_folders = get_folder_names(Path("config"))
-    template_folders = get_folder_names(Path("config_templates"))
+    config_folders = get_folder_names(config_dirs[0])
+    # templates ship with the scripts, independent of the working directory
+    template_folders = get_folder_names(Path(__file__).resolve().parent.parent / "config_templates")
+
+    # Load variables from .env file; per-cluster credentials (e.g. a different HCLOUD_TOKEN
+    # per project) override the shared .env. The shared .env is looked up like load_dotenv()
+    # does (from this script's directory upwards); dotenv is only imported when there is one
+    scripts_dir = Path(os.path.abspath(__file__)).parent
+    shared_env = next((d / '.env' for d in [scripts_dir, *scripts_dir.parents] if (d / '.env').is_file()), None)
+    cluster_env = config_folders['config_dir'] / '.env'
+    if shared_env or cluster_env.is_file():
+        from dotenv import load_dotenv
+        if shared_env:
+            load_dotenv(shared_env)
+        if cluster_env.is_file():
+            load_dotenv(cluster_env, override=True)
+    # installer runs started by pipeline and spares export their metrics to the same place
+    if args.metrics_dir:
+        os.environ['METRICS_TEXTFILE_DIR'] = str(Path(args.metrics_dir).resolve())
+    if args.pushgateway:
+        os.environ['PUSHGATEWAY_URL'] = args.pushgateway
 
 
     global cluster_config , nodes_index
 
-    cluster_config = load_yaml_file(config_folders['cluster_config_file'])
+    # init creates the config and test needs none; skip parsing it there
+    if COMMANDS[args.action][2]:
+        cluster_config = load_cluster_config()
 
     # Execute the appropriate function
     try:
-        return args.func(args)
+        with span(args.action, kind="command"):
+            return globals()[args.func_name](args)
     except KeyboardInterrupt:
         print("\nOperation cancelled by user.")
         return 130
@@ -884,6 +1913,14 @@ Examples:
             import traceback
             traceback.print_exc()
         return 1
+    finally:
+        if args.trace or args.timings:
+            print_summary()
+        if args.trace:
+            write_trace(args.trace)
+        # the cluster config is not loaded for every command, and loading it may have failed
+        cluster_name = (cluster_config or {}).get('cluster', {}).get('name') or config_folders['config_dir'].name
+        metrics.export(f"config-{args.action}", args.metrics_dir, args.pushgateway, cluster=cluster_name)
 
 
 if __name__ == '__main__':
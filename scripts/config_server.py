@@ -0,0 +1,191 @@
+"""
+HTTP(S) server for the rendered worker configs, for pull based provisioning
+
+Talos fetches its machine config at boot when the kernel command line has
+`talos.config=<url>` (Talos substitutes ${mac}, ${uuid}, ${hostname} and
+${serial} in the URL). The server answers GET /config with the node's
+secrets/nodes/w<N>.yaml:
+
+- the request's source IP is looked up in cluster_nodes_index.yaml
+- otherwise ?mac= is looked up in the NICs recorded in discovery/<ip>.yaml
+  (`install-talos-metal.py --inventory`), for nodes behind NAT or fetching over
+  the vSwitch. A MAC is no secret, so it is only accepted from source IPs in
+  mac_networks (serve-configs passes the indexed public IPs and the private node
+  CIDR); from anywhere else only the source IP counts
+
+Unknown nodes get a 404, nothing else is served. Every fetch is logged to
+stdout and config/logs/serve-configs.log and recorded as the node's
+`config-fetched` time in state.yaml.
+
+    server, url = serve(config_folders, "127.0.0.1", 0, mac_networks=["127.0.0.0/8"])
+    # curl "$url/config?mac=aa:bb:cc:dd:ee:ff"
+"""
+
+import ipaddress
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import yaml
+
+from state_store import StateStore
+
+
+def _normalize_mac(mac):
+    return mac.strip().lower().replace("-", ":")
+
+
+class NodeConfigs:
+    """Maps source IPs and MACs to rendered config files; re-reads its inputs when they change"""
+
+    def __init__(self, config_folders, mac_networks=()):
+        self.folders = config_folders
+        self.mac_networks = [ipaddress.ip_network(n) for n in mac_networks]
+        self.lock = threading.Lock()
+        self._stamp = None
+        self.by_ip = {}
+        self.by_mac = {}
+        self._cache = {}
+
+    def _inputs_stamp(self):
+        paths = [self.folders['cluster_nodes_index_file'], self.folders['discovery_dir']]
+        paths += sorted(self.folders['discovery_dir'].glob("*.yaml")) if self.folders['discovery_dir'].exists() else []
+        return tuple(p.stat().st_mtime_ns if p.exists() else 0 for p in paths)
+
+    def _refresh(self):
+        stamp = self._inputs_stamp()
+        if stamp == self._stamp:
+            return
+        with open(self.folders['cluster_nodes_index_file']) as f:
+            nodes_index = yaml.safe_load(f)['index']
+        by_ip, by_mac = {}, {}
+        for index, ip in nodes_index.items():
+            by_ip[ip] = int(index)
+            discovery_file = self.folders['discovery_dir'] / f"{ip}.yaml"
+            if discovery_file.exists():
+                with open(discovery_file) as f:
+                    hardware = (yaml.safe_load(f) or {}).get('hardware') or {}
+                for nic in hardware.get('nics') or []:
+                    if nic.get('mac'):
+                        by_mac[_normalize_mac(nic['mac'])] = int(index)
+        self.by_ip, self.by_mac, self._stamp = by_ip, by_mac, stamp
+
+    def mac_allowed(self, source_ip):
+        try:
+            address = ipaddress.ip_address(source_ip)
+        except ValueError:
+            return False
+        return any(address in network for network in self.mac_networks)
+
+    def match(self, source_ip, mac=None):
+        """(node index, how it was matched) or (None, None)"""
+        if mac and not self.mac_allowed(source_ip):
+            mac = None
+        with self.lock:
+            self._refresh()
+            if source_ip in self.by_ip:
+                return self.by_ip[source_ip], "ip"
+            if mac and _normalize_mac(mac) in self.by_mac:
+                return self.by_mac[_normalize_mac(mac)], "mac"
+        return None, None
+
+    def content(self, node_index):
+        """The rendered config of w<N>, cached until the file changes; None if not rendered"""
+        path = self.folders['secrets_nodes_dir'] / f"w{node_index}.yaml"
+        try:
+            mtime = path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+        with self.lock:
+            cached = self._cache.get(node_index)
+            if cached and cached[0] == mtime:
+                return cached[1]
+        content = path.read_bytes()
+        with self.lock:
+            self._cache[node_index] = (mtime, content)
+        return content
+
+
+class ConfigHandler(BaseHTTPRequestHandler):
+    configs = None
+    state = None
+    log_file = None
+    log_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        # fetches are logged by _log_fetch
+        pass
+
+    def _log_fetch(self, status, node_index, matched, mac, size):
+        node = f"w{node_index}" if node_index is not None else "-"
+        line = (f"{time.strftime('%Y-%m-%dT%H:%M:%S')} {self.client_address[0]} mac={mac or '-'} "
+                f"node={node} match={matched or '-'} status={status} bytes={size}")
+        print(f"serve-configs: {line}")
+        with self.log_lock:
+            with open(self.log_file, "a") as f:
+                f.write(line + "\n")
+
+    def _reply(self, status, body, content_type="text/plain"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.rstrip("/") != "/config":
+            return self._reply(404, b"not found\n")
+        mac = (parse_qs(url.query).get("mac") or [None])[0]
+        node_index, matched = self.configs.match(self.client_address[0], mac)
+        content = self.configs.content(node_index) if node_index is not None else None
+        if content is None:
+            self._log_fetch(404, node_index, matched, mac, 0)
+            return self._reply(404, b"no config for this node\n")
+        self._reply(200, content, "application/yaml")
+        self._log_fetch(200, node_index, matched, mac, len(content))
+        self.state.update({'workers': {node_index: {'config-fetched': int(time.time())}}})
+
+
+class ConfigServer(ThreadingHTTPServer):
+    """With TLS the listening socket accepts without a handshake; each connection shakes hands
+    in its own request thread under a timeout, so a client that stalls or speaks plain HTTP
+    never holds up the accept loop and the other nodes' fetches"""
+    daemon_threads = True
+    tls = False
+    # seconds for the handshake and, after it, for each read of the request
+    client_timeout = 10
+
+    def finish_request(self, request, client_address):
+        request.settimeout(self.client_timeout)
+        if self.tls:
+            try:
+                request.do_handshake()
+            except OSError as e:
+                # ssl.SSLError and socket.timeout are OSErrors; process_request_thread closes the socket
+                print(f"serve-configs: {client_address[0]} dropped, TLS handshake failed: {e}")
+                return
+        super().finish_request(request, client_address)
+
+
+def serve(config_folders, host, port=8090, tls_cert=None, tls_key=None, mac_networks=()):
+    """Start the server in a background thread, returns (server, base_url).
+    ?mac= lookups are only answered for clients in mac_networks."""
+    config_folders['logs_dir'].mkdir(parents=True, exist_ok=True)
+    handler = type("Handler", (ConfigHandler,), {
+        "configs": NodeConfigs(config_folders, mac_networks),
+        "state": StateStore(config_folders['state_file']),
+        "log_file": config_folders['logs_dir'] / "serve-configs.log",
+    })
+    server = ConfigServer((host, port), handler)
+    scheme = "http"
+    if tls_cert:
+        import ssl
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(tls_cert, tls_key)
+        server.socket = context.wrap_socket(server.socket, server_side=True, do_handshake_on_connect=False)
+        server.tls = True
+        scheme = "https"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"{scheme}://{host}:{server.server_address[1]}"
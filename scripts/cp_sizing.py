@@ -0,0 +1,85 @@
+"""
+Control plane sizing for the planned cluster scale
+
+Picks the HCloud server type of the control plane nodes and the etcd and
+kube-apiserver settings from the number of workers the cluster is planned
+for and their pod density:
+
+    cluster:
+        scale:
+            planned-workers: 60         # default: nodes in cluster_nodes_index.yaml
+            pods-per-node: 110
+            etcd-peer-rtt-ms: 2         # round trip between control plane nodes
+
+With `hetzner.cp-server-type: auto` the tier's server type is used.
+"""
+
+# (max workers, max pods, tier) - first tier that fits both wins
+CP_TIERS = [
+    (10, 1000, {
+        'name': 'small', 'server-type': 'ccx13',
+        'quota-backend-bytes': 2 * 1024**3, 'snapshot-count': 10000,
+        'max-requests-inflight': 400, 'max-mutating-requests-inflight': 200,
+        'kube-api-qps': 20, 'kube-api-burst': 30,
+    }),
+    (50, 5000, {
+        'name': 'medium', 'server-type': 'ccx23',
+        'quota-backend-bytes': 4 * 1024**3, 'snapshot-count': 10000,
+        'max-requests-inflight': 800, 'max-mutating-requests-inflight': 400,
+        'kube-api-qps': 50, 'kube-api-burst': 100,
+    }),
+    (150, 15000, {
+        'name': 'large', 'server-type': 'ccx33',
+        'quota-backend-bytes': 8 * 1024**3, 'snapshot-count': 25000,
+        'max-requests-inflight': 1600, 'max-mutating-requests-inflight': 800,
+        'kube-api-qps': 100, 'kube-api-burst': 200,
+    }),
+    (None, None, {
+        'name': 'xlarge', 'server-type': 'ccx43',
+        'quota-backend-bytes': 8 * 1024**3, 'snapshot-count': 50000,
+        'max-requests-inflight': 3000, 'max-mutating-requests-inflight': 1000,
+        'kube-api-qps': 200, 'kube-api-burst': 400,
+    }),
+]
+
+# dedicated vCPU types in size order, to tell whether a fixed type is below the recommendation
+CCX_ORDER = ['ccx13', 'ccx23', 'ccx33', 'ccx43', 'ccx53', 'ccx63']
+
+DEFAULT_PODS_PER_NODE = 110
+# etcd defaults; heartbeat should be about the peer round trip and the election timeout 10x that
+MIN_HEARTBEAT_MS = 100
+MIN_ELECTION_TIMEOUT_MS = 1000
+
+
+def control_plane_sizing(scale, planned_workers_default):
+    """Tier and rendered settings for the control plane, from cluster.scale"""
+    scale = scale or {}
+    workers = int(scale.get('planned-workers') or planned_workers_default)
+    pods_per_node = int(scale.get('pods-per-node') or DEFAULT_PODS_PER_NODE)
+    pods = workers * pods_per_node
+
+    for max_workers, max_pods, tier in CP_TIERS:
+        if max_workers is None or (workers <= max_workers and pods <= max_pods):
+            sizing = dict(tier)
+            break
+
+    rtt = float(scale.get('etcd-peer-rtt-ms') or 0)
+    heartbeat = max(MIN_HEARTBEAT_MS, int(rtt * 1.5))
+    sizing.update({
+        'planned-workers': workers,
+        'pods-per-node': pods_per_node,
+        'planned-pods': pods,
+        'heartbeat-interval': heartbeat,
+        'election-timeout': max(MIN_ELECTION_TIMEOUT_MS, heartbeat * 10),
+    })
+    return sizing
+
+
+def resolve_cp_server_type(configured, sizing):
+    """Server type to create control plane nodes with; warns when a fixed type is below the tier's"""
+    if not configured or configured == 'auto':
+        return sizing['server-type']
+    if configured in CCX_ORDER and CCX_ORDER.index(configured) < CCX_ORDER.index(sizing['server-type']):
+        print(f"⚠ Warning: cp-server-type {configured} is below the {sizing['server-type']} recommended for "
+              f"{sizing['planned-workers']} workers / {sizing['planned-pods']} pods")
+    return configured
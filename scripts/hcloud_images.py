@@ -0,0 +1,184 @@
+"""
+Registry of Talos snapshots in HCloud, keyed by schematic ID, Talos version and arch
+
+Snapshots are labelled with what they were built from:
+
+    talos-builder/schematic: 376567988ad370138ad8b2698212367b8edcb69b5fd68c80be1f2ec7d603b4b
+    talos-builder/version:   v1.10.3
+    talos-builder/arch:      amd64
+
+(label values are limited to 63 characters, the schematic ID is truncated
+to fit). Every cluster in the HCloud project looks its snapshot up by these
+labels first, so a second cluster on the same schematic and version reuses
+the snapshot instead of uploading another one. HCloud snapshots can be used
+in every location, one snapshot per key serves all CP datacenters.
+
+Each cluster using a snapshot adds a `cluster.talos-builder/<name>` label
+to it and removes that label from the snapshot it used before. Snapshots
+with neither a cluster label nor a server running from them are garbage.
+
+Builds of one key are serialized with a flock in the storage dir, so
+concurrent runs (e.g. `config.py -c a -c b hcloud-image`) build it once.
+"""
+
+import fcntl
+import json
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+from tracing import traced_run
+
+LABEL_PREFIX = "talos-builder/"
+CLUSTER_LABEL_PREFIX = "cluster.talos-builder/"
+KEY_LABELS = ("schematic", "version", "arch")
+# hcloud-upload-image --architecture
+SERVER_ARCH = {"amd64": "x86", "arm64": "arm"}
+
+
+def key_labels(schematic_id, talos_version, arch):
+    """The labels identifying the snapshot of a schematic, Talos version and arch"""
+    return {
+        f"{LABEL_PREFIX}schematic": schematic_id[:63],
+        f"{LABEL_PREFIX}version": talos_version,
+        f"{LABEL_PREFIX}arch": arch,
+    }
+
+
+def cluster_label(cluster_name):
+    return f"{CLUSTER_LABEL_PREFIX}{cluster_name}"
+
+
+def _hcloud_json(command):
+    result = traced_run(command + ["-o", "json"], capture_output=True, text=True, check=True)
+    return json.loads(result.stdout) or []
+
+
+def _created(image):
+    return datetime.fromisoformat(image['created'].replace("Z", "+00:00"))
+
+
+def registry_snapshots(labels=None):
+    """Snapshots in the registry (all, or those matching labels), newest first"""
+    selector = ",".join(f"{k}={v}" for k, v in labels.items()) if labels else f"{LABEL_PREFIX}schematic"
+    images = _hcloud_json(["hcloud", "image", "list", "--type", "snapshot", "-l", selector])
+    return sorted(images, key=_created, reverse=True)
+
+
+def find_snapshot(schematic_id, talos_version, arch):
+    """The newest available snapshot for the key, or None"""
+    images = [image for image in registry_snapshots(key_labels(schematic_id, talos_version, arch))
+              if image.get('status', 'available') == 'available']
+    return images[0] if images else None
+
+
+def clusters_of(image):
+    """Names of the clusters referencing a snapshot"""
+    return sorted(k[len(CLUSTER_LABEL_PREFIX):] for k in (image.get('labels') or {}) if k.startswith(CLUSTER_LABEL_PREFIX))
+
+
+def _download(url, output_file):
+    if output_file.is_file():
+        print(f"found {output_file}, will not re-download")
+        return
+    # a partial download never looks like a complete image
+    partial = output_file.with_name(output_file.name + ".part")
+    print(f"wget {url} -O {partial}")
+    traced_run(["wget", url, "-O", str(partial)], check=True)
+    partial.replace(output_file)
+
+
+def build_snapshot(schematic_id, talos_version, arch, location, storage_dir, upload_bin, factory_url):
+    """Download the hcloud image from the Image Factory and upload it as a labelled snapshot.
+    Returns the snapshot; when another run built it in the meantime, that one."""
+    storage_dir = Path(storage_dir)
+    storage_dir.mkdir(parents=True, exist_ok=True)
+    name = f"hcloud-{arch}-{talos_version}-{schematic_id[:12]}"
+    with open(storage_dir / f"{name}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        image = find_snapshot(schematic_id, talos_version, arch)
+        if image:
+            print(f"✓ snapshot {image['id']} was built by another run meanwhile")
+            return image
+
+        output_file = storage_dir / f"{name}.raw.xz"
+        _download(f"{factory_url}/image/{schematic_id}/{talos_version}/hcloud-{arch}.raw.xz", output_file)
+
+        labels = key_labels(schematic_id, talos_version, arch)
+        print(f"Uploading {output_file} as a snapshot (temporary server in {location})")
+        traced_run([
+            upload_bin, "upload",
+            "--image-path", str(output_file.resolve()),
+            "--architecture", SERVER_ARCH[arch],
+            "--compression", "xz",
+            "--location", location,
+            "--description", f"talos {talos_version} {arch} {schematic_id[:12]}",
+            "--labels", ",".join(f"{k}={v}" for k, v in labels.items()),
+        ], env=os.environ.copy(), check=True)
+
+        image = find_snapshot(schematic_id, talos_version, arch)
+        if not image:
+            raise RuntimeError(f"uploaded snapshot for {name} not found by its labels")
+        print(f"✓ built snapshot {image['id']}")
+        return image
+
+
+def _labels_of(image_id):
+    return (_hcloud_json(["hcloud", "image", "describe", str(image_id)]) or {}).get('labels') or {}
+
+
+def add_reference(image_id, cluster_name, attempts=3, settle=2):
+    """Label the snapshot as used by the cluster. add-label rewrites all labels of the image,
+    a concurrent add or remove from another cluster can drop ours, even after we read it back.
+    The label only counts once it is still there `settle` seconds (plus jitter) after the write;
+    otherwise it is written again. hcloud-image-gc re-labels the current image and keeps young
+    snapshots, which covers a label lost after that."""
+    label = cluster_label(cluster_name)
+    for _ in range(attempts):
+        if label not in _labels_of(image_id):
+            traced_run(["hcloud", "image", "add-label", "--overwrite", str(image_id), f"{label}=true"],
+                       capture_output=True, text=True, check=True)
+        time.sleep(settle + random.uniform(0, settle))
+        if label in _labels_of(image_id):
+            return True
+    print(f"⚠ Warning: could not label snapshot {image_id} with {label}")
+    return False
+
+
+def release_other_snapshots(image_id, cluster_name):
+    """Remove the cluster's label from every other snapshot in the registry; returns their ids"""
+    label = cluster_label(cluster_name)
+    released = []
+    for image in registry_snapshots():
+        if image['id'] != image_id and label in (image.get('labels') or {}):
+            traced_run(["hcloud", "image", "remove-label", str(image['id']), label],
+                       capture_output=True, text=True, check=True)
+            released.append(image['id'])
+    return released
+
+
+def garbage(min_age_hours=24):
+    """Snapshots in the registry no cluster references and no server runs from.
+    Snapshots younger than min_age_hours are kept, another run may be about to label them."""
+    in_use = {server['image']['id'] for server in _hcloud_json(["hcloud", "server", "list"]) if server.get('image')}
+    now = datetime.now(timezone.utc)
+    return [image for image in registry_snapshots()
+            if not clusters_of(image) and image['id'] not in in_use
+            and (now - _created(image)).total_seconds() >= min_age_hours * 3600]
+
+
+def delete_snapshots(images, max_concurrency=8):
+    """Delete snapshots concurrently; returns {image id: True/False}"""
+    def delete(image):
+        result = traced_run(["hcloud", "image", "delete", str(image['id'])], capture_output=True, text=True, check=False)
+        if result.returncode:
+            print(f"✗ snapshot {image['id']}: {result.stderr.strip()}")
+        return result.returncode == 0
+
+    if not images:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(len(images), max_concurrency)) as pool:
+        return dict(zip((image['id'] for image in images), pool.map(delete, images)))
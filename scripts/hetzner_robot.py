@@ -1,5 +1,5 @@
 """
-Hetzner Robot API Client for vSwitch Management
+Hetzner Robot API Client for vSwitch and Server Management
 
 This script provides functions to:
 - Create a new vSwitch
@@ -7,6 +7,9 @@ This script provides functions to:
 - Add servers to a vSwitch
 - Remove servers from a vSwitch
 - Delete a vSwitch
+- List servers
+- Activate the rescue system
+- Reset (reboot) servers
 
 Requirements:
     pip install requests
@@ -20,14 +23,21 @@ Setup:
     2. Set environment variables or provide credentials directly:
        export HETZNER_ROBOT_USER="your_username"
        export HETZNER_ROBOT_PASSWORD="your_password"
+
+    3. Optionally point the client at a local stand-in (see robot_standin.py):
+       export HETZNER_ROBOT_URL="http://127.0.0.1:8089"
 """
 
 import os
+import time
 import requests
 from typing import Dict, List, Optional, Any
 from requests.auth import HTTPBasicAuth
 import json
 
+import metrics
+from tracing import span
+
 def format_json(arg):
     return json.dumps(arg, indent=2, sort_keys=True)
 
@@ -35,18 +45,31 @@ class HetznerRobotAPI:
     """Client for Hetzner Robot API operations"""
     
     BASE_URL = "https://robot-ws.your-server.de"
+
+    # status codes worth retrying: rate limit and temporary unavailability. Rate limited requests
+    # were rejected before Robot applied them and are retried for every method; a 503 can come
+    # after a POST was applied (a second hardware reset, a 409 on the now active rescue), so it
+    # is only retried for idempotent methods
+    RETRY_STATUS_CODES = (429, 503)
+    IDEMPOTENT_METHODS = ("GET", "DELETE")
+    # Robot reports its request limits as 403 with this error code
+    RATE_LIMIT_ERROR_CODE = "RATE_LIMIT_EXCEEDED"
     
-    def __init__(self, username: str, password: str):
+    def __init__(self, username: str, password: str, base_url: Optional[str] = None, max_retries: int = 4):
         """
         Initialize the Hetzner Robot API client
         
         Args:
             username: Hetzner Robot web service user
             password: Hetzner Robot web service password
+            base_url: API URL (default: HETZNER_ROBOT_URL env var or BASE_URL)
+            max_retries: Retries for rate limited / unavailable responses
         """
         self.username = username
         self.password = password
         self.auth = HTTPBasicAuth(username, password)
+        self.base_url = (base_url or os.getenv("HETZNER_ROBOT_URL") or self.BASE_URL).rstrip("/")
+        self.max_retries = max_retries
     
     def _make_request(
         self, 
@@ -68,9 +91,9 @@ class HetznerRobotAPI:
             Parsed API response
             
         Raises:
-            requests.HTTPError: If request fails
+            requests.HTTPError: If request fails (after retries for rate limits, and 503 on GET/DELETE)
         """
-        url = self.BASE_URL + endpoint
+        url = self.base_url + endpoint
         if json_format:
             url += ".json"
         
@@ -80,14 +103,32 @@ class HetznerRobotAPI:
         }
         
         try:
-            response = requests.request(
-                method=method,
-                url=url,
-                auth=self.auth,
-                data=data,
-                headers=headers,
-                timeout=30
-            )
+            for attempt in range(self.max_retries + 1):
+                with span(f"{method} {endpoint}", kind="http", url=url, attempt=attempt) as s:
+                    response = requests.request(
+                        method=method,
+                        url=url,
+                        auth=self.auth,
+                        data=data,
+                        headers=headers,
+                        timeout=30
+                    )
+                    s.exit_status = response.status_code
+                    s.add_bytes(len(response.content))
+                labels = {"api": "robot", "endpoint": metrics.endpoint_label(endpoint), "method": method}
+                metrics.observe("hetzner_api_request_duration_seconds", s.duration, **labels)
+                metrics.inc("hetzner_api_requests_total", status=response.status_code, **labels)
+                metrics.inc("hetzner_api_response_bytes_total", len(response.content), api="robot")
+                throttled = self._is_throttled(response)
+                if throttled:
+                    metrics.inc("hetzner_api_throttled_total", api="robot", operation=labels["endpoint"])
+                retry = throttled or (response.status_code in self.RETRY_STATUS_CODES and method in self.IDEMPOTENT_METHODS)
+                if not retry or attempt == self.max_retries:
+                    break
+                metrics.inc("hetzner_api_retries_total", status=response.status_code, **labels)
+                delay = self._retry_delay(response, attempt)
+                print(f"⚠ Robot API {method} {endpoint} returned {response.status_code}, retrying in {delay:.0f}s")
+                time.sleep(delay)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.HTTPError as e:
@@ -98,6 +139,26 @@ class HetznerRobotAPI:
             print(f"Request failed: {e}")
             raise
     
+    @classmethod
+    def _is_throttled(cls, response) -> bool:
+        """True for a rate limited response: 429, or Robot's 403 RATE_LIMIT_EXCEEDED"""
+        if response.status_code == 429:
+            return True
+        if response.status_code != 403:
+            return False
+        try:
+            return response.json()["error"]["code"] == cls.RATE_LIMIT_ERROR_CODE
+        except (ValueError, KeyError, TypeError):
+            return False
+
+    @staticmethod
+    def _retry_delay(response, attempt: int) -> float:
+        """Seconds to wait before a retry: Retry-After if given, else exponential backoff"""
+        retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return float(retry_after)
+        return min(2 ** attempt * 2, 60)
+
     def create_vswitch(self, name: str, vlan: int) -> Dict[str, Any]:
         """
         Create a new vSwitch
@@ -212,3 +273,81 @@ class HetznerRobotAPI:
         print(f"✓ vSwitch {vswitch_id} deleted successfully")
         return response
 
+    def list_servers(self) -> List[Dict[str, Any]]:
+        """
+        List all servers of the account
+        
+        Returns:
+            List of server details (server_ip, server_number, server_name, ...)
+        """
+        response = self._make_request("GET", "/server")
+        return [entry["server"] for entry in response]
+    
+    def get_rescue(self, server_number: int) -> Dict[str, Any]:
+        """
+        Get rescue system boot options of a server
+        
+        Args:
+            server_number: Robot server number
+            
+        Returns:
+            Rescue system details (active, os, ...)
+        """
+        response = self._make_request("GET", f"/boot/{server_number}/rescue")
+        return response["rescue"]
+    
+    def activate_rescue(
+        self,
+        server_number: int,
+        os_name: str = "linux",
+        authorized_keys: Optional[List[str]] = None
+    ) -> Dict[str, Any]:
+        """
+        Activate the rescue system for the next boot of a server
+        
+        Args:
+            server_number: Robot server number
+            os_name: Rescue system OS (linux, vkvm, ...)
+            authorized_keys: Fingerprints of Robot SSH keys allowed to log in
+            
+        Returns:
+            Rescue system details (includes the root password)
+        """
+        data = {"os": os_name}
+        if authorized_keys:
+            data["authorized_key[]"] = authorized_keys
+        
+        print(f"Activating rescue system for server {server_number}...")
+        response = self._make_request("POST", f"/boot/{server_number}/rescue", data=data)
+        print(f"✓ Rescue system activated for server {server_number}")
+        return response["rescue"]
+
+    def deactivate_rescue(self, server_number: int) -> Dict[str, Any]:
+        """
+        Deactivate the rescue system of a server
+        
+        Args:
+            server_number: Robot server number
+            
+        Returns:
+            Rescue system details
+        """
+        print(f"Deactivating rescue system for server {server_number}...")
+        response = self._make_request("DELETE", f"/boot/{server_number}/rescue")
+        return response["rescue"]
+    
+    def reset_server(self, server_number: int, reset_type: str = "hw") -> Dict[str, Any]:
+        """
+        Reset a server
+        
+        Args:
+            server_number: Robot server number
+            reset_type: sw (CTRL+ALT+DEL), hw (hardware reset) or power (power cycle)
+            
+        Returns:
+            API response
+        """
+        print(f"Resetting server {server_number} ({reset_type})...")
+        response = self._make_request("POST", f"/reset/{server_number}", data={"type": reset_type})
+        print(f"✓ Server {server_number} reset")
+        return response["reset"]
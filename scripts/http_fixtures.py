@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+Record/replay HTTP fixtures for the Robot, HCloud and Talos Image Factory APIs
+
+record: a local proxy that forwards to the real services and saves every
+request/response pair to <fixtures>/<service>.json, with credentials
+stripped (Authorization, cookies, and password/token/key fields in JSON
+bodies). Bodies over --max-body are kept in <fixtures>/blobs/.
+
+replay: serves the saved responses from memory, so provisioning flows run
+offline and deterministically. Requests are matched by service, method,
+path and query; repeated requests get the recorded responses in order (the
+last one repeats). On top of that it can add latency (fixed, or the
+recorded duration) and inject failures: rate limits (429 with Retry-After;
+403 RATE_LIMIT_EXCEEDED for Robot), 503 and slow responses, drawn from a
+seeded RNG.
+
+Clients are pointed at the proxy per service:
+
+    export HETZNER_ROBOT_URL=http://127.0.0.1:8095/robot
+    export HCLOUD_ENDPOINT=http://127.0.0.1:8095/hcloud
+    export TALOS_FACTORY_URL=http://127.0.0.1:8095/factory
+
+Usage:
+    uv run scripts/http_fixtures.py record --fixtures fixtures/
+    uv run scripts/http_fixtures.py replay --fixtures fixtures/ --latency 0.05 --error-rate 0.1 --seed 1
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qsl, urlencode, urlparse
+
+UPSTREAMS = {
+    "robot": "https://robot-ws.your-server.de",
+    "hcloud": "https://api.hetzner.cloud/v1",
+    "factory": "https://factory.talos.dev",
+}
+ENV_VARS = {"robot": "HETZNER_ROBOT_URL", "hcloud": "HCLOUD_ENDPOINT", "factory": "TALOS_FACTORY_URL"}
+
+# never written to fixtures
+SECRET_HEADERS = {"authorization", "cookie", "set-cookie", "proxy-authorization"}
+SECRET_FIELDS = ("password", "token", "secret", "private_key", "api_key")
+# hop-by-hop and length headers are set by the server that replays
+SKIP_HEADERS = SECRET_HEADERS | {"connection", "keep-alive", "transfer-encoding", "content-encoding", "content-length",
+                                 "date", "server"}
+REDACTED = "REDACTED"
+
+
+def sanitize(value):
+    """JSON value with every password/token/secret-like field replaced"""
+    if isinstance(value, dict):
+        return {k: REDACTED if any(f in k.lower() for f in SECRET_FIELDS) and isinstance(v, (str, int))
+                else sanitize(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [sanitize(v) for v in value]
+    return value
+
+
+def request_key(service, method, path, query):
+    """Match key of a request: query parameters in sorted order, secrets left out"""
+    params = sorted((k, v) for k, v in parse_qsl(query, keep_blank_values=True)
+                    if not any(f in k.lower() for f in SECRET_FIELDS))
+    return f"{service} {method} {path}" + (f"?{urlencode(params)}" if params else "")
+
+
+class FixtureStore:
+    """Interactions per service in <dir>/<service>.json"""
+
+    def __init__(self, directory, max_body=1024 * 1024):
+        self.dir = Path(directory)
+        self.max_body = max_body
+        self.lock = threading.Lock()
+
+    def _file(self, service):
+        return self.dir / f"{service}.json"
+
+    def load(self, service):
+        try:
+            with open(self._file(service)) as f:
+                return json.load(f)["interactions"]
+        except FileNotFoundError:
+            return []
+
+    def encode_body(self, content, content_type):
+        """Fixture fields for a response body: sanitized JSON, text, base64, or a blob file"""
+        if len(content) > self.max_body:
+            digest = hashlib.sha256(content).hexdigest()
+            blob = self.dir / "blobs" / digest
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            if not blob.exists():
+                blob.write_bytes(content)
+            return {"body_file": f"blobs/{digest}"}
+        if "json" in content_type:
+            try:
+                return {"json": sanitize(json.loads(content))}
+            except ValueError:
+                pass
+        try:
+            return {"body": content.decode()}
+        except UnicodeDecodeError:
+            return {"body_base64": base64.b64encode(content).decode()}
+
+    def decode_body(self, interaction):
+        if "json" in interaction:
+            return json.dumps(interaction["json"]).encode()
+        if "body_file" in interaction:
+            return (self.dir / interaction["body_file"]).read_bytes()
+        if "body_base64" in interaction:
+            return base64.b64decode(interaction["body_base64"])
+        return interaction.get("body", "").encode()
+
+    def append(self, service, interaction):
+        """Add one interaction; the file is replaced atomically"""
+        with self.lock:
+            self.dir.mkdir(parents=True, exist_ok=True)
+            interactions = self.load(service) + [interaction]
+            fd, tmp_path = tempfile.mkstemp(dir=self.dir, prefix=f".{service}.")
+            with os.fdopen(fd, "w") as f:
+                json.dump({"service": service, "upstream": UPSTREAMS.get(service), "interactions": interactions},
+                          f, indent=1)
+            os.replace(tmp_path, self._file(service))
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    store = None
+    upstreams = None
+
+    def log_message(self, format, *args):
+        print(f"fixtures: {self.command} {self.path} -> {args[1] if len(args) > 1 else ''}")
+
+    def _service_path(self):
+        """(service, path below the service prefix, query) of the request"""
+        url = urlparse(self.path)
+        service, _, rest = url.path.lstrip("/").partition("/")
+        return service, "/" + rest, url.query
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else None
+
+    def _reply(self, status, body, headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status, message, headers=(), code="FIXTURES"):
+        body = json.dumps({"error": {"status": status, "code": code, "message": message}}).encode()
+        self._reply(status, body, [("Content-Type", "application/json")] + list(headers))
+
+    def do_GET(self):
+        self.handle_request()
+
+    do_POST = do_PUT = do_DELETE = do_PATCH = do_GET
+
+
+class RecordHandler(FixtureHandler):
+    """Forwards to the real service and saves the sanitized exchange"""
+
+    def handle_request(self):
+        import requests
+
+        service, path, query = self._service_path()
+        if service not in self.upstreams:
+            return self._error(404, f"unknown service {service}, expected one of {', '.join(self.upstreams)}")
+        url = self.upstreams[service] + path + (f"?{query}" if query else "")
+        headers = {k: v for k, v in self.headers.items() if k.lower() not in ("host", "content-length", "connection")}
+        started = time.monotonic()
+        response = requests.request(self.command, url, headers=headers, data=self._body(), timeout=300,
+                                    allow_redirects=False)
+        duration = time.monotonic() - started
+        content_type = response.headers.get("Content-Type", "")
+        interaction = {
+            "method": self.command,
+            "path": path,
+            "query": query,
+            "status": response.status_code,
+            "headers": [[k, v] for k, v in response.headers.items() if k.lower() not in SKIP_HEADERS],
+            "duration": round(duration, 3),
+        }
+        interaction.update(self.store.encode_body(response.content, content_type))
+        self.store.append(service, interaction)
+        self._reply(response.status_code, response.content, interaction["headers"])
+
+
+class ReplayState:
+    """Recorded responses by request key, with a cursor per key"""
+
+    def __init__(self, store, services):
+        self.lock = threading.Lock()
+        self.responses = {}
+        self.cursors = {}
+        for service in services:
+            for interaction in store.load(service):
+                key = request_key(service, interaction["method"], interaction["path"], interaction["query"])
+                self.responses.setdefault(key, []).append(interaction)
+
+    def next(self, key):
+        with self.lock:
+            responses = self.responses.get(key)
+            if not responses:
+                return None
+            cursor = self.cursors.get(key, 0)
+            self.cursors[key] = cursor + 1
+            return responses[min(cursor, len(responses) - 1)]
+
+
+class ReplayHandler(FixtureHandler):
+    """Answers from the fixtures, with added latency and injected failures"""
+
+    state = None
+    latency = 0.0
+    recorded_latency = False
+    error_rate = 0.0
+    error_statuses = (429, 503)
+    retry_after = 1
+    slow_rate = 0.0
+    slow_seconds = 5.0
+    rng = None
+    rng_lock = threading.Lock()
+
+    def _draw(self):
+        with self.rng_lock:
+            return self.rng.random(), self.rng.random(), self.rng.choice(self.error_statuses)
+
+    def handle_request(self):
+        service, path, query = self._service_path()
+        self._body()
+        error_draw, slow_draw, error_status = self._draw()
+        if error_draw < self.error_rate:
+            time.sleep(self.latency)
+            if error_status == 429 and service == "robot":
+                # Robot reports its request limits as 403 RATE_LIMIT_EXCEEDED, not 429
+                return self._error(403, "injected rate limit", code="RATE_LIMIT_EXCEEDED")
+            headers = [("Retry-After", str(self.retry_after))] if error_status == 429 else []
+            return self._error(error_status, "injected failure", headers)
+
+        key = request_key(service, self.command, path, query)
+        interaction = self.state.next(key)
+        if interaction is None:
+            return self._error(404, f"no fixture for {key}")
+        time.sleep(interaction.get("duration", 0) if self.recorded_latency else self.latency)
+        if slow_draw < self.slow_rate:
+            time.sleep(self.slow_seconds)
+        self._reply(interaction["status"], self.store.decode_body(interaction), interaction["headers"])
+
+
+def serve(handler, port=0):
+    """Start a fixtures server in a background thread, returns (server, base_url)"""
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def record_handler(fixtures_dir, upstreams=None, max_body=1024 * 1024):
+    return type("Handler", (RecordHandler,), {"store": FixtureStore(fixtures_dir, max_body),
+                                              "upstreams": upstreams or UPSTREAMS})
+
+
+def replay_handler(fixtures_dir, latency=0.0, recorded_latency=False, error_rate=0.0, error_statuses=(429, 503),
+                   retry_after=1, slow_rate=0.0, slow_seconds=5.0, seed=0):
+    store = FixtureStore(fixtures_dir)
+    return type("Handler", (ReplayHandler,), {
+        "store": store,
+        "upstreams": UPSTREAMS,
+        "state": ReplayState(store, UPSTREAMS),
+        "latency": latency,
+        "recorded_latency": recorded_latency,
+        "error_rate": error_rate,
+        "error_statuses": tuple(error_statuses),
+        "retry_after": retry_after,
+        "slow_rate": slow_rate,
+        "slow_seconds": slow_seconds,
+        "rng": random.Random(seed),
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Record/replay HTTP fixtures for Robot, HCloud and the Talos factory')
+    parser.add_argument('mode', choices=['record', 'replay'])
+    parser.add_argument('--fixtures', default='fixtures', help='Fixture directory (default: fixtures)')
+    parser.add_argument('--port', type=int, default=8095, help='Port to listen on (default: 8095)')
+    parser.add_argument('--upstream', action='append', default=[], metavar='SERVICE=URL',
+                        help='Record: override a service URL, e.g. robot=https://robot-ws.your-server.de')
+    parser.add_argument('--max-body', type=int, default=1024 * 1024, help='Record: bodies larger than this go to blobs/ (default: 1MiB)')
+    parser.add_argument('--latency', type=float, default=0.0, help='Replay: seconds added to every response')
+    parser.add_argument('--recorded-latency', action='store_true', help='Replay: wait as long as the recorded response took')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Replay: share of requests answered with an error')
+    parser.add_argument('--error-status', default='429,503', help='Replay: injected statuses (default: 429,503)')
+    parser.add_argument('--retry-after', type=int, default=1, help='Replay: Retry-After of injected 429s (default: 1)')
+    parser.add_argument('--slow-rate', type=float, default=0.0, help='Replay: share of responses delayed by --slow-seconds')
+    parser.add_argument('--slow-seconds', type=float, default=5.0, help='Replay: delay of slow responses (default: 5)')
+    parser.add_argument('--seed', type=int, default=0, help='Replay: seed of the failure injection (default: 0)')
+    args = parser.parse_args()
+
+    if args.mode == 'record':
+        upstreams = dict(UPSTREAMS) | dict(u.split("=", 1) for u in args.upstream)
+        handler = record_handler(args.fixtures, upstreams, args.max_body)
+    else:
+        handler = replay_handler(args.fixtures, args.latency, args.recorded_latency, args.error_rate,
+                                 [int(s) for s in args.error_status.split(",")], args.retry_after,
+                                 args.slow_rate, args.slow_seconds, args.seed)
+        print(f"✓ {sum(len(r) for r in handler.state.responses.values())} recorded responses loaded from {args.fixtures}")
+
+    server, base_url = serve(handler, args.port)
+    print(f"✓ Fixtures {args.mode} server listening on {base_url}")
+    for service, env_var in ENV_VARS.items():
+        print(f"  export {env_var}={base_url}/{service}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
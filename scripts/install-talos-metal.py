@@ -7,12 +7,25 @@ import paramiko
 from pathlib import Path
 import yaml
 import time
+import re
+import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from tracing import span, traced_write_file, print_summary, write_trace
+from progress import FleetProgress
+from ssh_engine import SSHEngine
+from state_store import StateStore, deep_merge
+
+TALOS_FACTORY_URL = os.environ.get('TALOS_FACTORY_URL', 'https://factory.talos.dev')
 
 class SSHConnection:
-    def __init__(self, hostname, username, key_file):
+    def __init__(self, hostname, username, key_file, port=22):
         self.hostname = hostname
         self.username = username
         self.key_file = key_file
+        self.port = port
         self.client = None
         
     def connect(self):
@@ -22,6 +35,7 @@ class SSHConnection:
             self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
             self.client.connect(
                 hostname=self.hostname,
+                port=self.port,
                 username=self.username,
                 key_filename=self.key_file
             )
@@ -39,8 +53,10 @@ class SSHConnection:
         """Run command with error tolerance"""
         print(f"Running: {cmd}")
         try:
-            stdin, stdout, stderr = self.client.exec_command(cmd)
-            exit_code = stdout.channel.recv_exit_status()
+            with span(cmd, kind="ssh", host=self.hostname) as s:
+                stdin, stdout, stderr = self.client.exec_command(cmd)
+                exit_code = stdout.channel.recv_exit_status()
+                s.exit_status = exit_code
             if exit_code == 0:
                 print(f"✓ Success: {cmd}")
             else:
@@ -52,11 +68,14 @@ class SSHConnection:
         """Run critical command that must succeed"""
         print(f"Running critical command: {cmd}")
         try:
-            stdin, stdout, stderr = self.client.exec_command(cmd)
-            exit_code = stdout.channel.recv_exit_status()
-            output = stdout.read().decode().strip()
-            error = stderr.read().decode().strip()
-            
+            with span(cmd, kind="ssh", host=self.hostname) as s:
+                stdin, stdout, stderr = self.client.exec_command(cmd)
+                exit_code = stdout.channel.recv_exit_status()
+                output = stdout.read().decode().strip()
+                error = stderr.read().decode().strip()
+                s.exit_status = exit_code
+                s.add_bytes(len(output) + len(error))
+
             if exit_code != 0:
                 print(f"✗ Error: Critical command failed: {cmd}")
                 print(f"stderr: {error}")
@@ -67,17 +86,211 @@ class SSHConnection:
             print(f"✗ Error: Critical command failed with exception: {cmd}: {e}")
             sys.exit(1)
 
+    def run_streaming(self, cmd, on_line, should_abort=None):
+        """Run critical command, passing each line of stdout/stderr to on_line as it arrives.
+        `\r` counts as a line end, so `dd status=progress` updates are seen live."""
+        print(f"Running critical command: {cmd}")
+        try:
+            with span(cmd, kind="ssh", host=self.hostname) as s:
+                channel = self.client.get_transport().open_session()
+                channel.exec_command(cmd)
+                pending = {'out': '', 'err': ''}
+                tail = []
+                received = 0
+                while True:
+                    idle = True
+                    for name, ready, recv in (('out', channel.recv_ready, channel.recv),
+                                              ('err', channel.recv_stderr_ready, channel.recv_stderr)):
+                        if not ready():
+                            continue
+                        idle = False
+                        data = recv(32768)
+                        received += len(data)
+                        lines = re.split(r'[\r\n]', pending[name] + data.decode(errors='replace'))
+                        pending[name] = lines.pop()
+                        for line in lines:
+                            if line.strip():
+                                on_line(line)
+                                tail = (tail + [line])[-20:]
+                    if idle and channel.exit_status_ready():
+                        break
+                    if should_abort and should_abort():
+                        channel.close()
+                        print(f"✗ Error: Aborted stalled command on {self.hostname}: {cmd}")
+                        sys.exit(1)
+                    if idle:
+                        time.sleep(0.2)
+                for line in pending.values():
+                    if line.strip():
+                        on_line(line)
+                exit_code = channel.recv_exit_status()
+                s.exit_status = exit_code
+                s.add_bytes(received)
+
+            if exit_code != 0:
+                print(f"✗ Error: Critical command failed: {cmd}")
+                print("output: " + "\n".join(tail))
+                sys.exit(1)
+            print(f"✓ Success: {cmd}")
+        except SystemExit:
+            raise
+        except Exception as e:
+            print(f"✗ Error: Critical command failed with exception: {cmd}: {e}")
+            sys.exit(1)
+
     def get_command_output(self, cmd):
         """Get command output without error handling"""
         try:
-            stdin, stdout, stderr = self.client.exec_command(cmd)
-            return stdout.read().decode().strip()
+            with span(cmd, kind="ssh", host=self.hostname) as s:
+                stdin, stdout, stderr = self.client.exec_command(cmd)
+                output = stdout.read().decode().strip()
+                s.exit_status = stdout.channel.recv_exit_status()
+                s.add_bytes(len(output))
+            return output
         except Exception:
             return ""
 
+class PooledSSHConnection(SSHConnection):
+    """SSHConnection on a client owned by SSHEngine; the engine connects and closes it"""
+
+    def __init__(self, hostname, client):
+        super().__init__(hostname, None, None)
+        self.client = client
+
+    def connect(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+# dd invocations per write mode; `bs` is large so syscalls and flushes do not dominate
+WRITE_MODES = {
+    # original behaviour: synchronous flush after every 4MB block
+    'sync': "bs=4M oflag=sync",
+    # O_DIRECT with large aligned blocks, bypasses the page cache; one fsync at the end
+    'direct': "bs=16M iflag=fullblock oflag=direct conv=fsync",
+    # page cache writes with a single fsync at the end
+    'buffered': "bs=16M iflag=fullblock conv=fsync",
+    # skip all-zero blocks; the target range is zeroed first with blkdiscard -z
+    'sparse': "bs=4M iflag=fullblock conv=sparse,fsync",
+}
+
+
+def choose_write_mode(ssh, disk_name):
+    """Pick a write mode for the disk type: direct I/O for NVMe/SSD, buffered for spinning disks"""
+    info = ssh.get_command_output(f"lsblk -dn -o ROTA,TRAN /dev/{disk_name}").split()
+    rotational = info[0] == "1" if info else False
+    transport = info[1] if len(info) > 1 else ""
+    mode = 'buffered' if rotational else 'direct'
+    print(f"  disk {disk_name}: rotational={rotational} transport={transport or '?'} -> write mode '{mode}'")
+    return mode
+
+
+def write_image(ssh, image_path, disk_name, image_size, fleet, write_mode='auto'):
+    """Write the image to the disk with the selected dd strategy, reporting progress"""
+    if write_mode == 'auto':
+        write_mode = choose_write_mode(ssh, disk_name)
+
+    if write_mode == 'sparse':
+        if not image_size:
+            print("✗ Error: sparse write mode needs the image size")
+            sys.exit(1)
+        # holes are not written, so the range they land in must read back as zeros
+        ssh.run_critical(f"blkdiscard -z -o 0 -l {(image_size + 4095) // 4096 * 4096} /dev/{disk_name}")
+
+    print(f"=== Writing Talos image to {disk_name} (mode: {write_mode}) ===")
+    tracker = fleet.tracker(ssh.hostname, "dd", total=image_size or None)
+    ssh.run_streaming(f"dd if={image_path} of=/dev/{disk_name} {WRITE_MODES[write_mode]} status=progress",
+                      tracker.feed_dd, should_abort=tracker.should_abort)
+    tracker.finish()
+    print(f"✓ {tracker.line()}")
+    metrics.inc("install_disk_write_bytes_total", tracker.done, write_mode=write_mode)
+    metrics.observe("install_disk_write_mb_per_second", (tracker.rate() or 0) / 1e6, write_mode=write_mode)
+    return write_mode
+
+
+def verify_written_image(ssh, disk_name, image_size, expected_hash, fleet):
+    """Hash exactly the written byte range of the disk and compare it with the download hash"""
+    print(f"=== Verifying {image_size} bytes written to {disk_name} ===")
+    # read around the page cache so the hash reflects what is on the device
+    if image_size % 4096 == 0:
+        read_flags = "iflag=direct,count_bytes"
+    else:
+        ssh.run_tolerant(f"blockdev --flushbufs /dev/{disk_name}")
+        read_flags = "iflag=count_bytes"
+
+    tracker = fleet.tracker(ssh.hostname, "verify", total=image_size)
+    hashes = []
+
+    def on_line(line):
+        if re.match(r'^[0-9a-f]{64}\b', line):
+            hashes.append(line.split()[0])
+        else:
+            tracker.feed_dd(line)
+
+    ssh.run_streaming(f"dd if=/dev/{disk_name} bs=16M {read_flags} count={image_size} status=progress | sha256sum",
+                      on_line, should_abort=tracker.should_abort)
+    tracker.finish()
+
+    written_hash = hashes[-1] if hashes else None
+    if written_hash != expected_hash:
+        print(f"✗ Error: {ssh.hostname} {disk_name} does not match the downloaded image")
+        print(f"  downloaded sha256: {expected_hash}")
+        print(f"  on disk sha256:    {written_hash}")
+        sys.exit(1)
+    print(f"✓ Verified {disk_name}: sha256 {written_hash}")
+
+
 def reboot(ssh):
     ssh.run_tolerant("reboot")
 
+
+def kexec_talos(ssh, image_path="/tmp/metal-amd64.iso", talos_config_url=None):
+    """Boot the Talos kernel and initramfs from the downloaded ISO with kexec,
+    skipping the firmware/POST cycle of a full reboot. With talos_config_url the
+    node fetches its machine config from there at boot (`config.py serve-configs`).
+    Returns False when kexec could not be prepared; the caller should reboot instead."""
+    mount_dir = "/mnt/talos-iso"
+
+    print("=== Preparing kexec into Talos ===")
+    if not ssh.get_command_output("command -v kexec"):
+        ssh.run_tolerant("DEBIAN_FRONTEND=noninteractive apt-get install -y -qq kexec-tools")
+        if not ssh.get_command_output("command -v kexec"):
+            print("⚠ Warning: kexec is not available")
+            return False
+
+    ssh.run_tolerant(f"umount {mount_dir}")
+    mounted = ssh.get_command_output(f"mkdir -p {mount_dir} && mount -o loop,ro {image_path} {mount_dir} && echo mounted")
+    if mounted != "mounted":
+        print(f"⚠ Warning: could not mount {image_path}")
+        return False
+
+    # kernel arguments exactly as the ISO boot menu passes them (first entry)
+    cmdline = ssh.get_command_output(
+        f"grep -m1 -E '^\\s*linux\\s+/boot/vmlinuz' {mount_dir}/boot/grub/grub.cfg | sed -E 's@^\\s*linux\\s+/boot/vmlinuz\\s*@@'"
+    )
+    if not cmdline:
+        print("⚠ Warning: no kernel command line found in the ISO boot menu")
+        ssh.run_tolerant(f"umount {mount_dir}")
+        return False
+    if talos_config_url:
+        cmdline += f" talos.config={talos_config_url}"
+    print(f"  kernel command line: {cmdline}")
+
+    loaded = ssh.get_command_output(
+        f"kexec -l {mount_dir}/boot/vmlinuz --initrd={mount_dir}/boot/initramfs.xz "
+        f"--command-line='{cmdline}' && echo loaded"
+    )
+    if loaded != "loaded":
+        print("⚠ Warning: kexec could not load the Talos kernel")
+        ssh.run_tolerant(f"umount {mount_dir}")
+        return False
+
+    # detach, so the SSH command returns before the running kernel is replaced
+    ssh.run_tolerant("nohup sh -c 'sleep 2; sync; kexec -e' >/dev/null 2>&1 &")
+    print("✓ Booting into Talos maintenance mode with kexec")
+    return True
+
     
 def discover_disks(ssh):
     """Discover all disks and their metadata on the remote server.
@@ -145,8 +358,23 @@ def discover_disks(ssh):
     return disks
 
 
-def install_talos(ssh, talos_version, talos_schematic):
-    """Install Talos on the remote server"""
+def install_talos(ssh, talos_version, talos_schematic, fleet=None, write_mode='auto', verify=True):
+    """Install Talos on the remote server.
+    Download and write progress is reported through `fleet` (a FleetProgress);
+    a private one is used when installing a single host."""
+
+    own_fleet = fleet is None
+    if own_fleet:
+        fleet = FleetProgress()
+        fleet.start()
+    try:
+        return _install_talos(ssh, talos_version, talos_schematic, fleet, write_mode, verify)
+    finally:
+        if own_fleet:
+            fleet.stop()
+
+
+def _install_talos(ssh, talos_version, talos_schematic, fleet, write_mode, verify):
 
     print("=== Stopping RAID arrays (tolerating failures) ===")
     ssh.run_tolerant("mdadm --stop /dev/md0")
@@ -178,15 +406,21 @@ def install_talos(ssh, talos_version, talos_schematic):
     print(f"\n=== Downloading Talos image {talos_version} for schematic {talos_schematic} ===")
 
     # Change to /tmp directory and download
-    download_url = f"https://factory.talos.dev/image/{talos_schematic}/{talos_version}/metal-amd64.iso"
-    ssh.run_critical("cd /tmp && rm -f metal-amd64.iso")
+    download_url = f"{TALOS_FACTORY_URL}/image/{talos_schematic}/{talos_version}/metal-amd64.iso"
+    ssh.run_critical("cd /tmp && rm -f metal-amd64.iso metal-amd64.iso.sha256")
 
-    download_cmd = f'cd /tmp && wget -q "{download_url}"'
+    # hash the image while it streams in, so verification does not need a second read of the file
+    download_cmd = (f"cd /tmp && bash -o pipefail -c "
+                    f"'wget --progress=dot:mega -O - \"{download_url}\" | tee metal-amd64.iso | sha256sum > metal-amd64.iso.sha256'")
+    tracker = fleet.tracker(ssh.hostname, "download")
     try:
-        ssh.run_critical(download_cmd)
+        ssh.run_streaming(download_cmd, tracker.feed_wget, should_abort=tracker.should_abort)
     except:
         print("✗ Error: Failed to download Talos image")
         sys.exit(1)
+    tracker.finish()
+    metrics.inc("install_download_bytes_total", tracker.done)
+    metrics.observe("install_download_mb_per_second", (tracker.rate() or 0) / 1e6)
 
     # Verify download
     check_file = ssh.get_command_output("cd /tmp && ls -la metal-amd64.iso 2>/dev/null")
@@ -198,8 +432,14 @@ def install_talos(ssh, talos_version, talos_schematic):
 
     print("✓ Downloaded Talos image successfully")
 
-    print(f"=== Writing Talos image to {primary_disk['name']} ===")
-    ssh.run_critical(f"cd /tmp && dd of=/dev/{primary_disk['name']} bs=4M oflag=sync if=metal-amd64.iso")
+    image_size = int(ssh.get_command_output("stat -c %s /tmp/metal-amd64.iso") or 0)
+    image_hash = ssh.get_command_output("cut -d' ' -f1 /tmp/metal-amd64.iso.sha256")
+    print(f"  image size: {image_size} bytes, sha256: {image_hash}")
+
+    write_image(ssh, "/tmp/metal-amd64.iso", primary_disk['name'], image_size, fleet, write_mode)
+
+    if verify:
+        verify_written_image(ssh, primary_disk['name'], image_size, image_hash, fleet)
 
     print("\n=== Installation Complete ===")
     print(f"✓ Installed Talos on {primary_disk['name']}")
@@ -207,12 +447,17 @@ def install_talos(ssh, talos_version, talos_schematic):
     return disks
 
 
-def save_server_info(hostname, disks, config_dir):
-    """Save full disk metadata to discovery/<ip>.yaml"""
+def save_server_info(hostname, disks, config_dir, hardware=None):
+    """Save full disk metadata (and hardware inventory, if given) to discovery/<ip>.yaml.
+    Keys already in the file and not rewritten here (e.g. an earlier inventory) are kept."""
     discovery_dir = Path(config_dir) / "discovery"
     discovery_dir.mkdir(exist_ok=True)
 
     server_file = discovery_dir / f"{hostname}.yaml"
+    existing = {}
+    if server_file.is_file():
+        with open(server_file, 'r') as f:
+            existing = yaml.safe_load(f) or {}
 
     primary = disks[0]
     secondary = disks[1] if len(disks) > 1 else None
@@ -221,11 +466,25 @@ def save_server_info(hostname, disks, config_dir):
     primary_by_id = primary['by_id'][0] if primary['by_id'] else ''
     secondary_by_id = secondary['by_id'][0] if secondary and secondary['by_id'] else ''
 
+    # every non-install disk becomes a data disk mounted at /var/mnt/disk<N>
+    data_disks = []
+    for i, disk in enumerate(disks[1:], start=2):
+        if not disk['by_id']:
+            print(f"⚠ Warning: {disk['name']} has no /dev/disk/by-id link, not used as data disk")
+            continue
+        data_disks.append({
+            'name': f"disk{i}",
+            'device': f"/dev/disk/by-id/{disk['by_id'][0]}",
+            'serial': disk['serial'],
+            'mountpoint': f"/var/mnt/disk{i}",
+        })
+
     # Keys consumed by the node template
     server_info = {
         'PRIMARY_DISK_ID': primary['serial'],
         'PRIMARY_DISK_BY_ID': primary_by_id,
         'SECONDARY_DISK': f"/dev/disk/by-id/{secondary_by_id}" if secondary_by_id else '',
+        'DATA_DISKS': data_disks,
     }
 
     # Full disk metadata for reference
@@ -241,13 +500,218 @@ def save_server_info(hostname, disks, config_dir):
             'by_id': disk['by_id'],
         })
     server_info['disks'] = disk_list
+    if hardware:
+        server_info['hardware'] = hardware
+    server_info = existing | server_info
 
-    with open(server_file, 'w') as f:
-        yaml.dump(server_info, f, default_flow_style=False)
+    traced_write_file(server_file, yaml.dump(server_info, default_flow_style=False))
 
     print(f"✓ Server information saved to {server_file}")
     print(f"  PRIMARY_DISK_BY_ID: {primary_by_id}")
     print(f"  SECONDARY_DISK: /dev/disk/by-id/{secondary_by_id}")
+    for disk in data_disks:
+        print(f"  DATA_DISK {disk['mountpoint']}: {disk['device']}")
+
+def _lscpu_fields(entries, fields=None):
+    """Flatten `lscpu -J` output (flat in older, nested in newer util-linux) into {field: data}"""
+    fields = {} if fields is None else fields
+    for entry in entries:
+        fields[entry['field'].rstrip(':')] = entry.get('data')
+        _lscpu_fields(entry.get('children', []), fields)
+    return fields
+
+
+def collect_hardware(ssh):
+    """Read-only hardware inventory: CPU, RAM, NUMA layout, NICs and link speeds, disks"""
+    cpu = _lscpu_fields(json.loads(ssh.get_command_output("lscpu -J") or '{"lscpu": []}')['lscpu'])
+    sockets = int(cpu.get('Socket(s)') or 1)
+    cores = sockets * int(cpu.get('Core(s) per socket') or 0)
+
+    mem_kb = ssh.get_command_output("awk '/^MemTotal:/ {print $2}' /proc/meminfo")
+    numa_nodes = []
+    for line in ssh.get_command_output("grep -H MemTotal /sys/devices/system/node/node*/meminfo").splitlines():
+        # /sys/devices/system/node/node0/meminfo:Node 0 MemTotal:       65536 kB
+        match = re.search(r'node(\d+)/meminfo:.*MemTotal:\s+(\d+)', line)
+        if match:
+            node = int(match.group(1))
+            numa_nodes.append({
+                'node': node,
+                'cpus': cpu.get(f"NUMA node{node} CPU(s)", ''),
+                'memory_mb': int(match.group(2)) // 1024,
+            })
+
+    nics = []
+    nic_output = ssh.get_command_output(
+        "for d in /sys/class/net/*; do [ -e $d/device ] || continue; "
+        "echo \"$(basename $d) $(cat $d/address) $(cat $d/speed 2>/dev/null || echo -1) "
+        "$(basename $(readlink $d/device/driver) 2>/dev/null)\"; done"
+    )
+    for line in nic_output.splitlines():
+        parts = line.split()
+        if len(parts) >= 3:
+            nics.append({
+                'name': parts[0],
+                'mac': parts[1],
+                'speed_mbps': int(parts[2]) if parts[2].lstrip('-').isdigit() else -1,
+                'driver': parts[3] if len(parts) > 3 else '',
+            })
+
+    disks = []
+    lsblk = json.loads(ssh.get_command_output("lsblk -J -b -d -o NAME,SIZE,ROTA,TRAN,MODEL -e 1,7,11,14,15")
+                       or '{"blockdevices": []}')
+    for disk in lsblk['blockdevices']:
+        if not int(disk['size'] or 0):
+            continue
+        disks.append({
+            'name': disk['name'],
+            'size_gb': int(disk['size'] or 0) // 10**9,
+            'rotational': str(disk.get('rota')).lower() in ('1', 'true'),
+            'transport': disk.get('tran') or '',
+            'model': (disk.get('model') or '').strip(),
+        })
+
+    return {
+        'cpu': {
+            'model': cpu.get('Model name', ''),
+            'sockets': sockets,
+            'cores': cores,
+            'threads': int(cpu.get('CPU(s)') or 0),
+        },
+        'memory_mb': int(mem_kb or 0) // 1024,
+        'numa_nodes': numa_nodes,
+        'nics': nics,
+        'disks': disks,
+    }
+
+
+def hardware_profile_key(hardware):
+    """Attributes that put two hosts in the same hardware profile"""
+    disks = {}
+    for disk in hardware['disks']:
+        kind = 'hdd' if disk['rotational'] else (disk['transport'] or 'ssd')
+        label = f"{disk['size_gb']}G-{kind}"
+        disks[label] = disks.get(label, 0) + 1
+    return (
+        hardware['cpu']['model'],
+        hardware['cpu']['cores'],
+        # round to 8GB so small reservations by the firmware do not split profiles
+        max(round(hardware['memory_mb'] / 1024 / 8), 1) * 8,
+        len(hardware['numa_nodes']),
+        tuple(sorted(disks.items())),
+        max([nic['speed_mbps'] for nic in hardware['nics']] or [0]),
+    )
+
+
+def group_hardware_profiles(inventory):
+    """Group hosts {ip: hardware} into named profiles, largest group first"""
+    groups = {}
+    for ip, hardware in inventory.items():
+        groups.setdefault(hardware_profile_key(hardware), []).append(ip)
+
+    profiles = {}
+    for n, (key, hosts) in enumerate(sorted(groups.items(), key=lambda kv: -len(kv[1])), start=1):
+        cpu_model, cores, memory_gb, numa_nodes, disks, nic_speed = key
+        profiles[f"profile-{n}"] = {
+            'cpu_model': cpu_model,
+            'cores': cores,
+            'memory_gb': memory_gb,
+            'numa_nodes': numa_nodes,
+            'disks': [f"{count}x {label}" for label, count in disks],
+            'max_nic_speed_mbps': nic_speed,
+            'hosts': sorted(hosts),
+        }
+    return profiles
+
+
+def inventory_host(hostname, args, config_dir, ssh=None):
+    """Collect disks and hardware of one host without changing anything on it"""
+    ssh = ssh or SSHConnection(hostname, args.username, args.key_file)
+    ssh.connect()
+    try:
+        with span(f"inventory {hostname}", kind="command", host=hostname):
+            disks = discover_disks(ssh)
+            if not disks:
+                print(f"✗ Error: No disks found on {hostname}")
+                sys.exit(1)
+            hardware = collect_hardware(ssh)
+            save_server_info(hostname, disks, config_dir, hardware=hardware)
+            return hardware
+    finally:
+        ssh.disconnect()
+
+
+def run_on_hosts(hostnames, operation, args):
+    """Run the blocking operation(hostname, ssh) on all hosts concurrently.
+    Returns ({hostname: return value}, [failed hostnames])."""
+    results = {}
+    failed = []
+    if args.engine == 'asyncio':
+        async def run():
+            engine = SSHEngine(args.username, args.key_file, max_concurrency=args.max_concurrency,
+                               connect_timeout=args.connect_timeout)
+            try:
+                return await engine.run_sessions(
+                    hostnames, lambda hostname, client: operation(hostname, PooledSSHConnection(hostname, client)))
+            finally:
+                await engine.close()
+
+        for hostname, result in asyncio.run(run()).items():
+            if result.ok:
+                results[hostname] = result.value
+            else:
+                print(f"✗ Error: {hostname}: {result.error}")
+                failed.append(hostname)
+        return results, failed
+
+    with ThreadPoolExecutor(max_workers=min(len(hostnames), args.max_concurrency)) as pool:
+        futures = {hostname: pool.submit(operation, hostname, None) for hostname in hostnames}
+        for hostname, future in futures.items():
+            try:
+                results[hostname] = future.result()
+            except SystemExit:
+                failed.append(hostname)
+            except Exception as e:
+                print(f"✗ Error: {hostname}: {e}")
+                failed.append(hostname)
+    return results, failed
+
+
+def run_inventory(hostnames, args, config_dir):
+    """Inventory all hosts in parallel, then write hardware_profiles.yaml"""
+    inventory, failed = run_on_hosts(
+        hostnames, lambda hostname, ssh: inventory_host(hostname, args, config_dir, ssh), args)
+
+    # profiles cover every host inventoried so far, not just this run
+    for discovery_file in sorted((Path(config_dir) / "discovery").glob("*.yaml")):
+        if discovery_file.stem not in inventory:
+            with open(discovery_file, 'r') as f:
+                hardware = (yaml.safe_load(f) or {}).get('hardware')
+            if hardware:
+                inventory[discovery_file.stem] = hardware
+
+    profiles = group_hardware_profiles(inventory)
+    for name, profile in profiles.items():
+        for hostname in profile['hosts']:
+            server_file = Path(config_dir) / "discovery" / f"{hostname}.yaml"
+            with open(server_file, 'r') as f:
+                server_info = yaml.safe_load(f)
+            server_info['hardware']['profile'] = name
+            traced_write_file(server_file, yaml.dump(server_info, default_flow_style=False))
+
+    profiles_file = Path(config_dir) / "hardware_profiles.yaml"
+    traced_write_file(profiles_file, yaml.dump({'profiles': profiles}, default_flow_style=False, sort_keys=False))
+
+    print("\n=== Hardware profiles ===")
+    for name, profile in profiles.items():
+        print(f"  {name}: {len(profile['hosts'])} host(s), {profile['cpu_model']} {profile['cores']} cores, "
+              f"{profile['memory_gb']}GB RAM, {profile['numa_nodes']} NUMA node(s), "
+              f"disks {', '.join(profile['disks'])}, NIC {profile['max_nic_speed_mbps']} Mb/s")
+        print(f"      {' '.join(profile['hosts'])}")
+    print(f"✓ Profiles saved to {profiles_file}")
+    for hostname in failed:
+        print(f"  ✗ {hostname}: inventory failed")
+    return failed
+
 
 def read_nodes_index(config_dir):
     config_file = config_dir / 'cluster_nodes_index.yaml'
@@ -259,12 +723,43 @@ def read_talos_config(config_dir):
     config_file = config_dir / 'cluster_config.yaml'
     with open( config_file, 'r') as f:
         talos_config = yaml.safe_load(f)
+    # ids the scripts manage (e.g. the schematic id) are kept in state.yaml
+    talos_config = deep_merge(talos_config, StateStore(config_dir / 'state.yaml').config_overrides())
     return talos_config
 
+def install_host(hostname, args, config_dir, talos_version, talos_schematic, fleet, ssh=None):
+    """Install Talos on one host, save its discovery file and optionally reboot it"""
+    ssh = ssh or SSHConnection(hostname, args.username, args.key_file)
+    ssh.connect()
+
+    started = time.monotonic()
+    try:
+        with span(f"install {hostname}", kind="command", host=hostname):
+            # Install Talos and collect disk information
+            disks = install_talos(ssh, talos_version, talos_schematic, fleet, args.write_mode,
+                                  verify=not args.no_verify)
+
+            # Save server information
+            save_server_info(hostname, disks, config_dir)
+
+            if args.kexec:
+                if not kexec_talos(ssh, talos_config_url=args.talos_config_url):
+                    print('Falling back to a full reboot')
+                    reboot(ssh)
+            elif args.reboot:
+                print('Rebooting in 5 seconds')
+                time.sleep(5)
+
+                reboot(ssh)
+        metrics.observe("install_duration_seconds", time.monotonic() - started)
+
+    finally:
+        ssh.disconnect()
+
 def main():
     parser = argparse.ArgumentParser(description='Install Talos on remote server via SSH')
     # parser.add_argument('hostname', help='Target server hostname/IP')
-    parser.add_argument('-i', '--index', help='Index number (starting from 1) of server of target server. Index is read from cluster_nodex_index.yaml ')
+    parser.add_argument('-i', '--index', nargs='+', help='Index number(s) (starting from 1) of target server(s). Index is read from cluster_nodex_index.yaml. Several indexes are installed concurrently')
     parser.add_argument('--ip', help='ip address of target server')
     parser.add_argument('-u', '--username', default='root', help='SSH username (default: root)')
     parser.add_argument('-k', '--key-file', required=True, help='SSH private key file path')
@@ -272,6 +767,23 @@ def main():
     parser.add_argument('--talos-version', help='Talos version (can also use TALOS_VERSION env var)')
     parser.add_argument('--talos-schematic', help='Talos schematic ID (can also use TALOS_SCHEMATIC env var)')
     parser.add_argument('-r', '--reboot', action='store_true', help='Reboot server after install')
+    parser.add_argument('--inventory', action='store_true', help='Read-only: collect disks and hardware into discovery/<ip>.yaml and group hosts into hardware profiles (default: all indexes)')
+    parser.add_argument('--kexec', action='store_true', help='After install, kexec straight into Talos instead of a firmware reboot (falls back to reboot)')
+    parser.add_argument('--talos-config-url', help='With --kexec, boot with talos.config=URL so the node pulls its config, e.g. "http://10.0.0.5:8090/config?mac=${mac}"')
+    parser.add_argument('--write-mode', choices=['auto'] + list(WRITE_MODES), default='auto',
+                        help='How dd writes the image: direct (O_DIRECT, large blocks), buffered (one final fsync), sparse (skip zero blocks), sync (fsync every block). auto picks by disk type (default: auto)')
+    parser.add_argument('--no-verify', action='store_true', help='Skip hashing the written disk range against the downloaded image')
+    parser.add_argument('--progress-interval', type=float, default=5, help='Seconds between progress reports (default: 5)')
+    parser.add_argument('--stall-warn', type=float, default=15, help='Warn when a download or write makes no progress for this many seconds (default: 15)')
+    parser.add_argument('--stall-abort', type=float, help='Fail a host whose download or write makes no progress for this many seconds')
+    parser.add_argument('--engine', choices=['threads', 'asyncio'], default='threads',
+                        help='How several hosts are driven: a thread per host, or the asyncio SSH engine with pooled connections, keepalives and connect timeouts (default: threads)')
+    parser.add_argument('--max-concurrency', type=int, default=32, help='Hosts worked on at the same time (default: 32)')
+    parser.add_argument('--connect-timeout', type=float, default=15, help='SSH connect timeout in seconds for --engine asyncio (default: 15)')
+    parser.add_argument('--trace', metavar='FILE', help='Write an OTLP/JSON trace of all steps to FILE and print the slowest steps')
+    parser.add_argument('--timings', action='store_true', help='Print the slowest steps when done')
+    parser.add_argument('--metrics-dir', help='Write Prometheus metrics to a node-exporter textfile in this dir (or METRICS_TEXTFILE_DIR)')
+    parser.add_argument('--pushgateway', help='Push Prometheus metrics to this Pushgateway URL (or PUSHGATEWAY_URL)')
     
 
     args = parser.parse_args()
@@ -284,9 +796,22 @@ def main():
     talos_version = args.talos_version or os.environ.get('TALOS_VERSION') or talos_config['talos']['version']
     talos_schematic = args.talos_schematic or os.environ.get('TALOS_SCHEMATIC') or talos_config['talos']['schematicId']
     nodes_index= read_nodes_index(config_dir)
-    hostname = nodes_index[int(args.index)]
-    print(hostname)
+    if args.inventory and not args.index:
+        args.index = sorted(nodes_index)
+    if not args.index:
+        parser.error("-i/--index is required")
+    hostnames = [nodes_index[int(index)] for index in args.index]
+    print(hostnames)
     # exit()
+
+    if args.inventory:
+        with span("inventory", kind="command"):
+            failed = run_inventory(hostnames, args, config_dir)
+        if args.trace or args.timings:
+            print_summary()
+        if args.trace:
+            write_trace(args.trace)
+        sys.exit(1 if failed else 0)
     
     if not talos_version or not talos_schematic:
         print("✗ Error: TALOS_VERSION and TALOS_SCHEMATIC must be provided via args or environment variables")
@@ -294,26 +819,36 @@ def main():
         print("Or: export TALOS_VERSION=v1.5.0 && export TALOS_SCHEMATIC=your-schematic-id")
         sys.exit(1)
     
-    # exit()
-    # Establish SSH connection
-    ssh = SSHConnection(hostname, args.username, args.key_file)
-    ssh.connect()
-    
-    try:
-        # Install Talos and collect disk information
-        disks = install_talos(ssh, talos_version, talos_schematic)
+    fleet = FleetProgress(interval=args.progress_interval, stall_after=args.stall_warn, abort_after=args.stall_abort)
+    fleet.start()
+    failed = []
 
-        # Save server information
-        save_server_info(hostname, disks, config_dir)
-        
-        if args.reboot:
-            print('Rebooting in 5 seconds')
-            time.sleep(5)
-
-            reboot(ssh)
+    try:
+        with span("install", kind="command"):
+            if len(hostnames) == 1:
+                install_host(hostnames[0], args, config_dir, talos_version, talos_schematic, fleet)
+            else:
+                _, failed = run_on_hosts(
+                    hostnames,
+                    lambda hostname, ssh: install_host(hostname, args, config_dir, talos_version,
+                                                       talos_schematic, fleet, ssh),
+                    args)
+                print("\n=== Fleet install summary ===")
+                for hostname in hostnames:
+                    print(f"  {'✗' if hostname in failed else '✓'} {hostname}")
 
     finally:
-        ssh.disconnect()
+        fleet.stop()
+        if args.trace or args.timings:
+            print_summary()
+        if args.trace:
+            write_trace(args.trace)
+        # one metric group per install run, so parallel pipeline nodes don't replace each other's
+        metrics.export(f"install-{'-'.join(str(i) for i in args.index)}", args.metrics_dir, args.pushgateway,
+                       cluster=talos_config['cluster']['name'])
+
+    if failed:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,94 @@
+"""
+Semantic comparison of rendered and live Talos machine configs
+
+Both sides are parsed into their documents (the v1alpha1 config plus
+documents like UserVolumeConfig), keyed by kind and name, with the
+HostnameConfig document dropped the same way strip_hostname_config_document
+drops it from rendered files. Comparing parsed values instead of text means
+comments, key order, quoting and indentation never count as a change.
+
+    changes = semantic_diff(parse_machine_config(rendered_text),
+                            live_machine_config(talosctl_get_output))
+    for line in format_changes(changes):
+        print(line)
+"""
+
+import re
+
+import yaml
+
+# documents Talos generates on its own and the renders strip, see strip_hostname_config_document
+IGNORED_KINDS = {'HostnameConfig'}
+
+# values under these keys are reported as changed without printing them
+SECRET_KEY = re.compile(r'(token|key|secret|crt|cert|password)', re.IGNORECASE)
+
+_MISSING = object()
+
+
+def _document_id(doc):
+    if 'kind' not in doc:
+        return 'v1alpha1'
+    return f"{doc['kind']}/{doc['name']}" if 'name' in doc else doc['kind']
+
+
+def parse_machine_config(text):
+    """{document id: document} of a (multi document) machine config"""
+    documents = {}
+    for doc in yaml.safe_load_all(text):
+        if not isinstance(doc, dict) or doc.get('kind') in IGNORED_KINDS:
+            continue
+        documents[_document_id(doc)] = doc
+    return documents
+
+
+def live_machine_config(output):
+    """The machine config from `talosctl get machineconfig -o yaml` output.
+    The resource's spec holds the config either as a YAML string or as a mapping."""
+    for resource in yaml.safe_load_all(output):
+        if not isinstance(resource, dict) or 'spec' not in resource:
+            continue
+        spec = resource['spec']
+        return parse_machine_config(spec) if isinstance(spec, str) else parse_machine_config(yaml.safe_dump(spec))
+    raise ValueError("no machine config in talosctl output")
+
+
+def _diff(path, rendered, live, changes):
+    if isinstance(rendered, dict) and isinstance(live, dict):
+        for key in list(rendered) + [k for k in live if k not in rendered]:
+            _diff(path + [str(key)], rendered.get(key, _MISSING), live.get(key, _MISSING), changes)
+    elif rendered != live:
+        changes.append((".".join(path), live, rendered))
+
+
+def semantic_diff(rendered, live):
+    """[(path, live value, rendered value)] for every value that differs; _MISSING marks an absent side"""
+    changes = []
+    for doc_id in list(rendered) + [d for d in live if d not in rendered]:
+        _diff([doc_id], rendered.get(doc_id, _MISSING), live.get(doc_id, _MISSING), changes)
+    return changes
+
+
+def _redact(value):
+    """The value with everything under a secret key replaced, at any depth. A subtree or a
+    whole document present on one side only is shown as one value and may hold secrets."""
+    if isinstance(value, dict):
+        return {k: "(redacted)" if SECRET_KEY.search(str(k)) else _redact(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_redact(v) for v in value]
+    return value
+
+
+def _show(path, value):
+    if value is _MISSING:
+        return "(absent)"
+    if SECRET_KEY.search(path.rsplit(".", 1)[-1]):
+        return "(redacted)"
+    text = yaml.safe_dump(_redact(value), default_flow_style=True, width=1000).strip()
+    text = text.removesuffix("\n...").removesuffix("...").strip()
+    return text if len(text) <= 120 else text[:117] + "..."
+
+
+def format_changes(changes):
+    """One line per change: path: live -> rendered"""
+    return [f"{path}: {_show(path, live)} -> {_show(path, rendered)}" for path, live, rendered in changes]
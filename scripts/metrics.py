@@ -0,0 +1,176 @@
+"""
+Prometheus metrics for provisioning runs
+
+Counters and histograms collected in memory while a command runs and
+exported once at the end, either as a node-exporter textfile
+(<dir>/talos_builder_<job>_<cluster>.prom, written atomically) or pushed to a
+Pushgateway-compatible endpoint (PUT <url>/metrics/job/<job>/cluster/<name>).
+Clusters sharing a metrics dir or Pushgateway never replace each other's
+metrics, and a failing export never fails the command.
+
+Export is configured with --metrics-dir / --pushgateway or the
+METRICS_TEXTFILE_DIR / PUSHGATEWAY_URL environment variables, which
+subprocesses (e.g. the installer started by `pipeline`) inherit.
+
+Usage:
+    import metrics
+
+    metrics.inc("hetzner_api_retries_total", api="robot", endpoint="/server", status="403")
+    metrics.observe("render_duration_seconds", 12.3)
+    metrics.export("config-render", cluster="prod")
+"""
+
+import os
+import re
+import threading
+from pathlib import Path
+
+PREFIX = "talos_builder_"
+
+_SECONDS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+_MB_PER_SECOND = (10, 25, 50, 100, 200, 400, 800, 1600, 3200)
+
+# name: (type, help, histogram buckets)
+METRICS = {
+    "hetzner_api_request_duration_seconds": ("histogram", "Latency of Robot and HCloud API calls by endpoint", _SECONDS),
+    "hetzner_api_requests_total": ("counter", "Robot and HCloud API calls by endpoint and status", None),
+    "hetzner_api_retries_total": ("counter", "API calls retried after a rate limit or 503", None),
+    "hetzner_api_throttled_total": ("counter", "API responses that were rate limited (429, Robot 403 RATE_LIMIT_EXCEEDED, hcloud rate_limit_exceeded)", None),
+    "hetzner_api_response_bytes_total": ("counter", "Bytes received from the Hetzner APIs", None),
+    "cli_command_duration_seconds": ("histogram", "Duration of hcloud and talosctl invocations by operation", _SECONDS),
+    "install_download_bytes_total": ("counter", "Bytes of Talos images downloaded by the installer", None),
+    "install_download_mb_per_second": ("histogram", "Talos image download throughput per host", _MB_PER_SECOND),
+    "install_disk_write_bytes_total": ("counter", "Bytes written to disks by the installer", None),
+    "install_disk_write_mb_per_second": ("histogram", "Disk write throughput of the image write per host", _MB_PER_SECOND),
+    "install_duration_seconds": ("histogram", "Install of one host, from SSH connect to reboot", _SECONDS),
+    "node_stage_duration_seconds": ("histogram", "pipeline stage durations per node", _SECONDS),
+    "node_time_to_join_seconds": ("histogram", "pipeline time from install start to applied config per node", _SECONDS),
+    "render_duration_seconds": ("histogram", "Duration of rendering all Talos configs", _SECONDS),
+}
+
+_lock = threading.Lock()
+# (name, sorted label items) -> value, or [bucket counts..., count, sum] for histograms
+_values = {}
+
+_ID_SEGMENT = re.compile(r'/\d+(?=/|$|\.json)')
+
+
+def endpoint_label(path):
+    """API path with numeric ids replaced, so server and vSwitch ids don't explode the label count"""
+    return _ID_SEGMENT.sub("/{id}", path.split("?")[0])
+
+
+def inc(name, value=1, **labels):
+    """Add value to a counter"""
+    key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+    with _lock:
+        _values[key] = _values.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    """Record one observation of a histogram"""
+    if value is None:
+        return
+    buckets = METRICS[name][2]
+    key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+    with _lock:
+        counts = _values.setdefault(key, [0] * (len(buckets) + 2))
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                counts[i] += 1
+        counts[-2] += 1
+        counts[-1] += value
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(items):
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}" if items else ""
+
+
+def render(constant_labels=None):
+    """All collected metrics in the Prometheus text exposition format"""
+    constant = tuple(sorted((k, str(v)) for k, v in (constant_labels or {}).items()))
+    with _lock:
+        values = dict(_values)
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        series = sorted((labels, value) for (metric, labels), value in values.items() if metric == name)
+        if not series:
+            continue
+        full_name = PREFIX + name
+        lines.append(f"# HELP {full_name} {help_text}")
+        lines.append(f"# TYPE {full_name} {kind}")
+        for labels, value in series:
+            labels = constant + labels
+            if kind == "counter":
+                lines.append(f"{full_name}{_labels(labels)} {value}")
+                continue
+            for bound, count in zip(list(buckets) + ["+Inf"], value[:-2] + [value[-2]]):
+                lines.append(f"{full_name}_bucket{_labels(labels + (('le', str(bound)),))} {count}")
+            lines.append(f"{full_name}_count{_labels(labels)} {value[-2]}")
+            lines.append(f"{full_name}_sum{_labels(labels)} {round(value[-1], 6)}")
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+def write_textfile(directory, job, constant_labels=None):
+    """Write <directory>/talos_builder_<job>[_<label value>...].prom for the node-exporter textfile
+    collector; the constant label values (e.g. the cluster) are part of the name"""
+    import tempfile
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    parts = [job] + [str(v) for _, v in sorted((constant_labels or {}).items())]
+    path = directory / f"{PREFIX}{re.sub(r'[^A-Za-z0-9_]', '_', '_'.join(parts))}.prom"
+    # node-exporter must never read a half written file
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".prom.tmp")
+    with os.fdopen(fd, "w") as f:
+        f.write(render(constant_labels))
+    os.replace(tmp_path, path)
+    return path
+
+
+def _grouping_path(grouping):
+    """/<key>/<value>... of a Pushgateway grouping key. Values are URL-encoded; values the path
+    can't carry (a "/" or empty) use the Pushgateway's <key>@base64/<value> form"""
+    import base64
+    from urllib.parse import quote
+    path = ""
+    for key, value in grouping.items():
+        value = str(value)
+        if "/" in value or not value:
+            path += f"/{key}@base64/{base64.urlsafe_b64encode(value.encode()).decode() or '='}"
+        else:
+            path += f"/{key}/{quote(value, safe='')}"
+    return path
+
+
+def push(url, job, grouping=None):
+    """Replace the job's metric group on a Pushgateway-compatible endpoint"""
+    import urllib.request
+    target = f"{url.rstrip('/')}/metrics{_grouping_path({'job': job, **(grouping or {})})}"
+    request = urllib.request.Request(target, data=render().encode(), method="PUT",
+                                     headers={"Content-Type": "text/plain; version=0.0.4"})
+    with urllib.request.urlopen(request, timeout=15) as response:
+        response.read()
+    return target
+
+
+def export(job, textfile_dir=None, pushgateway=None, **labels):
+    """Export to whatever is configured (arguments, else environment); labels are added to every series"""
+    textfile_dir = textfile_dir or os.getenv("METRICS_TEXTFILE_DIR")
+    pushgateway = pushgateway or os.getenv("PUSHGATEWAY_URL")
+    if not _values or not (textfile_dir or pushgateway):
+        return
+    # runs in the commands' finally blocks, an error here must not replace their outcome
+    if textfile_dir:
+        try:
+            print(f"Metrics written to {write_textfile(textfile_dir, job, labels)}")
+        except Exception as e:
+            print(f"⚠ Warning: could not write metrics to {textfile_dir}: {e}")
+    if pushgateway:
+        try:
+            print(f"Metrics pushed to {push(pushgateway, job, labels)}")
+        except Exception as e:
+            print(f"⚠ Warning: could not push metrics to {pushgateway}: {e}")
@@ -0,0 +1,193 @@
+"""
+Live progress reporting for long running remote steps
+
+Turns the output of `wget --progress=dot:mega` and `dd status=progress`
+(streamed over SSH as it is produced) into per host throughput, ETA and
+stall detection, and prints a combined view when several hosts are
+installed at once.
+
+Usage:
+    fleet = FleetProgress()
+    fleet.start()
+    tracker = fleet.tracker("10.0.0.1", "dd", total=image_size)
+    tracker.feed_dd(line)      # for every line of dd stderr
+    ...
+    tracker.finish()
+    fleet.stop()
+"""
+
+import re
+import threading
+import time
+
+DD_PROGRESS_RE = re.compile(r'^(\d+) bytes')
+WGET_LENGTH_RE = re.compile(r'^Length: (\d+)')
+# "  3072K ........ ........ ........ ........ ........ ........  4% 12.3M 2s"
+WGET_DOTS_RE = re.compile(r'^\s*(\d+)K ([. ]+)')
+WGET_DOT_BYTES = 64 * 1024  # one dot in dot:mega style
+
+
+def format_bytes(count):
+    return f"{count / 1e6:.1f} MB"
+
+
+def format_seconds(seconds):
+    if seconds is None:
+        return "--"
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+class ProgressTracker:
+    """Throughput, ETA and stall state for one transfer on one host"""
+
+    WINDOW = 5.0  # seconds of samples used for the current rate
+
+    def __init__(self, host, label, total=None, stall_after=15.0, abort_after=None):
+        self.host = host
+        self.label = label
+        self.total = total
+        self.stall_after = stall_after
+        self.abort_after = abort_after
+        self.done = 0
+        self.started = time.monotonic()
+        self.last_progress = self.started
+        self.finished = False
+        self.stall_reported = False
+        self._samples = [(self.started, 0)]
+        self._lock = threading.Lock()
+
+    def update(self, done):
+        now = time.monotonic()
+        with self._lock:
+            if done > self.done:
+                self.done = done
+                self.last_progress = now
+                self.stall_reported = False
+            self._samples.append((now, self.done))
+            while len(self._samples) > 2 and now - self._samples[0][0] > self.WINDOW:
+                self._samples.pop(0)
+
+    def feed_dd(self, line):
+        match = DD_PROGRESS_RE.match(line.strip())
+        if match:
+            self.update(int(match.group(1)))
+
+    def feed_wget(self, line):
+        match = WGET_LENGTH_RE.match(line.strip())
+        if match:
+            self.total = int(match.group(1))
+            return
+        match = WGET_DOTS_RE.match(line)
+        if match:
+            offset = int(match.group(1)) * 1024
+            dots = match.group(2).count('.')
+            self.update(offset + dots * WGET_DOT_BYTES)
+
+    def finish(self):
+        if self.total:
+            self.update(self.total)
+        self.finished = True
+
+    def rate(self):
+        """Bytes per second over the last few seconds"""
+        with self._lock:
+            (t0, d0), (t1, d1) = self._samples[0], self._samples[-1]
+        if self.finished:
+            elapsed = self.last_progress - self.started
+            return self.done / elapsed if elapsed > 0 else None
+        if t1 - t0 <= 0:
+            return None
+        return (d1 - d0) / (t1 - t0)
+
+    def eta(self):
+        rate = self.rate()
+        if not self.total or not rate:
+            return None
+        return max(self.total - self.done, 0) / rate
+
+    def stalled_for(self):
+        """Seconds without progress (0 if progress was recent)"""
+        if self.finished:
+            return 0
+        idle = time.monotonic() - self.last_progress
+        return idle if idle >= self.stall_after else 0
+
+    def should_abort(self):
+        """True once the transfer has been stalled for longer than abort_after"""
+        return bool(self.abort_after) and self.stalled_for() > self.abort_after
+
+    def line(self):
+        rate = self.rate()
+        done = format_bytes(self.done)
+        if self.total:
+            done += f" / {format_bytes(self.total)} ({100 * self.done / self.total:.0f}%)"
+        parts = [f"{self.host:<16} {self.label:<8} {done}",
+                 f"{rate / 1e6:.1f} MB/s" if rate else "-- MB/s"]
+        if self.finished:
+            parts.append(f"done in {format_seconds(self.last_progress - self.started)}")
+        else:
+            parts.append(f"ETA {format_seconds(self.eta())}")
+            stalled = self.stalled_for()
+            if stalled:
+                parts.append(f"⚠ STALLED {format_seconds(stalled)}")
+        return "  ".join(parts)
+
+
+class FleetProgress:
+    """Collects trackers of all hosts and periodically prints a combined view"""
+
+    def __init__(self, interval=5.0, stall_after=15.0, abort_after=None):
+        self.interval = interval
+        self.stall_after = stall_after
+        self.abort_after = abort_after
+        self.trackers = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def tracker(self, host, label, total=None):
+        tracker = ProgressTracker(host, label, total=total, stall_after=self.stall_after,
+                                  abort_after=self.abort_after)
+        with self._lock:
+            self.trackers = [t for t in self.trackers if t.host != host] + [tracker]
+        return tracker
+
+    def start(self):
+        self._thread = threading.Thread(target=self._report_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _report_loop(self):
+        while not self._stop.wait(self.interval):
+            self.report()
+
+    def report(self):
+        with self._lock:
+            active = [t for t in self.trackers if not t.finished]
+            trackers = list(self.trackers)
+        if not active:
+            return
+        for t in active:
+            t.update(t.done)  # add a sample so the rate decays while nothing arrives
+        print("--- progress ---")
+        for t in trackers:
+            print(f"  {t.line()}")
+            stalled = t.stalled_for()
+            if stalled and not t.stall_reported:
+                print(f"⚠ Warning: {t.host} {t.label} made no progress for {format_seconds(stalled)}")
+                t.stall_reported = True
+        if len(trackers) > 1:
+            rate = sum(t.rate() or 0 for t in active)
+            done = sum(t.done for t in trackers)
+            stalled = sum(1 for t in active if t.stalled_for())
+            print(f"  {'fleet':<16} {len(active)}/{len(trackers)} active  {format_bytes(done)}  "
+                  f"{rate / 1e6:.1f} MB/s  {stalled} stalled")
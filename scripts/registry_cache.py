@@ -0,0 +1,155 @@
+"""
+Registry mirrors through a pull-through cache, and pre-seeding the cache
+
+With `registries.cache` (or `registries.cache-node`) set in cluster_config.yaml,
+every node gets a `machine.registries.mirrors` patch that sends pulls for the
+listed upstream registries to the cache on the private vSwitch network:
+
+    registries:
+        cache: http://10.112.3.10:5000      # or cache-node: 1 (a metal worker's private IP, cache-port)
+        mirrors: [docker.io, ghcr.io, registry.k8s.io, quay.io, factory.talos.dev]
+        override-path: true                 # cache serves each upstream under /v2/<registry> (zot, Harbor)
+
+seed() warms the cache ahead of a fleet bring-up: it requests the manifests
+and blobs of the installer and system extension images through the cache
+with the registry v2 API, which makes the cache fetch and keep them.
+"""
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from tracing import span
+
+MANIFEST_TYPES = ", ".join([
+    "application/vnd.oci.image.index.v1+json",
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+    "application/vnd.oci.image.manifest.v1+json",
+    "application/vnd.docker.distribution.manifest.v2+json",
+])
+INDEX_TYPES = ("application/vnd.oci.image.index.v1+json",
+               "application/vnd.docker.distribution.manifest.list.v2+json")
+# Docker Hub images without a registry or namespace
+DEFAULT_REGISTRY = "docker.io"
+
+
+def cache_url(registries_config, private_ip_of_node):
+    """Base URL of the pull-through cache, or None when mirrors are off"""
+    registries_config = registries_config or {}
+    if registries_config.get('cache'):
+        return registries_config['cache'].rstrip("/")
+    if registries_config.get('cache-node') is not None:
+        ip = private_ip_of_node(int(registries_config['cache-node']))
+        return f"http://{ip}:{registries_config.get('cache-port', 5000)}"
+    return None
+
+
+def mirror_endpoints(registries_config, private_ip_of_node):
+    """{upstream registry: mirror endpoint} for the registries patch; empty when mirrors are off"""
+    registries_config = registries_config or {}
+    cache = cache_url(registries_config, private_ip_of_node)
+    if not cache:
+        return {}
+    override_path = registries_config.get('override-path', True)
+    return {registry: f"{cache}/v2/{registry}" if override_path else cache
+            for registry in registries_config.get('mirrors') or []}
+
+
+def split_image(image):
+    """(registry, repository, tag or digest) of an image reference"""
+    name, digest = image.split("@", 1) if "@" in image else (image, None)
+    first, _, rest = name.partition("/")
+    if rest and ("." in first or ":" in first or first == "localhost"):
+        registry, name = first, rest
+    else:
+        registry = DEFAULT_REGISTRY
+        name = name if "/" in name else f"library/{name}"
+    name, _, tag = name.partition(":") if ":" in name.rsplit("/", 1)[-1] else (name, "", "latest")
+    return registry, name, digest or tag
+
+
+class CacheSeeder:
+    """Pulls images through the cache with the registry v2 API"""
+
+    def __init__(self, cache, override_path=True, arch="amd64", timeout=300):
+        self.cache = cache.rstrip("/")
+        self.override_path = override_path
+        self.arch = arch
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def _url(self, registry, repository, kind, reference):
+        if self.override_path:
+            return f"{self.cache}/v2/{registry}/{repository}/{kind}/{reference}", {}
+        # containerd's layout for a mirror without overridePath
+        return f"{self.cache}/v2/{repository}/{kind}/{reference}", {"ns": registry}
+
+    def _get(self, registry, repository, kind, reference, **kwargs):
+        url, params = self._url(registry, repository, kind, reference)
+        with span(f"GET {kind} {repository}", kind="http", url=url) as s:
+            response = self.session.get(url, params=params, timeout=self.timeout, **kwargs)
+            s.exit_status = response.status_code
+            response.raise_for_status()
+        return response
+
+    def _blob(self, registry, repository, digest):
+        size = 0
+        with self._get(registry, repository, "blobs", digest, stream=True) as response:
+            for chunk in response.iter_content(1024 * 1024):
+                size += len(chunk)
+        return size
+
+    def seed_image(self, image):
+        """Pull one image's manifest(s) and blobs through the cache; returns the bytes fetched"""
+        registry, repository, reference = split_image(image)
+        response = self._get(registry, repository, "manifests", reference, headers={"Accept": MANIFEST_TYPES})
+        manifest = response.json()
+        size = len(response.content)
+        if manifest.get("mediaType") in INDEX_TYPES or "manifests" in manifest:
+            platforms = [m for m in manifest["manifests"]
+                         if (m.get("platform") or {}).get("architecture") in (self.arch, None)]
+            for platform_manifest in platforms:
+                response = self._get(registry, repository, "manifests", platform_manifest["digest"],
+                                     headers={"Accept": MANIFEST_TYPES})
+                size += len(response.content)
+                size += self._seed_blobs(registry, repository, response.json())
+            return size
+        return size + self._seed_blobs(registry, repository, manifest)
+
+    def _seed_blobs(self, registry, repository, manifest):
+        digests = [manifest["config"]["digest"]] + [layer["digest"] for layer in manifest.get("layers", [])]
+        return sum(self._blob(registry, repository, digest) for digest in digests)
+
+
+def extension_images(talos_version, extensions, factory_url=None):
+    """Image references of the schematic's official extensions for talos_version, from the Image Factory"""
+    factory_url = factory_url or os.getenv("TALOS_FACTORY_URL", "https://factory.talos.dev")
+    with span(f"GET extensions {talos_version}", kind="http", url=factory_url) as s:
+        response = requests.get(f"{factory_url}/version/{talos_version}/extensions/official", timeout=60)
+        s.exit_status = response.status_code
+        response.raise_for_status()
+    available = {ext["name"]: ext for ext in response.json()}
+    images = []
+    for name in extensions:
+        if name not in available:
+            print(f"⚠ Warning: extension {name} not found for Talos {talos_version}")
+            continue
+        ext = available[name]
+        images.append(f"{ext['ref']}@{ext['digest']}" if ext.get('digest') else ext['ref'])
+    return images
+
+
+def seed(cache, images, override_path=True, arch="amd64", max_concurrency=8):
+    """Pull all images through the cache concurrently; returns {image: bytes or exception}"""
+    seeder = CacheSeeder(cache, override_path, arch)
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        futures = {image: pool.submit(seeder.seed_image, image) for image in images}
+        for image, future in futures.items():
+            try:
+                results[image] = future.result()
+            except (requests.RequestException, KeyError, json.JSONDecodeError) as e:
+                results[image] = e
+    return results
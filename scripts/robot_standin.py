@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Hetzner Robot webservice
+
+Serves the subset of the Robot API used by hetzner_robot.py from memory,
+so `config.py rescue` and `config.py vswitch` can be exercised without a
+Robot account:
+
+- GET  /server
+- GET/POST/DELETE /boot/{server_number}/rescue (POST on an active rescue is a 409, like Robot)
+- POST /reset/{server_number}
+- GET  /vswitch, POST /vswitch, GET/DELETE /vswitch/{id}
+
+Servers are taken from a cluster_nodes_index.yaml (server numbers are
+1000 + index) and/or --server IP options. Any credentials are accepted.
+
+Usage:
+    uv run scripts/robot_standin.py --nodes-index config/cluster_nodes_index.yaml &
+    export HETZNER_ROBOT_URL=http://127.0.0.1:8089
+    uv run scripts/config.py rescue -k ~/ssh-key --no-wait
+"""
+
+import argparse
+import json
+import re
+import secrets
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import yaml
+
+
+class RobotState:
+    """In-memory servers, rescue settings, resets and vSwitches"""
+
+    def __init__(self, server_ips):
+        self.lock = threading.Lock()
+        self.servers = {}
+        for number, ip in server_ips.items():
+            self.servers[number] = {
+                "server_ip": ip,
+                "server_number": number,
+                "server_name": f"standin-{number}",
+                "product": "AX41-NVMe",
+                "dc": "FSN1-DC1",
+                "status": "ready",
+                "cancelled": False,
+            }
+        self.rescue = {number: {"server_ip": s["server_ip"], "server_number": number, "os": ["linux", "vkvm"],
+                                "active": False, "password": None, "authorized_key": [], "host_key": []}
+                       for number, s in self.servers.items()}
+        self.resets = []
+        self.vswitches = {}
+        self.next_vswitch_id = 50000
+
+
+class RobotHandler(BaseHTTPRequestHandler):
+    state = None
+    latency = 0.0
+
+    def log_message(self, format, *args):
+        print(f"robot-standin: {self.command} {self.path} -> {args[1] if len(args) > 1 else ''}")
+
+    def _reply(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _not_found(self, message="Not found"):
+        self._reply(404, {"error": {"status": 404, "code": "NOT_FOUND", "message": message}})
+
+    def _form(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return parse_qs(self.rfile.read(length).decode()) if length else {}
+
+    def _route(self):
+        time.sleep(self.latency)
+        return re.sub(r'\.json$', '', self.path.split("?")[0]).rstrip("/")
+
+    def do_GET(self):
+        path = self._route()
+        state = self.state
+        with state.lock:
+            if path == "/server":
+                return self._reply(200, [{"server": s} for s in state.servers.values()])
+            match = re.fullmatch(r'/boot/(\d+)/rescue', path)
+            if match:
+                number = int(match.group(1))
+                if number not in state.rescue:
+                    return self._not_found("Server not found")
+                return self._reply(200, {"rescue": state.rescue[number]})
+            if path == "/vswitch":
+                return self._reply(200, list(state.vswitches.values()))
+            match = re.fullmatch(r'/vswitch/(\d+)', path)
+            if match and int(match.group(1)) in state.vswitches:
+                return self._reply(200, state.vswitches[int(match.group(1))])
+        return self._not_found()
+
+    def do_POST(self):
+        path = self._route()
+        form = self._form()
+        state = self.state
+        with state.lock:
+            match = re.fullmatch(r'/boot/(\d+)/rescue', path)
+            if match:
+                number = int(match.group(1))
+                if number not in state.rescue:
+                    return self._not_found("Server not found")
+                rescue = state.rescue[number]
+                if rescue["active"]:
+                    return self._reply(409, {"error": {"status": 409, "code": "BOOT_ALREADY_ENABLED",
+                                                       "message": "The boot system is already enabled"}})
+                rescue.update(active=True, os=form.get("os", ["linux"])[0],
+                              authorized_key=[{"key": {"fingerprint": fp}} for fp in form.get("authorized_key[]", [])],
+                              password=secrets.token_urlsafe(12))
+                return self._reply(200, {"rescue": rescue})
+            match = re.fullmatch(r'/reset/(\d+)', path)
+            if match:
+                number = int(match.group(1))
+                if number not in state.servers:
+                    return self._not_found("Server not found")
+                reset_type = form.get("type", ["sw"])[0]
+                state.resets.append((number, reset_type))
+                # booting the rescue system consumes the one-shot activation
+                state.rescue[number]["active"] = False
+                return self._reply(200, {"reset": {"server_ip": state.servers[number]["server_ip"], "type": reset_type}})
+            if path == "/vswitch":
+                vswitch = {"id": state.next_vswitch_id, "name": form.get("name", [""])[0],
+                           "vlan": int(form.get("vlan", ["0"])[0]), "cancelled": False, "server": []}
+                state.vswitches[vswitch["id"]] = vswitch
+                state.next_vswitch_id += 1
+                return self._reply(201, vswitch)
+            match = re.fullmatch(r'/vswitch/(\d+)/server', path)
+            if match and int(match.group(1)) in state.vswitches:
+                state.vswitches[int(match.group(1))]["server"] += form.get("server", [])
+                return self._reply(201, {})
+        return self._not_found()
+
+    def do_DELETE(self):
+        path = self._route()
+        state = self.state
+        with state.lock:
+            match = re.fullmatch(r'/boot/(\d+)/rescue', path)
+            if match:
+                number = int(match.group(1))
+                if number not in state.rescue:
+                    return self._not_found("Server not found")
+                state.rescue[number].update(active=False, password=None, authorized_key=[])
+                return self._reply(200, {"rescue": state.rescue[number]})
+            match = re.fullmatch(r'/vswitch/(\d+)', path)
+            if match and int(match.group(1)) in state.vswitches:
+                state.vswitches[int(match.group(1))]["cancelled"] = True
+                return self._reply(200, {})
+        return self._not_found()
+
+
+def serve(server_ips, port=0, latency=0.0):
+    """Start the stand-in in a background thread, returns (server, base_url)"""
+    handler = type("Handler", (RobotHandler,), {"state": RobotState(server_ips), "latency": latency})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the Hetzner Robot webservice')
+    parser.add_argument('--port', type=int, default=8089, help='Port to listen on (default: 8089)')
+    parser.add_argument('--nodes-index', help='cluster_nodes_index.yaml to take server IPs from')
+    parser.add_argument('--server', action='append', default=[], help='Additional server IP (repeatable)')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every response')
+    args = parser.parse_args()
+
+    server_ips = {}
+    if args.nodes_index:
+        with open(args.nodes_index) as f:
+            for index, ip in yaml.safe_load(f)['index'].items():
+                server_ips[1000 + int(index)] = ip
+    for ip in args.server:
+        server_ips[2000 + len(server_ips)] = ip
+
+    server, base_url = serve(server_ips, args.port, args.latency)
+    print(f"✓ Robot stand-in with {len(server_ips)} server(s) listening on {base_url}")
+    print(f"  export HETZNER_ROBOT_URL={base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,272 @@
+"""
+Asyncio SSH engine for running commands on many hosts at once
+
+paramiko is blocking, so every SSH call runs in a bounded thread pool while
+an asyncio event loop schedules the hosts. The engine keeps one connection
+per host (reused by every command and session on that host, with transport
+keepalives), applies connect and command timeouts, bounds how many hosts
+are worked on at the same time, and reports failures as results instead of
+exiting the process.
+
+Usage:
+    engine = SSHEngine("root", "~/ssh-key", max_concurrency=100)
+
+    async def main():
+        results = await engine.run_many(hosts, "uptime")
+        for result in results.values():
+            print(result.host, result.ok, result.stdout)
+        # run a blocking, multi-step operation with the host's pooled client
+        sessions = await engine.run_sessions(hosts, lambda host, client: do_something(client))
+        await engine.close()
+
+    asyncio.run(main())
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any
+
+import paramiko
+
+from tracing import span
+
+
+@dataclass
+class CommandResult:
+    """Outcome of one command on one host; error is set when it could not run to completion"""
+    host: str
+    command: str
+    exit_status: int | None = None
+    stdout: str = ""
+    stderr: str = ""
+    duration: float = 0.0
+    error: str | None = None
+
+    @property
+    def ok(self):
+        return self.error is None and self.exit_status == 0
+
+
+@dataclass
+class SessionResult:
+    """Outcome of one operation run with a host's connection"""
+    host: str
+    value: Any = None
+    duration: float = 0.0
+    error: str | None = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class SSHEngine:
+    """Pooled, bounded and time limited SSH access to many hosts"""
+
+    def __init__(self, username="root", key_file=None, port=22, max_concurrency=50,
+                 connect_timeout=15.0, command_timeout=900.0, keepalive=15):
+        self.username = username
+        self.key_file = os.path.expanduser(key_file) if key_file else None
+        self.port = port
+        self.max_concurrency = max_concurrency
+        self.connect_timeout = connect_timeout
+        self.command_timeout = command_timeout
+        self.keepalive = keepalive
+        # connects, commands and sessions all run here; one thread per host in flight
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="ssh")
+        self._clients = {}
+        self._clients_lock = threading.Lock()
+        self._connect_locks = {}
+        self._semaphore = None
+
+    def _limit(self):
+        # created on first use so it belongs to the running loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def _address(self, host):
+        # "host:port" targets a non-default port (e.g. several test hosts on 127.0.0.1)
+        name, _, port = host.rpartition(":")
+        if name and port.isdigit() and ":" not in name:
+            return name, int(port)
+        return host, self.port
+
+    def _open_client(self, host):
+        hostname, port = self._address(host)
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        with span(f"connect {host}", kind="ssh", host=host):
+            client.connect(
+                hostname=hostname,
+                port=port,
+                username=self.username,
+                key_filename=self.key_file,
+                timeout=self.connect_timeout,
+                banner_timeout=self.connect_timeout,
+                auth_timeout=self.connect_timeout,
+            )
+        client.get_transport().set_keepalive(self.keepalive)
+        return client
+
+    def _pooled_client(self, host):
+        with self._clients_lock:
+            client = self._clients.get(host)
+        if client is not None and client.get_transport() and client.get_transport().is_active():
+            return client
+        return None
+
+    def _drop(self, host):
+        with self._clients_lock:
+            client = self._clients.pop(host, None)
+        if client is not None:
+            client.close()
+
+    async def connect(self, host):
+        """Return the pooled client for host, connecting once if needed"""
+        client = self._pooled_client(host)
+        if client is not None:
+            return client
+        lock = self._connect_locks.setdefault(host, asyncio.Lock())
+        async with lock:
+            client = self._pooled_client(host)
+            if client is not None:
+                return client
+            self._drop(host)
+            loop = asyncio.get_running_loop()
+            client = await asyncio.wait_for(loop.run_in_executor(self._executor, self._open_client, host),
+                                            self.connect_timeout + 5)
+            with self._clients_lock:
+                self._clients[host] = client
+            return client
+
+    def _exec(self, client, result, channels):
+        with span(result.command, kind="ssh", host=result.host) as s:
+            channel = client.get_transport().open_session()
+            channels.append(channel)
+            channel.exec_command(result.command)
+            stdout = channel.makefile("rb").read()
+            stderr = channel.makefile_stderr("rb").read()
+            result.exit_status = channel.recv_exit_status()
+            result.stdout = stdout.decode(errors="replace").strip()
+            result.stderr = stderr.decode(errors="replace").strip()
+            s.exit_status = result.exit_status
+            s.add_bytes(len(stdout) + len(stderr))
+
+    async def run(self, host, command, timeout=None):
+        """Run one command on host and return a CommandResult (never raises for remote failures)"""
+        result = CommandResult(host, command)
+        started = time.monotonic()
+        channels = []
+        async with self._limit():
+            try:
+                client = await self.connect(host)
+                loop = asyncio.get_running_loop()
+                await asyncio.wait_for(loop.run_in_executor(self._executor, self._exec, client, result, channels),
+                                       timeout or self.command_timeout)
+            except asyncio.TimeoutError:
+                # closing the channel unblocks the worker thread still reading from it
+                for channel in channels:
+                    channel.close()
+                result.error = f"timed out after {timeout or self.command_timeout:.0f}s"
+            except Exception as e:
+                # a broken connection is reopened by the next command
+                self._drop(host)
+                result.error = f"{type(e).__name__}: {e}"
+        result.duration = time.monotonic() - started
+        return result
+
+    async def run_many(self, hosts, command, timeout=None):
+        """Run the same command on all hosts, returns {host: CommandResult}"""
+        results = await asyncio.gather(*(self.run(host, command, timeout) for host in hosts))
+        return dict(zip(hosts, results))
+
+    def _call(self, operation, host, client):
+        try:
+            return operation(host, client)
+        except SystemExit as e:
+            # blocking helpers written for the CLI report failure by exiting
+            raise RuntimeError(f"exited with status {e.code}") from None
+
+    async def session(self, host, operation, timeout=None):
+        """Run the blocking operation(host, client) with the host's pooled client in a worker thread.
+
+        Returns a SessionResult holding the operation's return value or its error.
+        On timeout the connection is closed, which makes the operation's pending
+        SSH calls fail and frees its thread.
+        """
+        result = SessionResult(host)
+        started = time.monotonic()
+        async with self._limit():
+            try:
+                client = await self.connect(host)
+                loop = asyncio.get_running_loop()
+                future = loop.run_in_executor(self._executor, self._call, operation, host, client)
+                if timeout:
+                    result.value = await asyncio.wait_for(future, timeout)
+                else:
+                    result.value = await future
+            except asyncio.TimeoutError:
+                self._drop(host)
+                result.error = f"timed out after {timeout:.0f}s"
+            except Exception as e:
+                self._drop(host)
+                result.error = f"{type(e).__name__}: {e}"
+        result.duration = time.monotonic() - started
+        return result
+
+    async def run_sessions(self, hosts, operation, timeout=None):
+        """session() on all hosts, returns {host: SessionResult}"""
+        results = await asyncio.gather(*(self.session(host, operation, timeout) for host in hosts))
+        return dict(zip(hosts, results))
+
+    async def close(self):
+        with self._clients_lock:
+            hosts = list(self._clients)
+        for host in hosts:
+            self._drop(host)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run a command on many hosts over SSH')
+    parser.add_argument('hosts', nargs='+', help='Target hosts (host or host:port)')
+    parser.add_argument('-c', '--command', required=True, help='Command to run')
+    parser.add_argument('-u', '--username', default='root', help='SSH username (default: root)')
+    parser.add_argument('-k', '--key-file', required=True, help='SSH private key file path')
+    parser.add_argument('-p', '--port', type=int, default=22, help='SSH port (default: 22)')
+    parser.add_argument('--max-concurrency', type=int, default=50, help='Hosts worked on at the same time (default: 50)')
+    parser.add_argument('--timeout', type=float, default=60, help='Command timeout in seconds (default: 60)')
+    args = parser.parse_args()
+
+    # failures are reported per host below; keep paramiko's tracebacks out of the output
+    logging.getLogger("paramiko").setLevel(logging.CRITICAL)
+
+    async def run():
+        engine = SSHEngine(args.username, args.key_file, args.port, args.max_concurrency)
+        try:
+            return await engine.run_many(args.hosts, args.command, args.timeout)
+        finally:
+            await engine.close()
+
+    results = asyncio.run(run())
+    for result in results.values():
+        if result.ok:
+            print(f"✓ {result.host} ({result.duration:.1f}s)")
+        else:
+            print(f"✗ {result.host}: {result.error or f'exit {result.exit_status}'} {result.stderr}")
+        if result.stdout:
+            print("  " + result.stdout.replace("\n", "\n  "))
+    return 0 if all(result.ok for result in results.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""
+Machine state store for values the scripts manage
+
+IDs and addresses the scripts create (schematic id, HCloud image and
+network ids, the vSwitch id, the control plane LB IP) and per node progress
+live in config/state.yaml instead of being patched into the user's
+cluster_config.yaml:
+
+    config:                 # merged over cluster_config.yaml when it is loaded
+        talos:
+            schematicId: 376567988ad370138ad8b2698212367b8edcb69b5fd68c80be1f2ec7d603b4ba
+        hetzner:
+            hcloud-network-id: 4711
+    workers:                # written by `pipeline` as nodes move through the stages
+        1: {ip: 213.239.209.119, stage: apply, updated: 1760000000}
+
+Every transaction takes an exclusive flock on state.yaml.lock, re-reads the
+file, and replaces it with os.replace() from a temp file in the same dir, so
+readers never see a half written file and concurrent writers (threads,
+several `config.py` runs on one config dir) don't lose each other's changes.
+Changes made in one transaction are written once; a transaction that leaves
+the state unchanged writes nothing.
+
+    store = StateStore(config_dir / "state.yaml")
+    store.update({'config': {'hetzner': {'cp-lb-ip': '1.2.3.4'}}})
+    with store.transaction() as state:
+        ...
+"""
+
+import copy
+import fcntl
+import os
+from contextlib import contextmanager
+from pathlib import Path
+
+import yaml
+
+from tracing import span
+
+HEADER = "# Managed by the scripts, do not edit. Values under `config` override cluster_config.yaml\n"
+
+
+def deep_merge(base, overrides):
+    """base with overrides applied recursively; returns new dicts and leaves the inputs alone"""
+    merged = dict(base)
+    for key, value in (overrides or {}).items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = deep_merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+class StateStore:
+    """state.yaml with locked, atomic and batched updates"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.lock_path = self.path.with_name(self.path.name + ".lock")
+
+    def load(self):
+        """Current state. Needs no lock: the file is only ever replaced whole."""
+        try:
+            with open(self.path) as f:
+                return yaml.safe_load(f) or {}
+        except FileNotFoundError:
+            return {}
+
+    @contextmanager
+    def _locked(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _write(self, state):
+        import tempfile
+        content = HEADER + yaml.safe_dump(state, sort_keys=False, default_flow_style=False)
+        with span(f"write {self.path}", kind="file", path=str(self.path)) as s:
+            fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, prefix=f".{self.path.name}.")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    f.write(content)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            s.add_bytes(len(content.encode()))
+
+    @contextmanager
+    def transaction(self):
+        """Yield the current state for changing in place; written once on exit, not at all on error"""
+        with self._locked():
+            before = self.load()
+            state = copy.deepcopy(before)
+            yield state
+            if state != before:
+                self._write(state)
+
+    def update(self, changes):
+        """Merge changes into the state in one transaction, returns the new state"""
+        with self.transaction() as state:
+            merged = deep_merge(state, changes)
+            state.clear()
+            state.update(merged)
+        return merged
+
+    def config_overrides(self):
+        """The values that override cluster_config.yaml"""
+        return self.load().get("config") or {}
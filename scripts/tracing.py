@@ -0,0 +1,212 @@
+"""
+Lightweight step tracing for the cluster builder scripts
+
+Records nested spans (subprocess calls, HTTP requests, SSH commands,
+template renders, file writes) with duration, bytes and exit status.
+At the end of a run the slowest steps can be printed and the whole trace
+written as OTLP/JSON (the format accepted by OTLP HTTP collectors and
+`otel-desktop-viewer`, and readable with jq).
+
+Usage:
+    from tracing import span, traced_run
+
+    with span("render", kind="step"):
+        result = traced_run(["talosctl", "gen", "config", ...], capture_output=True)
+
+    print_summary()
+    write_trace("trace.json")
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+_lock = threading.Lock()
+_local = threading.local()
+_finished = []
+_root = None
+_trace_id = os.urandom(16).hex()
+
+
+class Span:
+    """A timed step; attributes hold anything worth reporting (host, endpoint, ...)"""
+
+    def __init__(self, name, kind, parent, attributes):
+        self.name = name
+        self.kind = kind
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = dict(attributes)
+        self.bytes = None
+        self.exit_status = None
+        self.error = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    @property
+    def duration(self):
+        end_ns = self.end_ns or time.time_ns()
+        return (end_ns - self.start_ns) / 1e9
+
+    def add_bytes(self, count):
+        self.bytes = (self.bytes or 0) + count
+
+
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+@contextmanager
+def span(name, kind="step", **attributes):
+    """Time the enclosed block as a span nested under the current one.
+
+    Spans opened in worker threads with no span of their own hang off the
+    first (root) span of the run.
+    """
+    global _root
+    stack = _stack()
+    parent = stack[-1] if stack else _root
+    current = Span(name, kind, parent, attributes)
+    with _lock:
+        if _root is None:
+            _root = current
+    stack.append(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.end_ns = time.time_ns()
+        stack.pop()
+        with _lock:
+            _finished.append(current)
+
+
+def traced_run(command, kind="subprocess", **kwargs):
+    """subprocess.run wrapper recording duration, exit status and output bytes"""
+    # imported here: commands that run nothing (e.g. status) start faster without it
+    import subprocess
+    name = " ".join(str(c) for c in command[:3]) if isinstance(command, (list, tuple)) else str(command)
+    with span(name, kind=kind, command=" ".join(str(c) for c in command)) as s:
+        try:
+            result = subprocess.run(command, **kwargs)
+        except subprocess.CalledProcessError as e:
+            s.exit_status = e.returncode
+            raise
+        s.exit_status = result.returncode
+        for output in (result.stdout, result.stderr):
+            if output:
+                s.add_bytes(len(output))
+    _command_metrics(command, s, result)
+    return result
+
+
+def _command_metrics(command, s, result):
+    """hcloud and talosctl calls as metrics, labelled by their subcommand (e.g. "load-balancer create")"""
+    if not isinstance(command, (list, tuple)):
+        return
+    tool = os.path.basename(str(command[0]))
+    if tool not in ("hcloud", "talosctl"):
+        return
+    operation = " ".join([str(c) for c in command[1:] if re.fullmatch(r'[a-z][a-z-]*', str(c))][:2])
+    metrics.observe("cli_command_duration_seconds", s.duration, tool=tool, operation=operation,
+                    status="ok" if result.returncode == 0 else "error")
+    stderr = result.stderr if isinstance(result.stderr, str) else (result.stderr or b"").decode(errors="replace")
+    if tool == "hcloud" and re.search(r'rate.?limit', stderr, re.IGNORECASE):
+        metrics.inc("hetzner_api_throttled_total", api="hcloud", operation=operation)
+
+
+def traced_write_file(path, content):
+    """Write text content to a file as a traced step"""
+    with span(f"write {path}", kind="file", path=str(path)) as s:
+        with open(path, "w") as f:
+            f.write(content)
+        s.add_bytes(len(content.encode()))
+
+
+def finished_spans():
+    with _lock:
+        return list(_finished)
+
+
+def print_summary(limit=10):
+    """Print the slowest steps and the total time per kind of step"""
+    spans = [s for s in finished_spans() if s is not _root]
+    if not spans:
+        return
+    print("\n=== Slowest steps ===")
+    for s in sorted(spans, key=lambda s: s.duration, reverse=True)[:limit]:
+        details = []
+        if s.exit_status is not None:
+            details.append(f"exit={s.exit_status}")
+        if s.bytes is not None:
+            details.append(f"bytes={s.bytes}")
+        if s.error:
+            details.append(f"error={s.error}")
+        print(f"  {s.duration:8.2f}s  [{s.kind}] {s.name}  {' '.join(details)}")
+
+    totals = {}
+    for s in spans:
+        count, seconds = totals.get(s.kind, (0, 0.0))
+        totals[s.kind] = (count + 1, seconds + s.duration)
+    print("=== Time by kind ===")
+    for kind, (count, seconds) in sorted(totals.items(), key=lambda kv: kv[1][1], reverse=True):
+        print(f"  {seconds:8.2f}s  {kind} ({count} spans)")
+    if _root is not None:
+        print(f"  {_root.duration:8.2f}s  total ({_root.name})")
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_span(s):
+    attributes = dict(s.attributes, kind=s.kind)
+    if s.bytes is not None:
+        attributes["bytes"] = s.bytes
+    if s.exit_status is not None:
+        attributes["exit_status"] = s.exit_status
+    failed = s.error is not None or bool(s.exit_status)
+    otlp = {
+        "traceId": _trace_id,
+        "spanId": s.span_id,
+        "name": s.name,
+        "kind": 1,
+        "startTimeUnixNano": str(s.start_ns),
+        "endTimeUnixNano": str(s.end_ns),
+        "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in attributes.items()],
+        "status": {"code": 2, "message": s.error or f"exit status {s.exit_status}"} if failed else {"code": 1},
+    }
+    if s.parent_id:
+        otlp["parentSpanId"] = s.parent_id
+    return otlp
+
+
+def write_trace(path, service_name="open-talos-hetzner-builder"):
+    """Write all finished spans as an OTLP/JSON trace file"""
+    trace = {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]},
+            "scopeSpans": [{
+                "scope": {"name": "tracing"},
+                "spans": [_otlp_span(s) for s in sorted(finished_spans(), key=lambda s: s.start_ns)],
+            }],
+        }]
+    }
+    with open(path, "w") as f:
+        json.dump(trace, f, indent=2)
+    print(f"✓ Trace written to {path}")
@@ -0,0 +1,151 @@
+"""
+Per node kubelet and kernel tuning for metal workers
+
+Derives max-pods, reserved CPU/memory, CPU and topology manager policies,
+hugepages and sysctls from the hardware recorded in discovery/<ip>.yaml
+(see `install-talos-metal.py --inventory`). Nodes without hardware data get
+the values the static worker patches used to set (max-pods 250, 1024
+hugepages) and no reservations; CPU and topology manager overrides still
+apply to them, with the static CPU manager's reserved cores and IRQ
+affinity rendered together.
+
+The static CPU manager is never derived, it is opt-in: kubelet refuses to
+start when its cpu_manager_state was written under another policy, so the
+policy of a running node must not change with a re-render.
+
+Overrides come from cluster_config.yaml and apply on top of the derived
+values, first `defaults` then the node's pool (pools are assigned in
+cluster_nodes_index.yaml):
+
+    worker-tuning:
+        defaults:
+            hugepages-percent: 2
+        pools:
+            db:
+                max-pods: 110
+                cpu-manager: static
+                topology-manager: single-numa-node
+"""
+
+# used when a node has no hardware inventory
+FALLBACK_TUNING = {
+    'max-pods': 250,
+    'hugepages': 1024,
+    'cpu-manager': 'none',
+    'topology-manager': 'none',
+    'sysctls': {},
+}
+
+# node pod CIDRs are /24, so more than ~250 pods cannot get addresses
+MAX_PODS_LIMIT = 250
+PODS_PER_THREAD = 10
+# Longhorn's V2 data engine needs 1024 x 2MiB hugepages
+MIN_HUGEPAGES = 1024
+HUGEPAGE_MB = 2
+
+
+def reserved_cpu_millicores(threads):
+    """CPU kept for kubelet and system daemons: 6% of the first core, 1% of the next,
+    0.5% of the next two and 0.25% of every further core (the GKE/AKS scale)"""
+    millicores = 60
+    if threads > 1:
+        millicores += 10
+    if threads > 2:
+        millicores += 5 * (min(threads, 4) - 2)
+    if threads > 4:
+        millicores += 2.5 * (threads - 4)
+    return int(millicores)
+
+
+def reserved_memory_mb(memory_mb):
+    """Memory kept for kubelet and system daemons: 25% of the first 4GB, 20% of the next 4GB,
+    10% of the next 8GB, 6% of the next 112GB and 2% of the rest"""
+    reserved = 0
+    remaining = memory_mb
+    for size_mb, fraction in ((4096, 0.25), (4096, 0.20), (8192, 0.10), (114688, 0.06), (None, 0.02)):
+        part = remaining if size_mb is None else min(remaining, size_mb)
+        reserved += part * fraction
+        remaining -= part
+        if remaining <= 0:
+            break
+    return int(reserved)
+
+
+def derive_tuning(hardware):
+    """Tuning values for one node class, from its discovery `hardware` section"""
+    if not hardware:
+        return dict(FALLBACK_TUNING)
+
+    threads = hardware['cpu']['threads'] or hardware['cpu']['cores']
+    memory_mb = hardware['memory_mb']
+    numa_nodes = max(len(hardware.get('numa_nodes', [])), 1)
+    nic_speed = max([nic['speed_mbps'] for nic in hardware.get('nics', [])] or [0])
+
+    # with the (opt-in) static CPU manager: the cores kept for the system, they also take the device IRQs
+    reserved_cpus = 2 if threads <= 32 else 4
+
+    sysctls = {
+        'fs.inotify.max_user_watches': 1048576,
+        'fs.inotify.max_user_instances': 8192,
+        'vm.max_map_count': 262144,
+        'net.core.somaxconn': 32768,
+        'kernel.pid_max': 4194304,
+    }
+    if nic_speed >= 10000:
+        sysctls.update({
+            'net.core.netdev_max_backlog': 250000,
+            'net.core.rmem_max': 67108864,
+            'net.core.wmem_max': 67108864,
+            'net.ipv4.tcp_rmem': "4096 87380 33554432",
+            'net.ipv4.tcp_wmem': "4096 65536 33554432",
+        })
+
+    return {
+        'max-pods': max(min(threads * PODS_PER_THREAD, MAX_PODS_LIMIT), 110),
+        'kube-reserved-cpu': f"{reserved_cpu_millicores(threads)}m",
+        'kube-reserved-memory': f"{reserved_memory_mb(memory_mb)}Mi",
+        'system-reserved-cpu': "500m",
+        'system-reserved-memory': "1Gi",
+        'eviction-hard-memory': "500Mi",
+        'cpu-manager': 'none',
+        'reserved-cpus': reserved_cpus,
+        'topology-manager': 'best-effort' if numa_nodes > 1 else 'none',
+        'hugepages-percent': 2,
+        'sysctls': sysctls,
+        'memory_mb': memory_mb,
+    }
+
+
+def cpu_manager_policy(machine_config):
+    """kubelet cpuManagerPolicy of a parsed machine config (document or patch), 'none' when unset"""
+    kubelet = ((machine_config or {}).get('machine') or {}).get('kubelet') or {}
+    return (kubelet.get('extraConfig') or {}).get('cpuManagerPolicy') or 'none'
+
+
+def node_pool(nodes_index_config, node_index):
+    """Name of the pool node_index is assigned to in cluster_nodes_index.yaml, or None"""
+    for pool, indexes in (nodes_index_config.get('pools') or {}).items():
+        if node_index in [int(i) for i in indexes]:
+            return pool
+    return None
+
+
+def worker_tuning(hardware, tuning_config, pool=None):
+    """Final tuning values for one node: derived defaults, then `defaults`, then the pool's overrides"""
+    tuning = derive_tuning(hardware)
+    tuning_config = tuning_config or {}
+    for overrides in (tuning_config.get('defaults'), (tuning_config.get('pools') or {}).get(pool)):
+        for key, value in (overrides or {}).items():
+            if key == 'sysctls':
+                tuning['sysctls'] = (tuning.get('sysctls') or {}) | value
+            else:
+                tuning[key] = value
+
+    # hugepages: explicit page count wins, else a share of RAM but at least what Longhorn V2 needs
+    if 'hugepages' not in tuning and tuning.get('memory_mb'):
+        by_ram = tuning['memory_mb'] * tuning.get('hugepages-percent', 0) // 100 // HUGEPAGE_MB
+        tuning['hugepages'] = max(by_ram, MIN_HUGEPAGES)
+
+    if tuning.get('cpu-manager') == 'static':
+        tuning['reserved-cpu-list'] = f"0-{int(tuning.get('reserved-cpus', 2)) - 1}"
+    return tuning